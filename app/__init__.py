@@ -1,25 +1,92 @@
 # app/__init__.py
+import multiprocessing
 import os
-from flask import Flask, send_from_directory
+import threading
+from flask import Flask
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 
+from .static_assets import build_manifest, serve_asset
+
 db = SQLAlchemy()
 
+_schema_lock = threading.Lock()
+_schema_ready = False
+
 class SharedLink(db.Model):
     __tablename__ = 'shared_links'
     id = db.Column(db.String(16), primary_key=True)
     offers_json = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    created_at = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+    # Lifecycle (see app/services/share_lifecycle.py). NULL expires_at marks links created before expiry existed.
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    last_accessed_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f'<SharedLink {self.id}>'
 
+def _shared_links_layout():
+    inspector = db.inspect(db.engine)
+    columns = {c['name'] for c in inspector.get_columns('shared_links')}
+    indexes = {i['name'] for i in inspector.get_indexes('shared_links')}
+    return columns, indexes
+
+def _upgrade_shared_links_table():
+    """
+    Adds lifecycle columns and indexes that db.create_all() won't add to an existing table.
+    Every worker runs this at boot, so another one may apply a statement first: a failed
+    statement is fine if re-inspecting shows its column or index now exists.
+    """
+    columns, indexes = _shared_links_layout()
+    statements = []
+    for column in ('expires_at', 'last_accessed_at'):
+        if column not in columns:
+            statements.append((column, None, f"ALTER TABLE shared_links ADD COLUMN {column} DATETIME NULL"))
+    for column in ('created_at', 'expires_at'):
+        index = f'ix_shared_links_{column}'
+        if index not in indexes:
+            statements.append((None, index, f"CREATE INDEX {index} ON shared_links ({column})"))
+    for column, index, statement in statements:
+        print(f"Flask __init__: Upgrading schema: {statement}")
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(db.text(statement))
+        except Exception as e:
+            columns, indexes = _shared_links_layout()
+            if column in columns or index in indexes:
+                print(f"Flask __init__: Schema change already applied by another worker: {statement}")
+                continue
+            raise
+
+def ensure_schema():
+    """
+    Creates the database tables once per process. Must be called inside an app context.
+    After the first successful check this is a plain flag lookup, so routes can call it on every request.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return True
+    with _schema_lock:
+        if _schema_ready:
+            return True
+        print("Flask __init__: Attempting db.create_all()...")
+        try:
+            db.create_all()
+            _upgrade_shared_links_table()
+            _schema_ready = True
+            print("Flask __init__: Database tables checked/created successfully.")
+        except Exception as e:
+            print(f"Flask __init__: Error during db.create_all(): {e}")
+            # This is important to see if DB connection fails
+    return _schema_ready
+
 def create_app():
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
     dotenv_path = os.path.join(project_root, '.env')
-    if os.path.exists(dotenv_path):
+    if os.environ.get('SKIP_DOTENV', 'false').lower() == 'true':
+        print("Flask __init__: SKIP_DOTENV set, not loading .env.") # e.g. benchmarks that must stay offline
+    elif os.path.exists(dotenv_path):
         print(f"Flask __init__: Loading .env file from {dotenv_path}")
         load_dotenv(dotenv_path)
     else:
@@ -58,27 +125,94 @@ def create_app():
 
     print(f"Flask __init__: SQLALCHEMY_DATABASE_URI set to: {app.config['SQLALCHEMY_DATABASE_URI']}")
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['LAZY_STARTUP'] = os.environ.get('LAZY_STARTUP', 'false').lower() == 'true'
+    app.config['WARMUP_ON_BOOT'] = os.environ.get('WARMUP_ON_BOOT', 'false').lower() == 'true'
+    app.config['WARMUP_TIMEOUT_SECONDS'] = float(os.environ.get('WARMUP_TIMEOUT_SECONDS', '5'))
+    # Spawned helper processes (the parse pool, app/services/parse_pool.py) re-import the main
+    # module, e.g. run.py, which calls create_app() again. They only need the parsers, so they
+    # skip every boot step below: no manifest, schema check, background jobs or warm-up.
+    # (parent_process() isn't set yet while the main module is re-imported; the name already is.
+    # Gunicorn workers are plain forks and keep "MainProcess".)
+    boot = multiprocessing.current_process().name == 'MainProcess'
 
     db.init_app(app)
 
     from .routes import main_routes
     app.register_blueprint(main_routes)
 
+    # The React build is served from an in-memory manifest (see app/static_assets.py).
+    # Built at boot, or on the first page request in lazy mode.
+    manifest_lock = threading.Lock()
+    if boot and not app.config['LAZY_STARTUP']:
+        app.extensions['static_manifest'] = build_manifest(app.static_folder)
+
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
     def serve(path):
-        if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-            return send_from_directory(app.static_folder, path)
-        else:
-            return send_from_directory(app.static_folder, 'index.html')
+        manifest = app.extensions.get('static_manifest')
+        if manifest is None:
+            with manifest_lock:
+                manifest = app.extensions.get('static_manifest')
+                if manifest is None:
+                    manifest = app.extensions['static_manifest'] = build_manifest(app.static_folder)
+        return serve_asset(manifest, path)
 
-    with app.app_context():
-        print("Flask __init__: Attempting db.create_all()...")
-        try:
-            db.create_all()
-            print("Flask __init__: Database tables checked/created successfully.")
-        except Exception as e:
-            print(f"Flask __init__: Error during db.create_all(): {e}")
-            # This is important to see if DB connection fails
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Explicit migrate step: create the database tables."""
+        if not ensure_schema():
+            raise SystemExit(1)
+
+    # In lazy mode the schema check is deferred to the first request that touches the database
+    # (or to `flask init-db` during deploys), so worker boot does no database round-trips.
+    if boot and not app.config['LAZY_STARTUP']:
+        with app.app_context():
+            ensure_schema()
+
+    # Share-link lifecycle: batched last-access writes and purging of expired links.
+    from app.services import share_lifecycle
+    if boot and share_lifecycle.SHARE_LIFECYCLE_ENABLED:
+        share_lifecycle.start_background_job(app)
+
+    # Background warmer for the most searched addresses (app/services/cache_warmer.py).
+    from app.services import cache_warmer
+    if boot and cache_warmer.CACHE_WARMER_ENABLED:
+        cache_warmer.start_background_job()
+
+    # Write-behind share creation: this worker's journal flusher (app/services/share_journal.py).
+    from app.services import share_journal
+    if boot and share_journal.SHARE_WRITE_BEHIND_ENABLED:
+        share_journal.start_background_job(app)
+
+    # Process-pool parsing of large provider responses (app/services/parse_pool.py), warmed in the background.
+    from app.services import parse_pool
+    if boot and parse_pool.PARSE_POOL_ENABLED:
+        threading.Thread(target=parse_pool.start, name="parse-pool-warmup", daemon=True).start()
+
+    @app.cli.command('purge-shares')
+    def purge_shares_command():
+        """Deletes expired share links now."""
+        if ensure_schema():
+            print(f"Purged {share_lifecycle.purge_expired()} share link(s).")
+
+    @app.cli.command('flush-shares')
+    def flush_shares_command():
+        """Moves share links waiting in the write-behind journal into the database now."""
+        if ensure_schema():
+            print(f"Flushed {share_journal.flush()} journaled share link(s).")
+
+    # Optional warm-up: the worker only reports ready on /api/health once pooled provider
+    # connections are open and the parsers have run once, so its first search costs the
+    # same as any later one. Runs per worker process; don't combine with gunicorn --preload.
+    app.extensions['warmup'] = {'ready': not (boot and app.config['WARMUP_ON_BOOT']), 'report': None}
+    if boot and app.config['WARMUP_ON_BOOT']:
+        def _run_warmup():
+            from app.services.warmup import warm_up
+            try:
+                app.extensions['warmup']['report'] = warm_up(app.config['WARMUP_TIMEOUT_SECONDS'])
+            except Exception as e:
+                print(f"Flask __init__: Warm-up failed: {e}")
+            app.extensions['warmup']['ready'] = True
+        threading.Thread(target=_run_warmup, name="worker-warmup", daemon=True).start()
 
     return app
\ No newline at end of file
@@ -1,19 +1,24 @@
 
-from flask import Blueprint, jsonify, request
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Response, jsonify, request, current_app
 import time
-from app.services.ping_perfect_client import fetch_ping_perfect_offers
-from app.services.servus_speed_client import get_servus_offers 
-from app.services.byteme_client import get_byteme_offers 
-from app.services.verbyndich_client import fetch_verbyndich_offers
-from app.services.webwunder_client import fetch_webwunder_offers
 import uuid
 import json
-from app import db, SharedLink 
+from datetime import datetime, timezone
+from app import db, SharedLink, ensure_schema
+from app.services.aggregator import BATCH_MAX_ADDRESSES, aggregate_batch, aggregate_offers_admitted
+from app.services import availability, cache_warmer, metrics, offer_history, prefetch, profiling, result_sets, share_journal, share_lifecycle, wire_format
+from app.services.address import canonicalize_address
+from app.services.admission import AdmissionRejected
 
 main_routes = Blueprint('main_routes', __name__)
 
+REQUIRED_ADDRESS_FIELDS = ["strasse", "hausnummer", "postleitzahl", "stadt"]
+
+def _is_valid_address(address_payload):
+    return isinstance(address_payload, dict) and all(k in address_payload for k in REQUIRED_ADDRESS_FIELDS)
+
 @main_routes.route("/api/offers", methods=["POST"])
+@profiling.profiled("offers")
 def get_offers_route(): 
     print(f"--- API Route: /api/offers POST request received at {time.strftime('%H:%M:%S')} ---")
     
@@ -22,73 +27,268 @@ def get_offers_route():
         return jsonify({"error": "Request must be JSON"}), 400
     
     address_payload = request.get_json()
-    if not isinstance(address_payload, dict) or not all(k in address_payload for k in ["strasse", "hausnummer", "postleitzahl", "stadt"]):
+    if not _is_valid_address(address_payload):
         print(f"API Route ERROR: Invalid address payload. Received: {address_payload}")
         return jsonify({"error": "Invalid address payload structure or missing required fields."}), 400
 
     print(f"API Route: Processing address: {address_payload}")
-    all_offers_aggregated = []
-    
-    # Define tasks for each provider
-    # For WebWunder, we need to call it for multiple connection types
-    tasks_to_submit = []
-
-    # Servus Speed
-    tasks_to_submit.append({"name": "ServusSpeed", "func": get_servus_offers, "args": (address_payload,)})
-    # ByteMe
-    tasks_to_submit.append({"name": "ByteMe", "func": get_byteme_offers, "args": (address_payload,)})
-    # Ping Perfect 
-    tasks_to_submit.append({"name": "PingPerfect", "func": fetch_ping_perfect_offers, "args": (address_payload, True)})
-    # VerbynDich
-    tasks_to_submit.append({"name": "VerbynDich", "func": fetch_verbyndich_offers, "args": (address_payload,)})
-    
-    # WebWunder - create tasks for each connection type
-    webwunder_conn_types = ["DSL", "CABLE", "FIBER"] # "MOBILE" often has no address check
-    for conn_type in webwunder_conn_types:
-        tasks_to_submit.append({
-            "name": f"WebWunder-{conn_type}", 
-            "func": fetch_webwunder_offers, 
-            "args": (address_payload, conn_type, True) # address, conn_type, installation
-        })
-
-    
-    OVERALL_FETCH_TIMEOUT_SECONDS = 20
-
-    with ThreadPoolExecutor(max_workers=len(tasks_to_submit) or 1) as executor:
-        future_to_task = {
-            executor.submit(task["func"], *task["args"]): task 
-            for task in tasks_to_submit
-        }
-        
-        # print(f"API Route: Submitted {len(future_to_task)} tasks to thread pool.")
-
-        for future in as_completed(future_to_task):
-            task_info = future_to_task[future]
-            provider_name_for_log = task_info["name"]
-            try:
-                # Individual task timeout (future.result(timeout))
-                # This ensures one very slow provider doesn't block indefinitely
-                # even if its internal HTTP timeouts fail.
-                # It needs to be less than OVERALL_FETCH_TIMEOUT_SECONDS
-                provider_offers_list = future.result(timeout=35) 
-                
-                if isinstance(provider_offers_list, list) and provider_offers_list:
-                    all_offers_aggregated.extend(provider_offers_list)
-                    # print(f"API Route INFO: Added {len(provider_offers_list)} offers from {provider_name_for_log}.")
-                elif isinstance(provider_offers_list, list): # Empty list returned
-                    print(f"API Route INFO: No offers returned from {provider_name_for_log} (empty list).")
-                else: # Should not happen if clients return [] on error
-                    print(f"API Route WARNING: {provider_name_for_log} returned non-list: {type(provider_offers_list)}")
-            
-            except TimeoutError: # This is for future.result(timeout=X)
-                 print(f"API Route ERROR: Fetching from {provider_name_for_log} with future.result() timed out after 35s.")
-            except Exception as exc:
-                print(f"API Route ERROR: {provider_name_for_log} client generated an exception: {exc}")
-                import traceback
-                traceback.print_exc() # Log full traceback for debugging
+    cache_warmer.record_search(address_payload)
+    prefetch.note_search(address_payload)
+    try:
+        result = aggregate_offers_admitted(address_payload)
+    except AdmissionRejected as e:
+        return _busy_response(e)
+    all_offers_aggregated = result["offers"]
+    with profiling.span("offers.save_result_set"):
+        result_set_id = result_sets.save(address_payload, result)
 
     print(f"API Route: Total combined offers returned: {len(all_offers_aggregated)}. Sending response at {time.strftime('%H:%M:%S')}.")
-    return jsonify(all_offers_aggregated)
+    with profiling.span("offers.serialize", offers=len(all_offers_aggregated)):
+        envelope = None
+        if request.args.get("envelope") == "true":
+            envelope = {"resultSetId": result_set_id, "providers": result["providers"], "stale": result["stale"]}
+        response = _offers_response(all_offers_aggregated, envelope)
+    _set_result_headers(response, result_set_id, result["providers"], result["stale"])
+    return response
+
+
+@main_routes.route("/api/prefetch", methods=["POST"])
+def prefetch_route():
+    """
+    Speculatively starts the provider calls for an address the user is still entering (see
+    app/services/prefetch.py). Body: the address fields, plus optionally "replaces": the id of
+    this form's previous prefetch, which is cancelled. Returns 202 {"prefetchId", "started"}.
+    """
+    payload = request.get_json(silent=True)
+    if not _is_valid_address(payload):
+        return jsonify({"error": "Invalid address payload structure or missing required fields."}), 400
+    address_payload = {k: v for k, v in payload.items() if k != "replaces"}
+    try:
+        result = prefetch.start(address_payload, replaces=payload.get("replaces"), client=request.remote_addr)
+    except AdmissionRejected as e:
+        return _busy_response(e)
+    if result is None:
+        return jsonify({"prefetchId": None, "started": 0}), 202 # skipped; the search just runs normally
+    print(f"API Route INFO: Prefetch {result['prefetchId']} started {result['started']} provider call(s).")
+    return jsonify(result), 202
+
+
+def _offers_response(offers, envelope=None):
+    """
+    The offers as JSON, or inside `envelope` when given. ?fields=a,b projects each offer to those
+    fields; ?format=compact streams the columnar format of app/services/wire_format.py instead.
+    """
+    fields = wire_format.parse_fields(request.args.get("fields"))
+    if request.args.get("format") == "compact":
+        return Response(wire_format.iter_columnar(offers, fields, envelope), mimetype="application/json")
+    offers = wire_format.project(offers, fields)
+    if envelope is not None:
+        return jsonify({**envelope, "offers": offers})
+    return jsonify(offers)
+
+
+def _busy_response(rejection):
+    # Shed load quickly instead of letting every search in the worker slow down.
+    print(f"API Route WARNING: Search not admitted ({rejection.reason}), retry after {rejection.retry_after_seconds}s.")
+    response = jsonify({"error": "Server is busy, please retry shortly.", "reason": rejection.reason})
+    response.headers["Retry-After"] = str(rejection.retry_after_seconds)
+    return response, rejection.status_code
+
+
+def _set_result_headers(response, result_set_id, providers, stale):
+    if result_set_id:
+        response.headers["X-Result-Set-Id"] = result_set_id
+    failed = [name for name, status in providers.items() if status["status"] in result_sets.RETRYABLE_STATUSES]
+    if failed:
+        # POST /api/offers/<result set id>/retry re-runs just these.
+        response.headers["X-Failed-Providers"] = ",".join(failed)
+    if stale:
+        # Some providers were served from stale cache entries (offers carry "_stale": true)
+        response.headers["X-Offers-Stale"] = "true"
+
+
+@main_routes.route("/api/offers/<result_set_id>/retry", methods=["POST"])
+@profiling.profiled("offers.retry")
+def retry_failed_providers(result_set_id):
+    """
+    Re-runs only the provider tasks of a stored result set that failed or timed out, merges
+    their offers into it and returns {"resultSetId", "offers", "providers", "stale"}.
+    """
+    print(f"--- API Route: /api/offers/{result_set_id}/retry POST request received at {time.strftime('%H:%M:%S')} ---")
+    result_set = result_sets.load(result_set_id)
+    if result_set is None:
+        return jsonify({"error": "Result set not found or expired"}), 404
+
+    failed = result_sets.failed_tasks(result_set)
+    if failed:
+        print(f"API Route: Retrying {len(failed)} provider task(s): {', '.join(failed)}")
+        try:
+            result = aggregate_offers_admitted(result_set["address"], only=set(failed))
+        except AdmissionRejected as e:
+            return _busy_response(e)
+        # If the stored set can't be updated (locked file, expired meanwhile), still answer with the retried tasks.
+        result_set = result_sets.merge(result_set_id, result) or result_sets.merge_tasks(result_set, result)
+        metrics.increment("result_sets.tasks_retried", len(failed))
+
+    providers = result_sets.providers_of(result_set)
+    response = _offers_response(
+        result_sets.offers_of(result_set),
+        {"resultSetId": result_set_id, "providers": providers, "stale": result_set["stale"]}
+    )
+    _set_result_headers(response, result_set_id, providers, result_set["stale"])
+    return response
+
+
+@main_routes.route("/api/offers/batch", methods=["POST"])
+def get_offers_batch_route():
+    """
+    Offers for many addresses in one request. Body: {"addresses": [address, ...]} (or a bare list).
+    Streams one NDJSON line per address as soon as it completes, in completion order:
+    {"index": i, "offers": [...], "providers": {...}, "stale": bool} or {"index": i, "error": "..."}.
+    """
+    print(f"--- API Route: /api/offers/batch POST request received at {time.strftime('%H:%M:%S')} ---")
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    payload = request.get_json()
+    addresses = payload.get("addresses") if isinstance(payload, dict) else payload
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({"error": "Payload must contain a non-empty list of addresses"}), 400
+    if len(addresses) > BATCH_MAX_ADDRESSES:
+        return jsonify({"error": f"At most {BATCH_MAX_ADDRESSES} addresses per batch"}), 413
+
+    valid = [(i, a) for i, a in enumerate(addresses) if _is_valid_address(a)]
+    invalid_indexes = [i for i, a in enumerate(addresses) if not _is_valid_address(a)]
+    print(f"API Route: Batch of {len(addresses)} addresses ({len(invalid_indexes)} invalid).")
+
+    def generate():
+        for i in invalid_indexes:
+            yield json.dumps({"index": i, "error": "Invalid address payload structure or missing required fields."}) + "\n"
+        completed = 0
+        for position, result in aggregate_batch([a for _, a in valid]):
+            completed += 1
+            line = {"index": valid[position][0], "offers": result["offers"], "providers": result["providers"], "stale": result["stale"]}
+            yield json.dumps(line) + "\n"
+        print(f"API Route: Batch finished, {completed} addresses streamed at {time.strftime('%H:%M:%S')}.")
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@main_routes.route('/api/health', methods=['GET'])
+def health_check():
+    # Readiness probe: 503 until the optional boot warm-up has finished.
+    warmup_state = current_app.extensions.get('warmup', {'ready': True, 'report': None})
+    status_code = 200 if warmup_state['ready'] else 503
+    return jsonify({"ready": warmup_state['ready'], "warmup": warmup_state['report']}), status_code
+
+
+@main_routes.route('/api/metrics', methods=['GET'])
+def metrics_snapshot():
+    # Per-worker counters, gauges and latency summaries.
+    return jsonify(metrics.snapshot()), 200
+
+
+def _profiles_admin_error():
+    if not profiling.PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    if not profiling.admin_token_ok(request.headers):
+        return jsonify({"error": "Missing or invalid X-Admin-Token"}), 403
+    return None
+
+
+@main_routes.route('/api/admin/profiles', methods=['GET'])
+def list_request_profiles():
+    # Summaries of the profiles in this worker's ring buffer, newest first.
+    error = _profiles_admin_error()
+    if error:
+        return error
+    return jsonify({"profiles": profiling.list_profiles()}), 200
+
+
+@main_routes.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def download_request_profile(profile_id):
+    # Full timeline (and CPU samples) as a JSON download; ?format=collapsed gives the CPU stacks for flame graph tools.
+    error = _profiles_admin_error()
+    if error:
+        return error
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found (it may have been evicted)"}), 404
+    if request.args.get("format") == "collapsed":
+        if profile.cpu_samples is None:
+            return jsonify({"error": "Profile has no CPU samples; request it with X-Profile: cpu"}), 404
+        response = Response(profile.collapsed_stacks(), mimetype="text/plain")
+        filename = f"profile-{profile_id}.collapsed.txt"
+    else:
+        response = jsonify(profile.to_dict())
+        filename = f"profile-{profile_id}.json"
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@main_routes.route('/api/availability/<plz>', methods=['GET'])
+def availability_summary(plz):
+    # Which provider tasks have returned offers for searches in this postleitzahl.
+    try:
+        return jsonify({"plz": plz, "providers": availability.summary_for_plz(plz)}), 200
+    except Exception as e:
+        print(f"API Route ERROR reading availability for PLZ {plz}: {e}")
+        return jsonify({"error": "Failed to read availability summary", "details": str(e)}), 500
+
+
+def _history_address_key():
+    # The address comes as query parameters (strasse, hausnummer, postleitzahl, stadt).
+    address_payload = {field: request.args.get(field) for field in REQUIRED_ADDRESS_FIELDS}
+    if not all(address_payload.values()):
+        return None
+    return canonicalize_address(address_payload)[1]
+
+
+def _parse_timestamp(value):
+    """Epoch seconds or an ISO 8601 timestamp (UTC if no offset is given); None if invalid."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+@main_routes.route('/api/history/offers', methods=['GET'])
+def offer_history_at():
+    # Offers per provider task as they were at ?at= (default: now), keyed by offer fingerprint.
+    address_key = _history_address_key()
+    if address_key is None:
+        return jsonify({"error": f"Query parameters {', '.join(REQUIRED_ADDRESS_FIELDS)} are required"}), 400
+    at = request.args.get("at")
+    at_ts = _parse_timestamp(at) if at else None
+    if at and at_ts is None:
+        return jsonify({"error": "at must be epoch seconds or an ISO 8601 timestamp"}), 400
+    try:
+        return jsonify({"at": time.time() if at_ts is None else at_ts, "tasks": offer_history.offers_at(address_key, at_ts)}), 200
+    except Exception as e:
+        print(f"API Route ERROR reading offer history: {e}")
+        return jsonify({"error": "Failed to read offer history", "details": str(e)}), 500
+
+
+@main_routes.route('/api/history/changes', methods=['GET'])
+def offer_history_changes():
+    # Offer changes recorded for the address after ?since= (default: all), oldest first.
+    address_key = _history_address_key()
+    if address_key is None:
+        return jsonify({"error": f"Query parameters {', '.join(REQUIRED_ADDRESS_FIELDS)} are required"}), 400
+    since = _parse_timestamp(request.args.get("since", "0"))
+    if since is None:
+        return jsonify({"error": "since must be epoch seconds or an ISO 8601 timestamp"}), 400
+    try:
+        return jsonify({"since": since, "changes": offer_history.changes_since(address_key, since)}), 200
+    except Exception as e:
+        print(f"API Route ERROR reading offer history: {e}")
+        return jsonify({"error": "Failed to read offer history", "details": str(e)}), 500
 
 
 @main_routes.route('/api/share', methods=['POST'])
@@ -102,14 +302,27 @@ def create_share_link():
         return jsonify({"error": "Payload must be a list of offers"}), 400
     if not offers_data:
         return jsonify({"error": "Cannot share an empty list of offers"}), 400
+    # Optional ?ttlDays=N; clamped to SHARE_LINK_MAX_TTL_DAYS.
+    ttl_days = request.args.get("ttlDays")
+    if ttl_days is not None and (not ttl_days.isdigit() or int(ttl_days) < 1):
+        return jsonify({"error": "ttlDays must be a positive integer"}), 400
     try:
         share_id = uuid.uuid4().hex[:10] 
         offers_json_string = json.dumps(offers_data)
-        new_shared_link = SharedLink(id=share_id, offers_json=offers_json_string)
-        db.session.add(new_shared_link)
-        db.session.commit()
+        expires_at = share_lifecycle.expiry_for(ttl_days)
+        if share_journal.SHARE_WRITE_BEHIND_ENABLED:
+            # Acknowledged once the journal line is on disk; the flusher inserts it in a batch.
+            share_journal.append(share_id, offers_json_string, share_lifecycle.utcnow(), expires_at)
+        else:
+            ensure_schema()
+            new_shared_link = SharedLink(id=share_id, offers_json=offers_json_string, expires_at=expires_at)
+            db.session.add(new_shared_link)
+            db.session.commit()
         print(f"API Route INFO: Created share link ID: {share_id}")
-        return jsonify({"shareId": share_id, "message": "Share link created successfully"}), 201
+        return jsonify({
+            "shareId": share_id, "message": "Share link created successfully",
+            "expiresAt": expires_at.isoformat() + "Z"
+        }), 201
     except Exception as e:
         db.session.rollback()
         print(f"API Route ERROR creating share link: {e}")
@@ -122,12 +335,20 @@ def get_shared_link_data(share_id):
     print(f"--- API Route: /api/share/{share_id} GET request ---")
     if not share_id or len(share_id) > 16:
         return jsonify({"error": "Invalid share ID format"}), 400
+    ensure_schema()
+    started = time.monotonic()
     try:
-        shared_link_entry = SharedLink.query.get(share_id)
+        # Links still waiting in the write-behind journal first, then the database.
+        shared_link_entry = share_journal.get_pending(share_id) or SharedLink.query.get(share_id)
+        if shared_link_entry and share_lifecycle.is_expired(shared_link_entry):
+            print(f"API Route INFO: Share link {share_id} has expired.")
+            return jsonify({"error": "Share link has expired"}), 410
         if shared_link_entry:
             offers_data = json.loads(shared_link_entry.offers_json)
+            share_lifecycle.record_access(share_id)
+            metrics.observe("share.read_ms", (time.monotonic() - started) * 1000)
             print(f"API Route INFO: Retrieved shared data for ID: {share_id}")
-            return jsonify(offers_data), 200
+            return _offers_response(offers_data), 200
         else:
             print(f"API Route WARNING: Share link not found for ID: {share_id}")
             return jsonify({"error": "Share link not found"}), 404
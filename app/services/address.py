@@ -0,0 +1,101 @@
+# app/services/address.py
+import re
+import unicodedata
+from functools import lru_cache
+
+# Address canonicalization. Every search goes through canonicalize_address() before the cache
+# lookup, so "Musterstraße 10", "Musterstr. 10" and "musterstrasse  10 " share one cache key
+# and one set of in-flight provider calls, and every client receives the same cleaned payload.
+
+ADDRESS_FIELDS = ("strasse", "hausnummer", "postleitzahl", "stadt")
+
+_TRANSLITERATION = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+# Abbreviations in the street key (applied after case folding and transliteration).
+_STREET_KEY_RULES = [
+    (re.compile(r"str\b\.?"), "strasse"),
+    (re.compile(r"\bpl\b\.?"), "platz"),
+    (re.compile(r"\bst\.\s*"), "sankt "),
+    (re.compile(r"\bdr\.\s*"), "doktor "),
+    (re.compile(r"\bprof\.\s*"), "professor "),
+]
+# A trailing "Str."/"str" in the payload sent to providers.
+_STREET_DISPLAY_SUFFIX = re.compile(r"([Ss])tr\.?$")
+
+_CITY_KEY_RULES = [
+    (re.compile(r"\ba\.\s*d\.\s*"), "an der "),
+    (re.compile(r"\ba\.\s*"), "am "),
+    (re.compile(r"\bi\.\s*"), "im "),
+    (re.compile(r"\bb\.\s*"), "bei "),
+]
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_HOUSE_NUMBER_SUFFIX = re.compile(r"(?<=\d)[\s\-/]+(?=[a-z]\b)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _clean(value):
+    """NFKC-normalized text with runs of whitespace collapsed to one space."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", str(value or ""))).strip()
+
+
+def _fold(value):
+    return _clean(value).casefold().translate(_TRANSLITERATION)
+
+
+@lru_cache(maxsize=8192)
+def street_key(street):
+    folded = _fold(street)
+    for pattern, replacement in _STREET_KEY_RULES:
+        folded = pattern.sub(replacement, folded)
+    # Spaces and hyphens are spelling variants ("Dr.-Müller-Str." / "Doktor Müller Straße").
+    return _NON_ALNUM.sub("", folded)
+
+
+@lru_cache(maxsize=8192)
+def house_number_key(house_number):
+    folded = _HOUSE_NUMBER_SUFFIX.sub("", _fold(house_number)) # "10 a", "10-a" -> "10a"
+    return _WHITESPACE.sub("", folded)
+
+
+@lru_cache(maxsize=8192)
+def city_key(city):
+    folded = _fold(city)
+    for pattern, replacement in _CITY_KEY_RULES:
+        folded = pattern.sub(replacement, folded)
+    return _NON_ALNUM.sub("", folded)
+
+
+def canonical_plz(plz):
+    """Five-digit postleitzahl, restoring a leading zero lost in spreadsheets; None if it isn't one."""
+    digits = "".join(ch for ch in _clean(plz) if ch.isdigit())
+    if len(digits) == 4:
+        digits = "0" + digits
+    return digits if len(digits) == 5 else None
+
+
+def canonicalize_address(address_payload):
+    """
+    Returns (payload, address_key) for a search address.
+
+    payload is what the provider clients receive: whitespace trimmed and collapsed, Unicode
+    normalized, a trailing "Str." spelled out, the house-number suffix attached ("10 A" -> "10a")
+    and the postleitzahl as five digits. Other keys are passed through unchanged.
+
+    address_key is the cache/coalescing key: case-folded and transliterated with street
+    abbreviations expanded and separators dropped. A valid postleitzahl together with street
+    and house number identifies the address, so the city (which users spell in many ways) only
+    enters the key when the PLZ can't be used.
+    """
+    payload = dict(address_payload)
+    street = _clean(address_payload.get("strasse"))
+    payload["strasse"] = _STREET_DISPLAY_SUFFIX.sub(lambda m: m.group(1) + "traße", street)
+    payload["hausnummer"] = house_number_key(address_payload.get("hausnummer"))
+    plz = canonical_plz(address_payload.get("postleitzahl"))
+    payload["postleitzahl"] = plz or _clean(address_payload.get("postleitzahl"))
+    payload["stadt"] = _clean(address_payload.get("stadt"))
+
+    key_parts = [plz or "", street_key(street), payload["hausnummer"]]
+    if plz is None:
+        key_parts.append(city_key(payload["stadt"]))
+    return payload, "|".join(key_parts)
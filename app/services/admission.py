@@ -0,0 +1,101 @@
+# app/services/admission.py
+import math
+import os
+import threading
+import time
+
+from app.services import metrics, profiling
+
+# Admission control for searches that need cold provider calls ("fan-outs").
+# At most ADMISSION_MAX_CONCURRENT_FANOUTS run at once per worker. Others wait in a bounded queue
+# for up to ADMISSION_MAX_QUEUE_WAIT_SECONDS. When the queue is full the request is turned away
+# at once (429); when the wait runs out it gets a 503. Both carry a Retry-After estimate.
+# Searches answered from the cache or by joining in-flight calls don't go through here.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_CONCURRENT_FANOUTS = int(os.getenv("ADMISSION_MAX_CONCURRENT_FANOUTS", "16"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "32"))
+ADMISSION_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_SECONDS", "2"))
+
+# Smoothing factor for the running average fan-out duration used in Retry-After.
+_DURATION_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a fan-out isn't admitted. status_code is 429 (queue full) or 503 (waited too long)."""
+
+    def __init__(self, status_code, reason, retry_after_seconds):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_queued, max_queue_wait_seconds):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queue_wait_seconds = max_queue_wait_seconds
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._avg_duration = 5.0 # seconds; replaced by observed fan-out durations
+
+    def _retry_after_locked(self):
+        """Rough seconds until a slot frees up for a new arrival, at least 1."""
+        rounds = (self._waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(self._avg_duration * rounds))
+
+    def _publish_locked(self):
+        metrics.set_gauge("admission.active", self._active)
+        metrics.set_gauge("admission.waiting", self._waiting)
+
+    def acquire(self):
+        """Blocks until a fan-out slot is free, or raises AdmissionRejected."""
+        started = time.monotonic()
+        with self._condition:
+            if self._active >= self.max_concurrent and self._waiting >= self.max_queued:
+                metrics.increment("admission.rejected.queue_full")
+                raise AdmissionRejected(429, "queue_full", self._retry_after_locked())
+            if self._active >= self.max_concurrent:
+                self._waiting += 1
+                self._publish_locked()
+                deadline = started + self.max_queue_wait_seconds
+                try:
+                    while self._active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                if self._active >= self.max_concurrent:
+                    self._publish_locked()
+                    metrics.increment("admission.rejected.timeout")
+                    raise AdmissionRejected(503, "queue_timeout", self._retry_after_locked())
+            self._active += 1
+            self._publish_locked()
+        metrics.increment("admission.admitted")
+        metrics.observe("admission.queue_wait_ms", (time.monotonic() - started) * 1000)
+
+    def release(self, duration_seconds):
+        with self._condition:
+            self._active -= 1
+            self._avg_duration += _DURATION_EWMA_ALPHA * (duration_seconds - self._avg_duration)
+            self._publish_locked()
+            self._condition.notify()
+
+
+_controller = AdmissionController(ADMISSION_MAX_CONCURRENT_FANOUTS, ADMISSION_MAX_QUEUED, ADMISSION_MAX_QUEUE_WAIT_SECONDS)
+
+
+def run_admitted(func, *args):
+    """Runs func(*args) inside a fan-out slot; raises AdmissionRejected if none can be had in time."""
+    if not ADMISSION_ENABLED:
+        return func(*args)
+    with profiling.span("admission.acquire"):
+        _controller.acquire()
+    started = time.monotonic()
+    try:
+        return func(*args)
+    finally:
+        _controller.release(time.monotonic() - started)
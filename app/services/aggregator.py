@@ -0,0 +1,380 @@
+# app/services/aggregator.py
+from concurrent.futures import FIRST_COMPLETED, wait
+from collections import deque
+from functools import partial
+import os
+import threading
+import time
+import traceback
+import uuid
+
+from app.services import admission, availability, cache_warmer, metrics, offer_cache, offer_history, profiling, providers, rate_limit, upstream_payload
+from app.services.address import canonicalize_address
+from app.services.scheduler import get_scheduler
+
+# Upper bound on how long one search waits for the slowest provider task. Each task is also
+# bounded by its provider's timeout budget from the registry.
+PROVIDER_TASK_TIMEOUT_SECONDS = 35
+
+# --- Stale-While-Revalidate ---
+# Stale cache entries are served immediately while one background refresh per entry runs.
+# Refreshes are capped per worker so a burst of expiring entries can't stampede the providers.
+SWR_MAX_REFRESHES_PER_MINUTE = int(os.getenv("SWR_MAX_REFRESHES_PER_MINUTE", "30"))
+_SWR_REFRESH_LEASE_SECONDS = PROVIDER_TASK_TIMEOUT_SECONDS + 5
+_REFRESH_OWNER = "swr-refresh"
+
+_refresh_lock = threading.Lock()
+_recent_refresh_times = deque()
+
+# Cache lifetime for results a client marked partial (e.g. VerbynDich pagination stopped early).
+PARTIAL_RESULT_TTL_SECONDS = int(os.getenv("PARTIAL_RESULT_TTL_SECONDS", "60"))
+
+# --- Batch Settings ---
+# Addresses are started in a sliding window so a huge batch keeps a bounded amount of work queued.
+BATCH_MAX_ADDRESSES = int(os.getenv("BATCH_MAX_ADDRESSES", "5000"))
+BATCH_ADDRESSES_IN_FLIGHT = int(os.getenv("BATCH_ADDRESSES_IN_FLIGHT", "20"))
+BATCH_ADDRESS_TIMEOUT_SECONDS = int(os.getenv("BATCH_ADDRESS_TIMEOUT_SECONDS", "120"))
+
+# Identical provider calls (same task, same address) that are already running are shared:
+# cache_key -> Future. Lets concurrent searches and batch rows for one address share a fetch.
+_in_flight_lock = threading.Lock()
+_in_flight_tasks = {}
+
+metrics.register_derived(
+    "offer_cache.stale_serve_ratio",
+    lambda c: metrics.ratio(c, "offer_cache.lookups.stale",
+                            ["offer_cache.lookups.fresh", "offer_cache.lookups.stale", "offer_cache.lookups.miss"])
+)
+
+
+def build_provider_tasks(address_payload):
+    """Returns the provider calls for one search as {"name", "provider", "func", "args", "timeout"} dicts."""
+    return providers.build_tasks(address_payload)
+
+
+def _refresh_slot_available():
+    """Sliding one-minute window limiting how many background refreshes this worker starts."""
+    now = time.monotonic()
+    with _refresh_lock:
+        while _recent_refresh_times and now - _recent_refresh_times[0] > 60:
+            _recent_refresh_times.popleft()
+        if len(_recent_refresh_times) >= SWR_MAX_REFRESHES_PER_MINUTE:
+            return False
+        _recent_refresh_times.append(now)
+        return True
+
+
+def _on_task_done(task, cache_key, plz, future):
+    """Runs once per real upstream call: caches the result and updates the PLZ summary."""
+    with _in_flight_lock:
+        if _in_flight_tasks.get(cache_key) is future:
+            del _in_flight_tasks[cache_key]
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is not None:
+        print(f"Aggregator ERROR: {task['name']} client generated an exception: {exc}")
+        traceback.print_exception(type(exc), exc, exc.__traceback__) # Log full traceback for debugging
+        return
+    offers = future.result()
+    if isinstance(offers, list): # None means the client hit an error; never cache it
+        # Partial results (pagination stopped early) are only kept briefly so a refresh completes them.
+        ttl_seconds = PARTIAL_RESULT_TTL_SECONDS if getattr(offers, "partial", False) else None
+        offer_cache.put(cache_key, offers, ttl_seconds=ttl_seconds)
+        availability.record_result(plz, task["name"], len(offers))
+        offer_history.record(offer_cache.address_key_of(cache_key), task["name"], offers)
+
+
+def _submit_task(task, cache_key, plz, owner, lane="interactive"):
+    """Schedules a provider call in a scheduler lane, or joins an identical call that is already in flight."""
+    with _in_flight_lock:
+        future = _in_flight_tasks.get(cache_key)
+        if future is not None and not future.done():
+            metrics.increment("aggregator.tasks_coalesced")
+            # A search joining a queued background call for the same address must not wait behind its lane.
+            get_scheduler().promote(future, lane)
+            return future
+        future = get_scheduler().submit(task["provider"], task["func"], task["args"], owner=owner, lane=lane)
+        _in_flight_tasks[cache_key] = future
+    metrics.increment("aggregator.tasks_submitted")
+    future.add_done_callback(partial(_on_task_done, task, cache_key, plz))
+    return future
+
+
+def _on_refresh_done(future):
+    if not future.cancelled() and future.exception() is None and isinstance(future.result(), list):
+        metrics.increment("offer_cache.refreshes.succeeded")
+    else:
+        # Keep serving the stale entry; the lease expires and a later request retries.
+        metrics.increment("offer_cache.refreshes.failed")
+
+
+def _schedule_refresh(task, cache_key, plz):
+    if not _refresh_slot_available():
+        metrics.increment("offer_cache.refreshes.rate_limited")
+        return
+    if not offer_cache.try_acquire_refresh_lease(cache_key, _SWR_REFRESH_LEASE_SECONDS):
+        return # Another request or worker is already refreshing this entry
+    metrics.increment("offer_cache.refreshes.started")
+    _submit_task(task, cache_key, plz, owner=_REFRESH_OWNER, lane="refresh").add_done_callback(_on_refresh_done)
+
+
+def refresh_expiring(address_payload, refresh_before, max_calls, owner, lane="refresh"):
+    """
+    Starts upstream calls (at most max_calls) for the address's provider tasks whose cache entry
+    is missing or expires before `refresh_before` (epoch seconds); used by the cache warmer.
+    Returns [(cache_key, previous (expires_at, stale_until) or None, future)].
+    """
+    address_payload, address_key = canonicalize_address(address_payload)
+    plz = address_payload.get("postleitzahl")
+    started = []
+    for task in build_provider_tasks(address_payload):
+        if len(started) >= max_calls:
+            break
+        cache_key = offer_cache.provider_cache_key(task["name"], address_key)
+        times = offer_cache.entry_times(cache_key)
+        if times is not None and times[0] > refresh_before:
+            continue
+        if availability.should_skip(plz, task["name"]):
+            continue
+        # Only one worker refreshes an existing entry
+        if times is not None and not offer_cache.try_acquire_refresh_lease(cache_key, _SWR_REFRESH_LEASE_SECONDS):
+            continue
+        started.append((cache_key, times, _submit_task(task, cache_key, plz, owner, lane)))
+    return started
+
+
+def cancel_queued(calls):
+    """
+    Cancels background calls [(cache_key, future)] that haven't started and that no search has
+    joined (a search promotes a call it joins to the interactive lane), and releases their
+    refresh leases. Returns how many.
+    """
+    cancelled = []
+    with _in_flight_lock:
+        for cache_key, future in calls:
+            if get_scheduler().unqueue(future):
+                # No search can join it from here on
+                if _in_flight_tasks.get(cache_key) is future:
+                    del _in_flight_tasks[cache_key]
+                cancelled.append((cache_key, future))
+    for cache_key, future in cancelled: # outside the lock: done callbacks take it
+        future.cancel()
+        offer_cache.release_refresh_lease(cache_key)
+    return len(cancelled)
+
+
+def plan_aggregation(address_payload, owner=None, only=None, lane="interactive"):
+    """
+    First half of a search: resolves every provider task for the address from the shared
+    offer cache where possible and lists the rest under "to_submit" for submit_aggregation().
+    Entries past their TTL but inside the grace window are used at once (each offer marked
+    "_stale": True) and refreshed in the background. Tasks that the PLZ availability summary
+    shows to be reliably empty for this postleitzahl are skipped (apart from periodic re-probes).
+
+    :param owner: Scheduler fairness group; defaults to one group per search.
+    :param only: Optional set of task names to run (e.g. re-fetching the failed tasks of a result set).
+    :param lane: Scheduler priority lane of the upstream calls ("interactive", "refresh" or "batch").
+    :return: A pending-aggregation dict for submit_aggregation() and finish_aggregation().
+    """
+    # Spelling variants of one address share cache entries and in-flight calls, and every
+    # client gets the same cleaned payload.
+    address_payload, address_key = canonicalize_address(address_payload)
+    plz = address_payload.get("postleitzahl")
+    pending = {
+        "address": address_payload, "plz": plz, "owner": owner or uuid.uuid4().hex, "lane": lane,
+        "payload_accounting": upstream_payload.PayloadAccounting(),
+        "offers": [], "task_offers": {}, "providers": {}, "stale": False, "to_submit": [], "futures": {}
+    }
+
+    for task in build_provider_tasks(address_payload):
+        if only is not None and task["name"] not in only:
+            continue
+        cache_key = offer_cache.provider_cache_key(task["name"], address_key)
+        cached_offers, cache_state = offer_cache.lookup(cache_key)
+        metrics.increment(f"offer_cache.lookups.{cache_state}")
+        # A partial result stays retryable while cached; the retry itself fetches it again.
+        partial_hit = getattr(cached_offers, "partial", False)
+        if cache_state == "fresh" and not (partial_hit and only is not None):
+            if not cached_offers:
+                metrics.increment("offer_cache.negative_hits")
+            cache_warmer.note_fresh_hit(cache_key)
+            pending["offers"].extend(cached_offers)
+            pending["task_offers"][task["name"]] = cached_offers
+            pending["providers"][task["name"]] = {"status": "partial" if partial_hit else "cached", "count": len(cached_offers)}
+        elif cache_state == "stale":
+            for offer in cached_offers:
+                offer["_stale"] = True
+            pending["offers"].extend(cached_offers)
+            pending["task_offers"][task["name"]] = cached_offers
+            pending["providers"][task["name"]] = {"status": "stale", "count": len(cached_offers)}
+            pending["stale"] = True
+            _schedule_refresh(task, cache_key, plz)
+        elif availability.should_skip(plz, task["name"]):
+            metrics.increment("availability.tasks_skipped")
+            pending["providers"][task["name"]] = {"status": "skipped", "count": 0}
+        else:
+            pending["to_submit"].append((task, cache_key))
+    return pending
+
+
+def count_cold_tasks(pending):
+    """How many of the pending tasks would start a new upstream call (not cached, not already in flight)."""
+    with _in_flight_lock:
+        return sum(
+            1 for _, cache_key in pending["to_submit"]
+            if not (cache_key in _in_flight_tasks and not _in_flight_tasks[cache_key].done())
+        )
+
+
+def submit_aggregation(pending):
+    """Submits the tasks planned by plan_aggregation() to the provider scheduler (or joins identical in-flight calls)."""
+    # Upstream bytes read by these calls are charged to this search, and rate-limit waits end at the
+    # task's deadline in finish_aggregation() (the scheduler copies the context).
+    submitted_at = time.monotonic()
+    with upstream_payload.accounting(pending["payload_accounting"]):
+        for task, cache_key in pending["to_submit"]:
+            task_deadline = submitted_at + min(task.get("timeout", PROVIDER_TASK_TIMEOUT_SECONDS), PROVIDER_TASK_TIMEOUT_SECONDS)
+            with rate_limit.deadline(task_deadline):
+                pending["futures"][_submit_task(task, cache_key, pending["plz"], pending["owner"], pending["lane"])] = task
+    pending["to_submit"] = []
+    pending["submitted_at"] = submitted_at
+    if pending["futures"]:
+        print(f"Aggregator: {len(pending['providers'])} provider task(s) served from cache or skipped, fetching {len(pending['futures'])}.")
+    return pending
+
+
+def start_aggregation(address_payload, owner=None, lane="interactive"):
+    """plan_aggregation() followed by submit_aggregation()."""
+    return submit_aggregation(plan_aggregation(address_payload, owner=owner, lane=lane))
+
+
+def _collect_result(pending, future, task):
+    task_name = task["name"]
+    if future.cancelled() or future.exception() is not None:
+        pending["providers"][task_name] = {"status": "error", "count": 0}
+        return
+    provider_offers_list = future.result()
+    if isinstance(provider_offers_list, list):
+        # Copies, because coalesced callers receive the very same list object.
+        task_offers = pending["task_offers"][task_name] = [dict(offer) for offer in provider_offers_list]
+        pending["offers"].extend(task_offers)
+        if getattr(provider_offers_list, "partial", False):
+            status = "partial"
+        else:
+            status = "ok" if provider_offers_list else "empty"
+        pending["providers"][task_name] = {"status": status, "count": len(provider_offers_list)}
+        if not provider_offers_list:
+            print(f"Aggregator INFO: No offers returned from {task_name} (empty list).")
+    else:
+        print(f"Aggregator WARNING: {task_name} failed (returned {type(provider_offers_list).__name__}).")
+        pending["providers"][task_name] = {"status": "error", "count": 0}
+
+
+def finish_aggregation(pending, timeout=PROVIDER_TASK_TIMEOUT_SECONDS):
+    """
+    Second half of a search: waits for the submitted provider tasks and merges their offers.
+    Each task gets its provider's timeout budget (counted from submission, so time spent queued
+    behind the provider's bulkhead counts too), and the whole wait is capped at `timeout` seconds.
+    Tasks still running afterwards are reported as "timeout"; they keep running and still fill
+    the cache when they finish.
+
+    :return: {"offers": [...], "providers": {task_name: {"status": ..., "count": ...}}, "stale": bool,
+              "task_offers": {task_name: [...]}} where status is one of "cached", "stale", "skipped",
+             "ok", "partial", "empty", "error", "timeout". task_offers holds the same offers grouped by task.
+    """
+    future_to_task = pending["futures"]
+    submitted_at = pending.get("submitted_at", time.monotonic())
+    overall_deadline = time.monotonic() + timeout
+
+    def _deadline(future):
+        return min(overall_deadline, submitted_at + future_to_task[future].get("timeout", timeout))
+
+    # This ensures one very slow provider doesn't block the response indefinitely
+    # even if its internal HTTP timeouts fail.
+    remaining = set(future_to_task)
+    while remaining:
+        for future in [f for f in remaining if f.done()]:
+            remaining.discard(future)
+            _collect_result(pending, future, future_to_task[future])
+        now = time.monotonic()
+        for future in [f for f in remaining if _deadline(f) <= now]:
+            remaining.discard(future)
+            task = future_to_task[future]
+            print(f"Aggregator ERROR: Fetching from {task['name']} timed out after {round(now - submitted_at, 1)}s.")
+            metrics.increment(f"aggregator.timeouts.{task['provider']}")
+            pending["providers"][task["name"]] = {"status": "timeout", "count": 0}
+        if remaining:
+            next_deadline = min(_deadline(f) for f in remaining)
+            wait(remaining, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+    if future_to_task:
+        upstream_payload.report(pending["payload_accounting"])
+    return {
+        "offers": pending["offers"], "providers": pending["providers"], "stale": pending["stale"],
+        "task_offers": pending["task_offers"]
+    }
+
+
+def aggregate_offers(address_payload, owner=None):
+    """Fans out to every provider task for one address and merges the normalized offers."""
+    return finish_aggregation(start_aggregation(address_payload, owner=owner))
+
+
+def aggregate_offers_admitted(address_payload, owner=None, only=None):
+    """
+    aggregate_offers() for interactive searches under admission control. Searches that are
+    answered entirely from the cache or by joining calls already in flight are cheap and skip
+    the queue; only ones that start new upstream calls need a fan-out slot.
+
+    :raises admission.AdmissionRejected: When the worker is saturated.
+    """
+    with profiling.span("aggregate.plan"): # address canonicalization and cache lookups
+        pending = plan_aggregation(address_payload, owner=owner, only=only)
+    if count_cold_tasks(pending) == 0:
+        metrics.increment("admission.bypassed")
+        return _submit_and_finish(pending)
+    return admission.run_admitted(_submit_and_finish, pending)
+
+
+def _submit_and_finish(pending):
+    with profiling.span("aggregate.fanout", tasks=len(pending["to_submit"])):
+        return finish_aggregation(submit_aggregation(pending))
+
+
+def aggregate_batch(address_payloads, owner=None):
+    """
+    Generator for batch jobs: yields (index, result) per address as soon as that address is
+    complete, in completion order. All provider calls go through the shared scheduler's batch
+    lane under one owner, so per-provider caps hold across the whole batch, it interleaves
+    fairly with other batches and only uses capacity interactive searches leave spare; the
+    offer cache and in-flight coalescing are reused between addresses. At most BATCH_ADDRESSES_IN_FLIGHT addresses are outstanding at a time.
+    """
+    owner = owner or f"batch-{uuid.uuid4().hex}"
+    address_iter = iter(enumerate(address_payloads))
+    outstanding = {} # index -> (pending, deadline)
+
+    def _start_next():
+        try:
+            index, address_payload = next(address_iter)
+        except StopIteration:
+            return False
+        outstanding[index] = (start_aggregation(address_payload, owner=owner, lane="batch"), time.monotonic() + BATCH_ADDRESS_TIMEOUT_SECONDS)
+        return True
+
+    while len(outstanding) < BATCH_ADDRESSES_IN_FLIGHT and _start_next():
+        pass
+
+    while outstanding:
+        now = time.monotonic()
+        for index in sorted(outstanding):
+            pending, deadline = outstanding[index]
+            if all(f.done() for f in pending["futures"]) or deadline <= now:
+                del outstanding[index]
+                yield index, finish_aggregation(pending, timeout=0)
+                _start_next()
+        if not outstanding:
+            break
+        waiting_on = [f for pending, _ in outstanding.values() for f in pending["futures"] if not f.done()]
+        next_deadline = min(deadline for _, deadline in outstanding.values())
+        if waiting_on:
+            wait(waiting_on, timeout=max(0.0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
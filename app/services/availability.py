@@ -0,0 +1,117 @@
+# app/services/availability.py
+import os
+import sqlite3
+import threading
+import time
+
+from app.services.local_store import default_path, get_connection
+
+# Per-postleitzahl summary of which provider tasks (e.g. "WebWunder-FIBER") return offers.
+# When a task has come back empty for the last N searches in a PLZ we stop calling it there,
+# except for one re-probe every AVAILABILITY_REPROBE_SECONDS so the summary can recover.
+AVAILABILITY_PREDICTOR_ENABLED = os.getenv("AVAILABILITY_PREDICTOR_ENABLED", "true").lower() == "true"
+AVAILABILITY_DB_PATH = os.getenv("AVAILABILITY_DB_PATH", default_path("offer_cache.db"))
+AVAILABILITY_MIN_EMPTY_OBSERVATIONS = int(os.getenv("AVAILABILITY_MIN_EMPTY_OBSERVATIONS", "5"))
+AVAILABILITY_REPROBE_SECONDS = int(os.getenv("AVAILABILITY_REPROBE_SECONDS", str(6 * 3600)))
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def normalize_plz(plz):
+    return "".join(str(plz or "").split())
+
+
+def _connect():
+    global _schema_ready
+    conn = get_connection(AVAILABILITY_DB_PATH)
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS provider_availability ("
+                    " plz TEXT NOT NULL,"
+                    " task_name TEXT NOT NULL,"
+                    " observations INTEGER NOT NULL DEFAULT 0,"
+                    " empty_observations INTEGER NOT NULL DEFAULT 0,"
+                    " consecutive_empty INTEGER NOT NULL DEFAULT 0,"
+                    " last_probe_at REAL NOT NULL DEFAULT 0,"
+                    " PRIMARY KEY (plz, task_name))"
+                )
+                _schema_ready = True
+    return conn
+
+
+def record_result(plz, task_name, offer_count):
+    """Adds one successful (non-error) provider call to the PLZ summary."""
+    if not AVAILABILITY_PREDICTOR_ENABLED:
+        return
+    plz = normalize_plz(plz)
+    if not plz:
+        return
+    is_empty = 1 if offer_count == 0 else 0
+    try:
+        _connect().execute(
+            "INSERT INTO provider_availability (plz, task_name, observations, empty_observations, consecutive_empty, last_probe_at)"
+            " VALUES (?, ?, 1, ?, ?, ?)"
+            " ON CONFLICT (plz, task_name) DO UPDATE SET"
+            "  observations = observations + 1,"
+            "  empty_observations = empty_observations + excluded.empty_observations,"
+            "  consecutive_empty = CASE WHEN excluded.empty_observations = 1 THEN consecutive_empty + 1 ELSE 0 END,"
+            "  last_probe_at = excluded.last_probe_at",
+            (plz, task_name, is_empty, is_empty, time.time())
+        )
+    except sqlite3.Error as e:
+        print(f"Availability ERROR: Could not record {task_name} for PLZ {plz}: {e}")
+
+
+def should_skip(plz, task_name):
+    """
+    True if task_name has been reliably empty in this PLZ and isn't due for a re-probe.
+    When a re-probe is due, exactly one caller (across workers) claims it and gets False.
+    """
+    if not AVAILABILITY_PREDICTOR_ENABLED:
+        return False
+    plz = normalize_plz(plz)
+    if not plz:
+        return False
+    try:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT consecutive_empty, last_probe_at FROM provider_availability WHERE plz = ? AND task_name = ?",
+            (plz, task_name)
+        ).fetchone()
+        if row is None or row[0] < AVAILABILITY_MIN_EMPTY_OBSERVATIONS:
+            return False
+        now = time.time()
+        if now - row[1] < AVAILABILITY_REPROBE_SECONDS:
+            return True
+        # Re-probe due: claim it by moving last_probe_at forward so concurrent searches keep skipping.
+        cursor = conn.execute(
+            "UPDATE provider_availability SET last_probe_at = ? WHERE plz = ? AND task_name = ? AND last_probe_at = ?",
+            (now, plz, task_name, row[1])
+        )
+        return cursor.rowcount != 1
+    except sqlite3.Error as e:
+        print(f"Availability ERROR: Lookup failed for {task_name} in PLZ {plz}: {e}")
+        return False
+
+
+def summary_for_plz(plz):
+    """Returns {task_name: {...}} with the observation counts for one PLZ."""
+    plz = normalize_plz(plz)
+    rows = _connect().execute(
+        "SELECT task_name, observations, empty_observations, consecutive_empty, last_probe_at"
+        " FROM provider_availability WHERE plz = ? ORDER BY task_name",
+        (plz,)
+    ).fetchall()
+    return {
+        task_name: {
+            "observations": observations,
+            "emptyObservations": empty_observations,
+            "consecutiveEmpty": consecutive_empty,
+            "lastProbeAt": last_probe_at,
+            "reliablyEmpty": consecutive_empty >= AVAILABILITY_MIN_EMPTY_OBSERVATIONS,
+        }
+        for task_name, observations, empty_observations, consecutive_empty, last_probe_at in rows
+    }
@@ -1,4 +1,9 @@
 import requests
+from app.services import profiling
+from app.services.interning import intern_offer
+from app.services.http_session import get_session, register_provider_host
+from app.services.upstream_payload import read_payload
+from app.services.providers import timeout_for
 import os
 import csv 
 from io import StringIO 
@@ -6,6 +11,7 @@ from io import StringIO
 
 # --- Credentials and Constants ---
 BYTEME_BASE_URL = "https://byteme.gendev7.check24.fun/app/api/products/data"
+register_provider_host(BYTEME_BASE_URL, "ByteMe")
 BYTEME_API_KEY = os.getenv("BYTEME_API_KEY")
 
 # --- Normalization Function (specific to ByteMe's CSV structure) ---
@@ -120,7 +126,7 @@ def _normalize_byteme_offer(offer_data_dict):
             "_provider_specific_id": offer_data_dict.get("productId"), # Crucial for de-duplication
             # "_raw_byteme_data": offer_data_dict # Optional for debugging
         }
-        return normalized_offer
+        return intern_offer(normalized_offer)
     except Exception as e:
         print(f"ByteMe Normalization: Error normalizing offer data: {offer_data_dict}. Error: {e}")
         return None
@@ -138,7 +144,8 @@ def get_byteme_offers(address_details):
                                 "plz": "10115",
                                 "city": "Berlin"
                             }
-    :return: A list of normalized, de-duplicated offer dictionaries.
+    :return: A list of normalized, de-duplicated offer dictionaries,
+             or None if the request or parsing failed (so callers can tell a failure from "no offers").
     """
     if not BYTEME_API_KEY:
         print("ByteMe API Key (BYTEME_API_KEY) is not configured.")
@@ -163,16 +170,19 @@ def get_byteme_offers(address_details):
 
     try:
         print(f"ByteMe: Requesting products for address: {params}")
-        response = requests.get(
-            BYTEME_BASE_URL,
-            params=params,
-            headers=headers,
-            timeout=20 # Timeout for the API call
-        )
-        response.raise_for_status() # Raises HTTPError for bad responses (4XX or 5XX)
-
-        # Response content is CSV text
-        csv_text = response.text
+        with profiling.span("ByteMe.fetch"):
+            response = get_session().get(
+                BYTEME_BASE_URL,
+                params=params,
+                headers=headers,
+                timeout=timeout_for("ByteMe"), # Timeout budget from the provider registry
+                stream=True
+            )
+            read_payload(response, "ByteMe") # bounded by the registry's max_payload_bytes
+            response.raise_for_status() # Raises HTTPError for bad responses (4XX or 5XX)
+
+            # Response content is CSV text
+            csv_text = response.text
         
         # Use StringIO to treat the string as a file for csv.reader
         csv_file = StringIO(csv_text)
@@ -182,37 +192,43 @@ def get_byteme_offers(address_details):
         # connectionType,installationService,tv,limitFrom,maxAge,voucherType,voucherValue
         csv_reader = csv.DictReader(csv_file) # DictReader uses the first row as keys
 
-        for row_dict in csv_reader:
-            product_id = row_dict.get("productId")
-            if not product_id: # Skip rows without a product ID
-                print(f"ByteMe: Skipping row due to missing productId: {row_dict}")
-                continue
-
-            # De-duplication based on productId
-            if product_id in processed_product_ids:
-                
-                continue
-            processed_product_ids.add(product_id)
-
-            normalized_offer = _normalize_byteme_offer(row_dict)
-            #normalized_offer = row_dict
-            if normalized_offer:
-                all_normalized_offers.append(normalized_offer)
+        with profiling.span("ByteMe.parse_normalize"): # CSV rows are parsed and normalized in one pass
+            for row_dict in csv_reader:
+                product_id = row_dict.get("productId")
+                if not product_id: # Skip rows without a product ID
+                    print(f"ByteMe: Skipping row due to missing productId: {row_dict}")
+                    continue
+
+                # De-duplication based on productId
+                if product_id in processed_product_ids:
+
+                    continue
+                processed_product_ids.add(product_id)
+
+                normalized_offer = _normalize_byteme_offer(row_dict)
+                #normalized_offer = row_dict
+                if normalized_offer:
+                    all_normalized_offers.append(normalized_offer)
         
         print(f"ByteMe: Successfully fetched, de-duplicated, and normalized {len(all_normalized_offers)} offers.")
 
     except requests.exceptions.Timeout:
         print("ByteMe: Timeout fetching products.")
+        return None
     except requests.exceptions.HTTPError as e:
         print(f"ByteMe: HTTP error: {e.response.status_code} - {e.response.text}")
+        return None
     except requests.exceptions.RequestException as e:
         print(f"ByteMe: Request error: {e}")
+        return None
     except csv.Error as e: # Catch errors from csv parsing
         print(f"ByteMe: CSV parsing error: {e}")
+        return None
     except Exception as e: # Catch any other unexpected errors
         print(f"ByteMe: An unexpected error occurred: {e}")
         # import traceback
         # traceback.print_exc() # For more detailed debugging
+        return None
         
     return all_normalized_offers
 
@@ -0,0 +1,221 @@
+# app/services/cache_warmer.py
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import wait
+from datetime import datetime
+
+from app.services import metrics, offer_cache
+from app.services.address import canonicalize_address
+
+# Background cache warmer. Every search is counted in a count-min sketch keyed by canonical
+# address (a few KiB regardless of how many distinct addresses are searched), and a bounded
+# candidate list keeps the payloads of the most frequent ones. Every CACHE_WARMER_INTERVAL_SECONDS
+# the warmer refreshes the provider entries of the top CACHE_WARMER_TOP_N addresses that are
+# missing or expire within CACHE_WARMER_REFRESH_AHEAD_SECONDS, so hot addresses never go stale.
+# Both default to a third of the offer cache TTL. The refresh-ahead window is capped at
+# TTL - interval: otherwise an entry refreshed in one run is due again in the next, and every
+# run would refetch everything. Refreshes go through the normal provider clients and the
+# scheduler's refresh lane (as their own fairness group), so they only use capacity searches
+# leave spare, and a run starts at most CACHE_WARMER_MAX_UPSTREAM_CALLS upstream calls.
+# That is why warming runs at any time by default. CACHE_WARMER_OFFPEAK_HOURS (local time,
+# e.g. "1-6" or "22-5") restricts it to a window, which only pays off when entries outlive
+# the gap to the busy hours (a long OFFER_CACHE_TTL_SECONDS). Counts are halved every
+# CACHE_WARMER_HALF_LIFE_HOURS so the ranking follows current traffic. State is per worker.
+CACHE_WARMER_ENABLED = os.getenv("CACHE_WARMER_ENABLED", "false").lower() == "true"
+CACHE_WARMER_TOP_N = int(os.getenv("CACHE_WARMER_TOP_N", "200"))
+CACHE_WARMER_MIN_SEARCHES = int(os.getenv("CACHE_WARMER_MIN_SEARCHES", "3"))
+CACHE_WARMER_INTERVAL_SECONDS = int(
+    os.getenv("CACHE_WARMER_INTERVAL_SECONDS") or max(60, offer_cache.OFFER_CACHE_TTL_SECONDS // 3)
+)
+CACHE_WARMER_OFFPEAK_HOURS = os.getenv("CACHE_WARMER_OFFPEAK_HOURS", "")
+CACHE_WARMER_MAX_UPSTREAM_CALLS = int(os.getenv("CACHE_WARMER_MAX_UPSTREAM_CALLS", "50"))
+CACHE_WARMER_REFRESH_AHEAD_SECONDS = min(
+    int(os.getenv("CACHE_WARMER_REFRESH_AHEAD_SECONDS") or offer_cache.OFFER_CACHE_TTL_SECONDS // 3),
+    max(0, offer_cache.OFFER_CACHE_TTL_SECONDS - CACHE_WARMER_INTERVAL_SECONDS)
+)
+CACHE_WARMER_HALF_LIFE_HOURS = float(os.getenv("CACHE_WARMER_HALF_LIFE_HOURS", "24"))
+CACHE_WARMER_SKETCH_WIDTH = int(os.getenv("CACHE_WARMER_SKETCH_WIDTH", "4096"))
+CACHE_WARMER_SKETCH_DEPTH = int(os.getenv("CACHE_WARMER_SKETCH_DEPTH", "4"))
+# How long a run waits for its refreshes before the next one may start.
+CACHE_WARMER_RUN_TIMEOUT_SECONDS = int(os.getenv("CACHE_WARMER_RUN_TIMEOUT_SECONDS", "60"))
+
+_WARMER_OWNER = "cache-warmer"
+# Candidates beyond this are trimmed back to 2 * TOP_N (lowest counts first).
+_MAX_CANDIDATES = CACHE_WARMER_TOP_N * 4
+
+
+class CountMinSketch:
+    """Approximate per-key counts in fixed memory; estimates never undercount."""
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self._rows = [array("I", bytes(4 * width)) for _ in range(depth)]
+
+    def _indexes(self, key):
+        # Double hashing: row i uses h1 + i * h2.
+        h1 = hash(key)
+        h2 = hash((key, 1)) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key):
+        """Counts one occurrence and returns the new estimate (conservative update)."""
+        indexes = self._indexes(key)
+        estimate = min(row[i] for row, i in zip(self._rows, indexes)) + 1
+        for row, i in zip(self._rows, indexes):
+            if row[i] < estimate:
+                row[i] = estimate
+        return estimate
+
+    def estimate(self, key):
+        return min(row[i] for row, i in zip(self._rows, self._indexes(key)))
+
+    def halve(self):
+        for row in self._rows:
+            for i, value in enumerate(row):
+                if value:
+                    row[i] = value >> 1
+
+
+_lock = threading.Lock()
+_sketch = CountMinSketch(CACHE_WARMER_SKETCH_WIDTH, CACHE_WARMER_SKETCH_DEPTH)
+_candidates = {} # address key -> [estimate, canonical address payload]
+# cache key -> (previous (expires_at, stale_until) or None, warmed at): what a user would have
+# found without the warmer, checked on their first fresh hit.
+_warmed = {}
+
+
+def record_search(address_payload):
+    """Counts a user search for the address."""
+    if not CACHE_WARMER_ENABLED:
+        return
+    address_payload, address_key = canonicalize_address(address_payload)
+    with _lock:
+        estimate = _sketch.add(address_key)
+        candidate = _candidates.get(address_key)
+        if candidate is not None:
+            candidate[0] = estimate
+        elif estimate >= CACHE_WARMER_MIN_SEARCHES:
+            _candidates[address_key] = [estimate, address_payload]
+            if len(_candidates) > _MAX_CANDIDATES:
+                _trim_candidates_locked()
+
+
+def _trim_candidates_locked():
+    keep = sorted(_candidates.items(), key=lambda item: item[1][0], reverse=True)[:CACHE_WARMER_TOP_N * 2]
+    _candidates.clear()
+    _candidates.update(keep)
+
+
+def top_addresses(n=CACHE_WARMER_TOP_N):
+    """[(estimated searches, canonical address payload)] of the n most searched addresses."""
+    with _lock:
+        ranked = sorted(_candidates.values(), key=lambda candidate: candidate[0], reverse=True)
+    return [(count, payload) for count, payload in ranked[:n] if count >= CACHE_WARMER_MIN_SEARCHES]
+
+
+def decay():
+    """Halves every count, so old popularity fades."""
+    with _lock:
+        _sketch.halve()
+        for key in list(_candidates):
+            _candidates[key][0] >>= 1
+            if _candidates[key][0] == 0:
+                del _candidates[key]
+
+
+def note_fresh_hit(cache_key):
+    """
+    Called for a user search served a fresh cache entry. If the warmer wrote it, counts what
+    the user would otherwise have had: a cold miss (old entry gone) or a stale answer.
+    """
+    if not _warmed:
+        return
+    with _lock:
+        warmed = _warmed.pop(cache_key, None)
+    if warmed is None:
+        return
+    previous, _ = warmed
+    now = time.time()
+    if previous is None or previous[1] <= now:
+        metrics.increment("cache_warmer.cold_misses_avoided")
+    elif previous[0] <= now:
+        metrics.increment("cache_warmer.stale_serves_avoided")
+    else:
+        metrics.increment("cache_warmer.hits_before_old_expiry")
+
+
+def in_offpeak_window(now=None, hours=None):
+    spec = (CACHE_WARMER_OFFPEAK_HOURS if hours is None else hours).strip()
+    if not spec:
+        return True
+    start, end = (int(part) for part in spec.split("-"))
+    hour = (now or datetime.now()).hour
+    return start <= hour < end if start <= end else (hour >= start or hour < end)
+
+
+def run_once():
+    """One warming pass over the top addresses; returns a small report."""
+    from app.services.aggregator import refresh_expiring
+    now = time.time()
+    with _lock:
+        # Entries warmed longer ago than the TTL have expired again; stop tracking them.
+        for cache_key in [k for k, (_, warmed_at) in _warmed.items() if warmed_at < now - offer_cache.OFFER_CACHE_TTL_SECONDS]:
+            del _warmed[cache_key]
+
+    budget = CACHE_WARMER_MAX_UPSTREAM_CALLS
+    addresses = top_addresses()
+    started = []
+    for _, address_payload in addresses:
+        if budget <= 0:
+            metrics.increment("cache_warmer.budget_exhausted")
+            break
+        calls = refresh_expiring(address_payload, now + CACHE_WARMER_REFRESH_AHEAD_SECONDS, budget, _WARMER_OWNER)
+        budget -= len(calls)
+        started.extend(calls)
+
+    with _lock:
+        for cache_key, previous, _ in started:
+            _warmed[cache_key] = (previous, now)
+    futures = [future for _, _, future in started]
+    done, not_done = wait(futures, timeout=CACHE_WARMER_RUN_TIMEOUT_SECONDS) if futures else (set(), set())
+    refreshed = sum(1 for f in done if not f.cancelled() and f.exception() is None and isinstance(f.result(), list))
+    metrics.increment("cache_warmer.runs")
+    metrics.increment("cache_warmer.upstream_calls", len(started))
+    metrics.increment("cache_warmer.refreshed", refreshed)
+    metrics.increment("cache_warmer.failed", len(futures) - refreshed)
+    with _lock:
+        metrics.set_gauge("cache_warmer.tracked_addresses", len(_candidates))
+    return {"addresses": len(addresses), "upstream_calls": len(started), "refreshed": refreshed,
+            "unfinished": len(not_done)}
+
+
+def start_background_job():
+    """Per-worker daemon thread running run_once() in the off-peak window and decaying the counts."""
+
+    if CACHE_WARMER_OFFPEAK_HOURS.strip() and offer_cache.OFFER_CACHE_TTL_SECONDS < 6 * 3600:
+        print(f"Cache Warmer WARNING: Off-peak window {CACHE_WARMER_OFFPEAK_HOURS} with a "
+              f"{offer_cache.OFFER_CACHE_TTL_SECONDS}s cache TTL: warmed entries expire before the busy hours.")
+
+    def _run():
+        next_decay = time.monotonic() + CACHE_WARMER_HALF_LIFE_HOURS * 3600
+        while True:
+            time.sleep(CACHE_WARMER_INTERVAL_SECONDS)
+            try:
+                if time.monotonic() >= next_decay:
+                    decay()
+                    next_decay = time.monotonic() + CACHE_WARMER_HALF_LIFE_HOURS * 3600
+                if not in_offpeak_window():
+                    continue
+                report = run_once()
+                if report["upstream_calls"]:
+                    print(f"Cache Warmer: {report['refreshed']}/{report['upstream_calls']} provider entries refreshed "
+                          f"for the top {report['addresses']} address(es).")
+            except Exception as e:
+                print(f"Cache Warmer ERROR: Run failed: {e}")
+
+    thread = threading.Thread(target=_run, name="cache-warmer", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,70 @@
+# app/services/http_session.py
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.services import providers, rate_limit
+
+# --- Pool Settings ---
+# One pool per provider host; pool_maxsize bounds how many keep-alive connections are kept per host.
+# Registered provider hosts get their own adapter sized to the provider's bulkhead (plus any
+# extra concurrency the client adds, e.g. the Servus Speed detail pool), so concurrent calls
+# don't open connections the pool then throws away. HTTP_POOL_MAXSIZE applies to other hosts.
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+
+class RateLimitedAdapter(HTTPAdapter):
+    """Waits for a token of the target host's rate limit (app/services/rate_limit.py) before sending."""
+
+    def send(self, request, **kwargs):
+        rate_limit.acquire(request.url, kwargs.get("timeout"))
+        return super().send(request, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+_host_pool_sizes = {} # "scheme://host/" prefix -> pool_maxsize
+
+
+def _mount_host(session, prefix, pool_maxsize):
+    session.mount(prefix, RateLimitedAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+
+
+def register_provider_host(url, provider_name, extra_connections=0):
+    """
+    Puts requests to url's host under provider_name's rate limit, with a connection pool as
+    large as the provider's bulkhead plus extra_connections.
+    """
+    rate_limit.register_host(url, provider_name)
+    parts = urlsplit(url)
+    if not parts.hostname:
+        return
+    prefix = f"{parts.scheme}://{parts.netloc}/"
+    pool_maxsize = max(HTTP_POOL_MAXSIZE, providers.max_concurrency_for(provider_name) + extra_connections)
+    with _session_lock:
+        _host_pool_sizes[prefix] = pool_maxsize
+        if _session is not None: # clients are imported lazily, possibly after the session exists
+            _mount_host(_session, prefix, pool_maxsize)
+
+
+def get_session():
+    """
+    Returns the process-wide requests.Session shared by all provider clients.
+    Reusing it keeps TLS connections to the provider hosts alive between searches
+    instead of paying a fresh handshake for every call.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = RateLimitedAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                for prefix, pool_maxsize in _host_pool_sizes.items():
+                    _mount_host(session, prefix, pool_maxsize)
+                _session = session
+    return _session
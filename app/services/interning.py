@@ -0,0 +1,58 @@
+# app/services/interning.py
+import os
+import threading
+
+from app.services import metrics
+
+# Flyweight sharing of offer field values. The same strings come back in almost every offer:
+# provider names, product names, connection types, TV packages, benefits texts (the joined
+# benefit list, e.g. "Installation service included"), and product IDs across addresses.
+# The normalizers and the offer cache's decoder pass each offer through intern_offer(), which
+# replaces those values with one shared instance per distinct string. Strings are immutable,
+# so sharing is safe. Offers held in memory (result lists, history states, coalesced results)
+# then cost a pointer per field instead of a fresh string.
+#
+# Each field has its own table of at most OFFER_INTERN_MAX_VALUES strings. A table that fills up
+# is cleared and starts over. Offers keep the instances they already hold, so memory stays
+# bounded even if some field turns out to be unique per offer.
+OFFER_INTERN_ENABLED = os.getenv("OFFER_INTERN_ENABLED", "true").lower() == "true"
+OFFER_INTERN_MAX_VALUES = int(os.getenv("OFFER_INTERN_MAX_VALUES", "20000"))
+
+INTERNED_FIELDS = (
+    "providerName", "productName", "connectionType", "benefits", "tv", "tvIncluded",
+    "discountType", "_provider_specific_id",
+)
+
+_lock = threading.Lock()
+_tables = {field: {} for field in INTERNED_FIELDS}
+
+
+def intern_value(field, value):
+    """The shared instance of a string value of field (other values are returned as they are)."""
+    if type(value) is not str:
+        return value
+    table = _tables[field]
+    shared = table.get(value)
+    if shared is not None:
+        return shared
+    with _lock:
+        if len(table) >= OFFER_INTERN_MAX_VALUES:
+            table.clear()
+            metrics.increment(f"interning.{field}.table_resets")
+        return table.setdefault(value, value)
+
+
+def intern_offer(offer):
+    """Replaces the repeating string fields of a normalized offer with shared instances, in place."""
+    if not OFFER_INTERN_ENABLED or offer is None:
+        return offer
+    for field in INTERNED_FIELDS:
+        value = offer.get(field)
+        if value is not None:
+            offer[field] = intern_value(field, value)
+    return offer
+
+
+def table_sizes():
+    """{field: distinct strings currently interned}."""
+    return {field: len(table) for field, table in _tables.items()}
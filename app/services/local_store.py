@@ -0,0 +1,32 @@
+# app/services/local_store.py
+import os
+import sqlite3
+import threading
+
+# Host-local SQLite files shared by every worker process on the machine (offer cache etc.).
+# WAL mode lets readers in all workers proceed while one writer appends.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("LOCAL_STORE_BUSY_TIMEOUT_SECONDS", "2"))
+
+_local = threading.local()
+
+def default_path(filename):
+    return os.path.join(PROJECT_ROOT, filename)
+
+def get_connection(path):
+    """
+    Returns this thread's connection to the SQLite file at `path`, opening it on first use.
+    sqlite3 connections can't be shared between threads, and connections are opened lazily
+    so nothing is inherited across a gunicorn fork.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        # isolation_level=None -> autocommit; multi-statement writes use explicit BEGIN IMMEDIATE.
+        conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = conn
+    return conn
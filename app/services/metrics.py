@@ -0,0 +1,83 @@
+# app/services/metrics.py
+import threading
+from collections import defaultdict, deque
+
+# Process-local metrics, exposed as JSON on /api/metrics. Each gunicorn worker reports its own numbers.
+
+# How many recent observations per histogram are kept for percentiles.
+_HISTOGRAM_WINDOW = 1000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_histograms = {}
+_derived = {}
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def set_gauge_max(name, value):
+    """Raises the gauge to value if it is higher (for high-water marks)."""
+    with _lock:
+        if value > _gauges.get(name, float("-inf")):
+            _gauges[name] = value
+
+
+def observe(name, value):
+    """Records one sample (e.g. a latency in ms) for a histogram summary."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {"count": 0, "sum": 0.0, "max": 0.0, "recent": deque(maxlen=_HISTOGRAM_WINDOW)}
+        histogram["count"] += 1
+        histogram["sum"] += value
+        histogram["max"] = max(histogram["max"], value)
+        histogram["recent"].append(value)
+
+
+def register_derived(name, func):
+    """Registers a metric computed at snapshot time from the counters, e.g. a hit ratio."""
+    _derived[name] = func
+
+
+def ratio(counters, numerator, denominators):
+    total = sum(counters.get(d, 0) for d in denominators)
+    return round(counters.get(numerator, 0) / total, 4) if total else 0.0
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {}
+        for name, h in _histograms.items():
+            recent = sorted(h["recent"])
+            histograms[name] = {
+                "count": h["count"],
+                "avg": round(h["sum"] / h["count"], 3) if h["count"] else None,
+                "max": round(h["max"], 3),
+                "p50": _percentile(recent, 0.50),
+                "p99": _percentile(recent, 0.99),
+            }
+    derived = {}
+    for name, func in _derived.items():
+        try:
+            derived[name] = func(counters)
+        except Exception as e:
+            print(f"Metrics ERROR: Derived metric {name} failed: {e}")
+    return {"counters": counters, "gauges": gauges, "histograms": histograms, "derived": derived}
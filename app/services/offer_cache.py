@@ -0,0 +1,223 @@
+# app/services/offer_cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from app.services.interning import intern_offer
+from app.services.local_store import default_path, get_connection
+
+# --- Settings ---
+# One SQLite file (WAL mode) per host, so every gunicorn worker reads the same warm cache.
+OFFER_CACHE_ENABLED = os.getenv("OFFER_CACHE_ENABLED", "true").lower() == "true"
+OFFER_CACHE_PATH = os.getenv("OFFER_CACHE_PATH", default_path("offer_cache.db"))
+OFFER_CACHE_TTL_SECONDS = int(os.getenv("OFFER_CACHE_TTL_SECONDS", "900"))
+# Negative caching: "no offers here" answers are stable, so empty results are kept longer.
+OFFER_CACHE_NEGATIVE_TTL_SECONDS = int(os.getenv("OFFER_CACHE_NEGATIVE_TTL_SECONDS", "3600"))
+# Stale-while-revalidate: for this long after the TTL an entry is still served (marked stale)
+# while a single background refresh replaces it.
+OFFER_CACHE_STALE_GRACE_SECONDS = int(os.getenv("OFFER_CACHE_STALE_GRACE_SECONDS", "3600"))
+OFFER_CACHE_MAX_ENTRIES = int(os.getenv("OFFER_CACHE_MAX_ENTRIES", "50000"))
+OFFER_CACHE_MAX_BYTES = int(os.getenv("OFFER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Limits are checked every N writes rather than on every put (a SUM over the table isn't free).
+_LIMIT_CHECK_EVERY_PUTS = 100
+
+# Bump when the table layout, payload encoding or key format changes; old cache files are then rebuilt.
+_SCHEMA_VERSION = 3
+
+_schema_lock = threading.Lock()
+_schema_ready_paths = set()
+_puts_since_limit_check = 0
+
+
+def provider_cache_key(task_name, address_key):
+    return f"{task_name}|{address_key}"
+
+
+def address_key_of(cache_key):
+    return cache_key.split("|", 1)[1]
+
+
+# --- Encoding ---
+# Offers from one provider call share the same keys, so each distinct key tuple is written once
+# ("s") and every offer becomes a row of values referencing it ("r"). The JSON is then deflated.
+# This round-trips exactly (missing keys stay missing) and is several times smaller than json.dumps.
+# Results a client marked partial also carry "p", so they still read back as partial.
+
+class PartialOffers(list):
+    """A cached result its provider marked partial (e.g. verbyndich_client.PartialResult)."""
+    partial = True
+
+
+def encode_offers(offers):
+    schemas = []
+    schema_index = {}
+    rows = []
+    for offer in offers:
+        keys = tuple(offer.keys())
+        idx = schema_index.get(keys)
+        if idx is None:
+            idx = schema_index[keys] = len(schemas)
+            schemas.append(list(keys))
+        rows.append([idx] + list(offer.values()))
+    data = {"s": schemas, "r": rows}
+    if getattr(offers, "partial", False):
+        data["p"] = 1
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(raw.encode("utf-8"), 6)
+
+
+def decode_offers(blob):
+    data = json.loads(zlib.decompress(blob).decode("utf-8"))
+    schemas = data["s"]
+    # json.loads makes a fresh string per value; share the repeating ones (see interning.py).
+    offers = [intern_offer(dict(zip(schemas[row[0]], row[1:]))) for row in data["r"]]
+    return PartialOffers(offers) if data.get("p") else offers
+
+
+# --- Storage ---
+
+def _connect():
+    conn = get_connection(OFFER_CACHE_PATH)
+    if OFFER_CACHE_PATH not in _schema_ready_paths:
+        with _schema_lock:
+            if OFFER_CACHE_PATH not in _schema_ready_paths:
+                _ensure_schema(conn)
+                _schema_ready_paths.add(OFFER_CACHE_PATH)
+    return conn
+
+
+def _ensure_schema(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != _SCHEMA_VERSION:
+        # It's a cache: on layout changes simply start over.
+        conn.execute("DROP TABLE IF EXISTS offer_cache")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS offer_cache ("
+        " cache_key TEXT PRIMARY KEY,"
+        " payload BLOB NOT NULL,"
+        " stored_at REAL NOT NULL,"
+        " expires_at REAL NOT NULL,"
+        " stale_until REAL NOT NULL,"
+        " refresh_lease_until REAL NOT NULL DEFAULT 0,"
+        " size_bytes INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_offer_cache_stale_until ON offer_cache (stale_until)")
+    conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+
+def lookup(cache_key):
+    """
+    Returns (offers, state) for cache_key where state is "fresh", "stale" (past the TTL but
+    inside the grace window) or "miss" (offers is then None).
+    """
+    if not OFFER_CACHE_ENABLED:
+        return None, "miss"
+    try:
+        row = _connect().execute(
+            "SELECT payload, expires_at, stale_until FROM offer_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or row[2] <= now:
+            return None, "miss"
+        return decode_offers(row[0]), ("fresh" if row[1] > now else "stale")
+    except (sqlite3.Error, ValueError, zlib.error) as e:
+        print(f"Offer Cache ERROR: Read failed for {cache_key}: {e}")
+        return None, "miss"
+
+
+def get(cache_key):
+    """Returns the cached offer list for cache_key if it is fresh, otherwise None."""
+    offers, state = lookup(cache_key)
+    return offers if state == "fresh" else None
+
+
+def entry_times(cache_key):
+    """(expires_at, stale_until) of the entry for cache_key, or None if there is none."""
+    if not OFFER_CACHE_ENABLED:
+        return None
+    try:
+        row = _connect().execute(
+            "SELECT expires_at, stale_until FROM offer_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Offer Cache ERROR: Read failed for {cache_key}: {e}")
+        return None
+    return tuple(row) if row else None
+
+
+def try_acquire_refresh_lease(cache_key, lease_seconds):
+    """
+    Claims the right to refresh a stale entry. Only one worker on the host wins the lease
+    until it expires or the entry is rewritten, so a stale key triggers one upstream refresh.
+    """
+    if not OFFER_CACHE_ENABLED:
+        return False
+    try:
+        now = time.time()
+        cursor = _connect().execute(
+            "UPDATE offer_cache SET refresh_lease_until = ? WHERE cache_key = ? AND refresh_lease_until <= ?",
+            (now + lease_seconds, cache_key, now)
+        )
+        return cursor.rowcount == 1
+    except sqlite3.Error as e:
+        print(f"Offer Cache ERROR: Lease update failed for {cache_key}: {e}")
+        return False
+
+
+def release_refresh_lease(cache_key):
+    """Gives up a refresh lease whose call won't run (e.g. a cancelled prefetch), so others may refresh now."""
+    if not OFFER_CACHE_ENABLED:
+        return
+    try:
+        _connect().execute("UPDATE offer_cache SET refresh_lease_until = 0 WHERE cache_key = ?", (cache_key,))
+    except sqlite3.Error as e:
+        print(f"Offer Cache ERROR: Lease release failed for {cache_key}: {e}")
+
+
+def put(cache_key, offers, ttl_seconds=None):
+    """Stores a provider's normalized offers. Errors are logged and swallowed: the cache is optional."""
+    global _puts_since_limit_check
+    if not OFFER_CACHE_ENABLED:
+        return
+    if ttl_seconds is not None:
+        ttl = ttl_seconds
+    else:
+        ttl = OFFER_CACHE_TTL_SECONDS if offers else OFFER_CACHE_NEGATIVE_TTL_SECONDS
+    try:
+        payload = encode_offers(offers)
+        now = time.time()
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO offer_cache (cache_key, payload, stored_at, expires_at, stale_until, size_bytes)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (cache_key, payload, now, now + ttl, now + ttl + OFFER_CACHE_STALE_GRACE_SECONDS, len(payload))
+        )
+        _puts_since_limit_check += 1
+        if _puts_since_limit_check >= _LIMIT_CHECK_EVERY_PUTS:
+            _puts_since_limit_check = 0
+            _enforce_limits(conn)
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        print(f"Offer Cache ERROR: Write failed for {cache_key}: {e}")
+
+
+def _enforce_limits(conn):
+    """Drops rows past their grace window, then the soonest-expiring ones until entry and byte limits hold."""
+    conn.execute("DELETE FROM offer_cache WHERE stale_until <= ?", (time.time(),))
+    entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM offer_cache").fetchone()
+    if entries <= OFFER_CACHE_MAX_ENTRIES and total_bytes <= OFFER_CACHE_MAX_BYTES:
+        return
+    # Evict down to 90% of the limits so we don't come straight back here on the next check.
+    excess_entries = entries - int(OFFER_CACHE_MAX_ENTRIES * 0.9)
+    average_size = total_bytes / entries if entries else 1
+    excess_by_bytes = int((total_bytes - OFFER_CACHE_MAX_BYTES * 0.9) / max(average_size, 1))
+    to_delete = max(excess_entries, excess_by_bytes, 0)
+    if to_delete:
+        conn.execute(
+            "DELETE FROM offer_cache WHERE cache_key IN"
+            " (SELECT cache_key FROM offer_cache ORDER BY stale_until LIMIT ?)",
+            (to_delete,)
+        )
+        print(f"Offer Cache INFO: Evicted {to_delete} entries (had {entries} entries / {total_bytes} bytes).")
@@ -0,0 +1,254 @@
+# app/services/offer_history.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from app.services import metrics
+from app.services.local_store import default_path, get_connection
+
+# Offer history per canonical address and provider task. Every real upstream result is compared
+# with the last known offers of that task. The first result is stored as a "base" snapshot.
+# After that, only deltas are stored, keyed by offer fingerprint: offers added, offers removed,
+# and fields set or unset on changed offers. An unchanged result stores nothing, so storage grows
+# with what actually changed. Every OFFER_HISTORY_REBASE_EVERY deltas a new base is written, so
+# rebuilding a point in time replays a bounded number of rows. Failed and partial results are
+# not recorded, so a flaky provider doesn't look like offers disappearing.
+OFFER_HISTORY_ENABLED = os.getenv("OFFER_HISTORY_ENABLED", "true").lower() == "true"
+OFFER_HISTORY_DB_PATH = os.getenv("OFFER_HISTORY_DB_PATH", default_path("offer_history.db"))
+OFFER_HISTORY_REBASE_EVERY = int(os.getenv("OFFER_HISTORY_REBASE_EVERY", "50"))
+# Latest state of recently recorded tasks, so recording doesn't replay history every time.
+_STATE_CACHE_SIZE = 2048
+
+# Fields that describe how an offer was served, not the offer itself.
+_VOLATILE_FIELDS = ("_stale",)
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+_state_lock = threading.Lock()
+_latest_states = OrderedDict() # (address key, task) -> (seq, {fingerprint: offer})
+
+
+def _connect():
+    global _schema_ready
+    conn = get_connection(OFFER_HISTORY_DB_PATH)
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS offer_snapshots ("
+                    " address_key TEXT NOT NULL,"
+                    " task_name TEXT NOT NULL,"
+                    " seq INTEGER NOT NULL,"
+                    " taken_at REAL NOT NULL,"
+                    " kind TEXT NOT NULL," # "base" (full offers) or "delta"
+                    " payload BLOB NOT NULL,"
+                    " PRIMARY KEY (address_key, task_name, seq))"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_offer_snapshots_address_time ON offer_snapshots (address_key, taken_at)"
+                )
+                _schema_ready = True
+    return conn
+
+
+def _encode(document):
+    return zlib.compress(json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 6)
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+# --- Offers, fingerprints and deltas ---
+
+def fingerprint(offer):
+    """Stable identity of an offer across fetches: its provider product ID, else its defining fields."""
+    identity = offer.get("_provider_specific_id")
+    if identity is None:
+        identity = [offer.get(f) for f in ("productName", "downloadSpeedMbps", "connectionType", "contractTermMonths")]
+    raw = json.dumps([offer.get("providerName"), identity], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _state_of(offers):
+    state = {}
+    for offer in offers:
+        state[fingerprint(offer)] = {k: v for k, v in offer.items() if k not in _VOLATILE_FIELDS}
+    return state
+
+
+def diff(old_state, new_state):
+    """{"added": {fp: offer}, "removed": [fp], "changed": {fp: {"set": {...}, "unset": [...]}}}; empty dict if equal."""
+    delta = {}
+    added = {fp: offer for fp, offer in new_state.items() if fp not in old_state}
+    removed = [fp for fp in old_state if fp not in new_state]
+    changed = {}
+    for fp, offer in new_state.items():
+        old = old_state.get(fp)
+        if old is None or old == offer:
+            continue
+        change = {}
+        set_fields = {k: v for k, v in offer.items() if k not in old or old[k] != v}
+        unset_fields = [k for k in old if k not in offer]
+        if set_fields:
+            change["set"] = set_fields
+        if unset_fields:
+            change["unset"] = unset_fields
+        changed[fp] = change
+    if added:
+        delta["added"] = added
+    if removed:
+        delta["removed"] = removed
+    if changed:
+        delta["changed"] = changed
+    return delta
+
+
+def apply_delta(state, delta):
+    """Applies a delta to a {fingerprint: offer} state in place and returns it."""
+    for fp in delta.get("removed", ()):
+        state.pop(fp, None)
+    for fp, change in delta.get("changed", {}).items():
+        offer = dict(state.get(fp, {}))
+        offer.update(change.get("set", {}))
+        for field in change.get("unset", ()):
+            offer.pop(field, None)
+        state[fp] = offer
+    state.update(delta.get("added", {}))
+    return state
+
+
+# --- Recording ---
+
+def _replay(conn, address_key, task_name, until=None):
+    """(seq, state) of a task as of `until` (epoch seconds; None = latest), or (None, None) without history."""
+    time_filter = "" if until is None else " AND taken_at <= ?"
+    params = (address_key, task_name) + (() if until is None else (until,))
+    base = conn.execute(
+        "SELECT seq, payload FROM offer_snapshots WHERE address_key = ? AND task_name = ? AND kind = 'base'"
+        + time_filter + " ORDER BY seq DESC LIMIT 1", params
+    ).fetchone()
+    if base is None:
+        return None, None
+    seq, state = base[0], _decode(base[1])["state"]
+    rows = conn.execute(
+        "SELECT seq, payload FROM offer_snapshots WHERE address_key = ? AND task_name = ? AND seq > ?"
+        + time_filter + " ORDER BY seq", (address_key, task_name, seq) + (() if until is None else (until,))
+    ).fetchall()
+    for seq, payload in rows:
+        apply_delta(state, _decode(payload)["delta"])
+    return seq, state
+
+
+def record(address_key, task_name, offers):
+    """Records a provider task's fresh result for an address; returns True if anything changed."""
+    if not OFFER_HISTORY_ENABLED or getattr(offers, "partial", False):
+        return False
+    new_state = _state_of(offers)
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE") # seq numbers stay gapless across workers
+        try:
+            last_seq = conn.execute(
+                "SELECT MAX(seq) FROM offer_snapshots WHERE address_key = ? AND task_name = ?", (address_key, task_name)
+            ).fetchone()[0]
+            with _state_lock:
+                cached = _latest_states.get((address_key, task_name))
+            if cached is not None and cached[0] == last_seq:
+                old_state = cached[1]
+            else: # another worker wrote since, or not seen by this worker yet
+                _, old_state = _replay(conn, address_key, task_name)
+
+            if old_state is None:
+                seq, kind, document = 0, "base", {"state": new_state}
+            else:
+                delta = diff(old_state, new_state)
+                if not delta:
+                    conn.execute("COMMIT")
+                    metrics.increment("offer_history.unchanged")
+                    _remember(address_key, task_name, last_seq, old_state)
+                    return False
+                seq = last_seq + 1
+                if seq % OFFER_HISTORY_REBASE_EVERY == 0:
+                    # The delta is kept alongside the full state so change listings stay complete.
+                    kind, document = "base", {"state": new_state, "delta": delta}
+                else:
+                    kind, document = "delta", {"delta": delta}
+            payload = _encode(document)
+            conn.execute(
+                "INSERT INTO offer_snapshots (address_key, task_name, seq, taken_at, kind, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                (address_key, task_name, seq, now, kind, payload)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        print(f"Offer History ERROR: Could not record {task_name} for {address_key}: {e}")
+        return False
+    metrics.increment(f"offer_history.{kind}_written")
+    metrics.increment("offer_history.bytes_written", len(payload))
+    _remember(address_key, task_name, seq, new_state)
+    return True
+
+
+def _remember(address_key, task_name, seq, state):
+    with _state_lock:
+        _latest_states[(address_key, task_name)] = (seq, state)
+        _latest_states.move_to_end((address_key, task_name))
+        while len(_latest_states) > _STATE_CACHE_SIZE:
+            _latest_states.popitem(last=False)
+
+
+# --- Reading ---
+
+def _task_names(conn, address_key):
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT task_name FROM offer_snapshots WHERE address_key = ? ORDER BY task_name", (address_key,)
+    )]
+
+
+def offers_at(address_key, at=None):
+    """
+    {task name: {fingerprint: offer}} as known at `at` (epoch seconds; None = now).
+    Tasks without history at that time are left out.
+    """
+    conn = _connect()
+    result = {}
+    for task_name in _task_names(conn, address_key):
+        _, state = _replay(conn, address_key, task_name, until=at)
+        if state is not None:
+            result[task_name] = state
+    return result
+
+
+def changes_since(address_key, since=0):
+    """
+    Chronological [{"task", "takenAt", "initial", "added", "removed", "changed"}] recorded after
+    `since`; "added" maps fingerprints to offers, "removed" lists fingerprints.
+    """
+    rows = _connect().execute(
+        "SELECT task_name, taken_at, kind, payload FROM offer_snapshots"
+        " WHERE address_key = ? AND taken_at > ? ORDER BY taken_at, task_name, seq",
+        (address_key, since)
+    ).fetchall()
+    changes = []
+    for task_name, taken_at, kind, payload in rows:
+        document = _decode(payload)
+        delta = document.get("delta")
+        entry = {"task": task_name, "takenAt": taken_at, "initial": delta is None}
+        if delta is None: # first snapshot of the task: everything was added
+            delta = {"added": document["state"]}
+        entry.update({
+            "added": delta.get("added", {}),
+            "removed": delta.get("removed", []),
+            "changed": delta.get("changed", {}),
+        })
+        changes.append(entry)
+    return changes
@@ -0,0 +1,110 @@
+# app/services/parse_pool.py
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.services import metrics, profiling
+from app.services.interning import intern_offer
+
+# Optional process-pool parsing stage for the web request path (PARSE_POOL_ENABLED=true).
+# WebWunder XML parsing and VerbynDich description regexes are pure Python/lxml work that holds
+# the GIL, so a large response slows down every other request in the worker. Large payloads are
+# handed to a small pool of warm worker processes running the clients' parse functions (the same
+# split bulk_compare.py uses). Small payloads are parsed in the calling thread, because sending
+# them to a process costs more than the parse: PARSE_POOL_MIN_BYTES of raw WebWunder XML,
+# PARSE_POOL_MIN_ITEMS VerbynDich items. Results come back as compact records (each distinct key
+# tuple once, then one value row per offer). If the pool breaks, parsing falls back to the thread.
+PARSE_POOL_ENABLED = os.getenv("PARSE_POOL_ENABLED", "false").lower() == "true"
+PARSE_POOL_WORKERS = int(os.getenv("PARSE_POOL_WORKERS", "2"))
+PARSE_POOL_MIN_BYTES = int(os.getenv("PARSE_POOL_MIN_BYTES", str(64 * 1024)))
+PARSE_POOL_MIN_ITEMS = int(os.getenv("PARSE_POOL_MIN_ITEMS", "200"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _warm_worker():
+    # Imports the clients (lxml, compiled regexes) and runs every parser once, so the first
+    # offloaded parse costs the same as any later one.
+    from app.services.warmup import _run_synthetic_normalization
+    _run_synthetic_normalization()
+
+
+def get_pool():
+    """This worker's parse processes, started on first use (after any gunicorn fork)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the web worker has threads (scheduler, background jobs) and locks.
+                _pool = ProcessPoolExecutor(
+                    max_workers=PARSE_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_worker
+                )
+    return _pool
+
+
+def start():
+    """Starts and warms the pool now instead of on the first large response."""
+    pool = get_pool()
+    for future in [pool.submit(_ping) for _ in range(PARSE_POOL_WORKERS)]:
+        future.result()
+
+
+def _ping():
+    return os.getpid()
+
+
+def to_records(offers):
+    """Compact form of a list of offers: (key tuples, rows of [key tuple index, *values])."""
+    schemas = []
+    schema_index = {}
+    rows = []
+    for offer in offers:
+        keys = tuple(offer.keys())
+        idx = schema_index.get(keys)
+        if idx is None:
+            idx = schema_index[keys] = len(schemas)
+            schemas.append(keys)
+        rows.append((idx,) + tuple(offer.values()))
+    return schemas, rows
+
+
+def from_records(records):
+    schemas, rows = records
+    return [intern_offer(dict(zip(schemas[row[0]], row[1:]))) for row in rows]
+
+
+def _parse_to_records(parse, payload, parse_args):
+    offers = parse(payload, *parse_args)
+    return None if offers is None else to_records(offers)
+
+
+def run_parse(provider_name, parse, payload, parse_args=(), size=0, min_size=PARSE_POOL_MIN_BYTES):
+    """
+    parse(payload, *parse_args), in a parse process when the pool is enabled and size >= min_size,
+    else in the calling thread. The provider call's thread just waits meanwhile (without the GIL).
+    """
+    global _pool
+    if not PARSE_POOL_ENABLED or size < min_size:
+        metrics.increment(f"parse_pool.{provider_name}.inline")
+        return parse(payload, *parse_args)
+    started = time.monotonic()
+    pool = get_pool()
+    try:
+        with profiling.span(f"{provider_name}.parse_pool", size=size):
+            records = pool.submit(_parse_to_records, parse, payload, tuple(parse_args)).result()
+    except (BrokenProcessPool, OSError) as e:
+        print(f"Parse Pool ERROR: {provider_name} parse process failed, parsing in-thread: {e}")
+        metrics.increment(f"parse_pool.{provider_name}.failed")
+        if isinstance(e, BrokenProcessPool):
+            with _pool_lock:
+                if _pool is pool: # the next large payload starts a fresh pool
+                    _pool = None
+        return parse(payload, *parse_args)
+    metrics.increment(f"parse_pool.{provider_name}.offloaded")
+    metrics.observe(f"parse_pool.{provider_name}.ms", (time.monotonic() - started) * 1000)
+    return None if records is None else from_records(records)
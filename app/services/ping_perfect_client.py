@@ -1,6 +1,11 @@
 # app/services/ping_perfect_client.py
 import os
 import requests
+from app.services import profiling
+from app.services.interning import intern_offer
+from app.services.http_session import get_session, register_provider_host
+from app.services.upstream_payload import read_payload
+from app.services.providers import timeout_for
 import time
 import hashlib
 import hmac
@@ -11,6 +16,7 @@ PING_PERFECT_BASE_URL = os.getenv("PING_PERFECT_BASE_URL", "https://pingperfect.
 PING_PERFECT_CLIENT_ID = os.getenv("PING_PERFECT_CLIENT_ID")
 PING_PERFECT_SIGNATURE_SECRET = os.getenv("PING_PERFECT_SIGNATURE_SECRET")
 PING_PERFECT_OFFERS_ENDPOINT = "/internet/angebote/data"
+register_provider_host(PING_PERFECT_BASE_URL, "PingPerfect")
 
 def _calculate_ping_perfect_signature(request_body_str, timestamp_seconds, secret):
     data_to_sign = f"{timestamp_seconds}:{request_body_str}"
@@ -83,7 +89,7 @@ def _normalize_ping_perfect_offer(offer_data, index):
             "dataLimitGb": limit_from_api,
             "_provider_specific_id": provider_specific_id,
         }
-        return normalized_offer
+        return intern_offer(normalized_offer)
     except Exception as e:
         print(f"Ping Perfect Norm Error: {e} for offer data: {str(offer_data)[:200]}...")
         return None
@@ -120,17 +126,21 @@ def fetch_ping_perfect_offers(address_details, wants_fiber_param=True): # Rename
 
     try:
         print(f"Ping Perfect Client: Sending request to {api_url}")
-        response = requests.post(api_url, data=request_body_str, headers=headers, timeout=20) # Timeout added
+        with profiling.span("PingPerfect.fetch", fiber=wants_fiber_param):
+            response = get_session().post(api_url, data=request_body_str, headers=headers, timeout=timeout_for("PingPerfect"), stream=True) # Timeout budget from the provider registry
+            read_payload(response, "PingPerfect")
         print(f"Ping Perfect Client: API response status: {response.status_code}")
         response.raise_for_status()
         
-        offers_list_json = response.json()
+        with profiling.span("PingPerfect.parse"):
+            offers_list_json = response.json()
         if isinstance(offers_list_json, list):
             print(f"Ping Perfect Client: Received {len(offers_list_json)} raw offers.")
-            for i, offer_item in enumerate(offers_list_json):
-                normalized = _normalize_ping_perfect_offer(offer_item, i)
-                if normalized:
-                    all_normalized_offers.append(normalized)
+            with profiling.span("PingPerfect.normalize", offers=len(offers_list_json)):
+                for i, offer_item in enumerate(offers_list_json):
+                    normalized = _normalize_ping_perfect_offer(offer_item, i)
+                    if normalized:
+                        all_normalized_offers.append(normalized)
         else:
             print(f"Ping Perfect Client WARNING: Expected list, got {type(offers_list_json)}. Resp: {str(offers_list_json)[:200]}")
             
@@ -138,16 +148,21 @@ def fetch_ping_perfect_offers(address_details, wants_fiber_param=True): # Rename
 
     except requests.exceptions.Timeout:
         print("Ping Perfect Client ERROR: Timeout during API request.")
+        return None
     except requests.exceptions.HTTPError as http_err:
         print(f"Ping Perfect Client HTTP ERROR: {http_err.response.status_code} - {http_err.response.text[:200]}")
+        return None
     except requests.exceptions.RequestException as req_err:
         print(f"Ping Perfect Client REQUEST EXCEPTION: {req_err}")
+        return None
     except ValueError as json_err: # JSONDecodeError
         print(f"Ping Perfect Client JSON DECODE ERROR: {json_err}. Response: {response.text[:200] if 'response' in locals() else 'N/A'}")
+        return None
     except Exception as e:
         print(f"Ping Perfect Client UNEXPECTED ERROR: {e}")
         import traceback
         traceback.print_exc()
+        return None
     
     return all_normalized_offers
 
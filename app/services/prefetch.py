@@ -0,0 +1,134 @@
+# app/services/prefetch.py
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.services import metrics
+from app.services.address import canonicalize_address
+from app.services.admission import AdmissionRejected
+from app.services.rate_limit import TokenBucket
+
+# Speculative prefetch. The address form calls POST /api/prefetch (debounced) once all four fields
+# are valid. That starts the provider calls for every task of the address whose cache entry is
+# missing or expired, in the scheduler's refresh lane, so they only use spare capacity. When the
+# user submits, the /api/offers search finds the cached results or joins the calls still in flight,
+# which moves them to the interactive lane. A newer prefetch from the same form (the address was
+# edited) cancels the previous one's calls that haven't started yet.
+#
+# Conversion: a search for an address this worker prefetched within PREFETCH_CONVERSION_WINDOW_SECONDS
+# counts as converted. Searches that land on another worker aren't seen, so the rate is a lower bound.
+#
+# The endpoint needs no login, so each client (remote address) also gets a token bucket of
+# PREFETCH_CLIENT_RATE_PER_SECOND / PREFETCH_CLIENT_BURST prefetches; beyond that it gets a 429
+# with Retry-After, like a search that isn't admitted. Buckets are per worker.
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_MAX_CALLS = int(os.getenv("PREFETCH_MAX_CALLS", "10")) # upstream calls one prefetch may start
+PREFETCH_MAX_ACTIVE = int(os.getenv("PREFETCH_MAX_ACTIVE", "50")) # prefetches with calls outstanding, per worker
+PREFETCH_CONVERSION_WINDOW_SECONDS = int(os.getenv("PREFETCH_CONVERSION_WINDOW_SECONDS", "300"))
+PREFETCH_CLIENT_RATE_PER_SECOND = float(os.getenv("PREFETCH_CLIENT_RATE_PER_SECOND", "0.5"))
+PREFETCH_CLIENT_BURST = int(os.getenv("PREFETCH_CLIENT_BURST", "5"))
+
+_PREFETCH_OWNER = "prefetch"
+_MAX_TRACKED = 5000
+
+_lock = threading.Lock()
+_prefetches = OrderedDict() # prefetch id -> {"address_key", "calls": [(cache_key, future)], "at"}
+_recent_addresses = OrderedDict() # address key -> monotonic time of the latest prefetch
+_client_buckets = OrderedDict() # client -> TokenBucket, least recently used first
+
+
+def _conversion_rate(counters):
+    # Prefetches superseded by a newer one from the same form (the user kept typing) don't count.
+    final = counters.get("prefetch.accepted", 0) - counters.get("prefetch.cancelled", 0)
+    return round(counters.get("prefetch.converted", 0) / final, 4) if final > 0 else 0.0
+
+
+metrics.register_derived("prefetch.conversion_rate", _conversion_rate)
+
+
+def _active_count_locked():
+    return sum(1 for p in _prefetches.values() if any(not f.done() for _, f in p["calls"]))
+
+
+def _admit_client(client):
+    """Takes one of the client's prefetch tokens; raises AdmissionRejected (429) if it has none left."""
+    if client is None or PREFETCH_CLIENT_RATE_PER_SECOND <= 0:
+        return
+    with _lock:
+        bucket = _client_buckets.get(client)
+        if bucket is None:
+            bucket = _client_buckets[client] = TokenBucket(PREFETCH_CLIENT_RATE_PER_SECOND, PREFETCH_CLIENT_BURST)
+        _client_buckets.move_to_end(client)
+        while len(_client_buckets) > _MAX_TRACKED:
+            _client_buckets.popitem(last=False)
+    if bucket.reserve(0) is None:
+        metrics.increment("prefetch.client_rate_limited")
+        raise AdmissionRejected(429, "prefetch_rate_limited", max(1, int(1 / PREFETCH_CLIENT_RATE_PER_SECOND + 0.999)))
+
+
+def start(address_payload, replaces=None, client=None):
+    """
+    Starts a prefetch for the address; returns {"prefetchId", "started"} or None if skipped
+    (disabled, or too many prefetches running in this worker).
+
+    :raises AdmissionRejected: When `client` (e.g. the remote address) is over its prefetch rate.
+    """
+    if not PREFETCH_ENABLED:
+        return None
+    _admit_client(client)
+    from app.services.aggregator import refresh_expiring
+    if replaces:
+        cancel(replaces)
+    address_payload, address_key = canonicalize_address(address_payload)
+    with _lock:
+        if _active_count_locked() >= PREFETCH_MAX_ACTIVE:
+            metrics.increment("prefetch.rejected")
+            return None
+    started = refresh_expiring(address_payload, time.time(), PREFETCH_MAX_CALLS, _PREFETCH_OWNER, lane="refresh")
+    prefetch_id = uuid.uuid4().hex[:16]
+    now = time.monotonic()
+    with _lock:
+        _prefetches[prefetch_id] = {
+            "address_key": address_key, "calls": [(cache_key, future) for cache_key, _, future in started], "at": now
+        }
+        _recent_addresses[address_key] = now
+        _recent_addresses.move_to_end(address_key)
+        while len(_prefetches) > _MAX_TRACKED:
+            _prefetches.popitem(last=False)
+        while len(_recent_addresses) > _MAX_TRACKED:
+            _recent_addresses.popitem(last=False)
+    metrics.increment("prefetch.accepted")
+    metrics.increment("prefetch.upstream_calls", len(started))
+    return {"prefetchId": prefetch_id, "started": len(started)}
+
+
+def cancel(prefetch_id):
+    """Cancels a prefetch's calls that haven't started and that no search has joined; returns how many."""
+    from app.services.aggregator import cancel_queued
+    with _lock:
+        prefetch = _prefetches.pop(prefetch_id, None)
+        if prefetch is None:
+            return 0
+        if _recent_addresses.get(prefetch["address_key"]) == prefetch["at"]:
+            del _recent_addresses[prefetch["address_key"]] # superseded: a later search isn't a conversion
+    cancelled = cancel_queued(prefetch["calls"])
+    metrics.increment("prefetch.cancelled")
+    metrics.increment("prefetch.calls_cancelled", cancelled)
+    return cancelled
+
+
+def note_search(address_payload):
+    """Called for every /api/offers search: counts it as converted if its address was prefetched recently."""
+    if not PREFETCH_ENABLED or not _recent_addresses:
+        return
+    _, address_key = canonicalize_address(address_payload)
+    with _lock:
+        prefetched_at = _recent_addresses.pop(address_key, None)
+    if prefetched_at is None:
+        return
+    lead_seconds = time.monotonic() - prefetched_at
+    if lead_seconds <= PREFETCH_CONVERSION_WINDOW_SECONDS:
+        metrics.increment("prefetch.converted")
+        metrics.observe("prefetch.lead_ms", lead_seconds * 1000) # head start the search got
@@ -0,0 +1,187 @@
+# app/services/profiling.py
+import contextvars
+import functools
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Opt-in request profiling. With PROFILING_ENABLED=true a request is profiled when it sends
+# "X-Profile: 1" (timeline only) or "X-Profile: cpu" (timeline plus a sampled CPU profile),
+# or at random for a PROFILING_SAMPLE_RATE fraction of requests. A profile is a timeline of
+# spans (route, cache lookups, admission wait, each provider call's queue wait, HTTP, parse
+# and normalize phases, JSON serialization). The scheduler copies contextvars into its
+# threads, so spans in provider calls land in the profile of the request that started them.
+# Finished profiles are kept in a ring buffer of PROFILING_BUFFER_SIZE and served by the
+# /api/admin/profiles endpoints. When PROFILING_ADMIN_TOKEN is set, both the X-Profile header
+# and the admin endpoints need a matching X-Admin-Token header.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_BUFFER_SIZE = int(os.getenv("PROFILING_BUFFER_SIZE", "50"))
+PROFILING_CPU_INTERVAL_MS = float(os.getenv("PROFILING_CPU_INTERVAL_MS", "5"))
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN")
+
+_MAX_STACK_DEPTH = 64
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+_buffer_lock = threading.Lock()
+_finished_profiles = deque(maxlen=PROFILING_BUFFER_SIZE)
+
+
+class Profile:
+    def __init__(self, name, cpu):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []
+        self.cpu_samples = Counter() if cpu else None
+        self._lock = threading.Lock()
+        self._thread_refs = Counter() # thread ident -> open spans, for the CPU sampler
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def offset_ms(self):
+        return (time.perf_counter() - self._t0) * 1000
+
+    def add_span(self, name, start_ms, end_ms, attrs):
+        span = {"name": name, "thread": threading.current_thread().name,
+                "startMs": round(start_ms, 3), "durationMs": round(end_ms - start_ms, 3)}
+        if attrs:
+            span["attrs"] = attrs
+        with self._lock:
+            self.spans.append(span)
+
+    def enter_thread(self):
+        with self._lock:
+            self._thread_refs[threading.get_ident()] += 1
+
+    def leave_thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._thread_refs[ident] -= 1
+            if self._thread_refs[ident] <= 0:
+                del self._thread_refs[ident]
+
+    # --- Statistical CPU profile: samples the stacks of threads currently working for this request ---
+    def start_sampler(self):
+        if self.cpu_samples is None:
+            return
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.id}", daemon=True)
+        self._sampler.start()
+
+    def _sample_loop(self):
+        interval = PROFILING_CPU_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            with self._lock:
+                idents = list(self._thread_refs)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < _MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    self.cpu_samples[";".join(reversed(stack))] += 1
+
+    def finish(self):
+        self.duration_ms = round(self.offset_ms(), 3)
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+    def summary(self):
+        return {"id": self.id, "name": self.name, "startedAt": self.started_at,
+                "durationMs": self.duration_ms, "spans": len(self.spans), "cpu": self.cpu_samples is not None}
+
+    def to_dict(self):
+        data = self.summary()
+        with self._lock:
+            data["timeline"] = sorted(self.spans, key=lambda s: s["startMs"])
+        if self.cpu_samples is not None:
+            data["cpuSamples"] = dict(self.cpu_samples.most_common())
+            data["cpuIntervalMs"] = PROFILING_CPU_INTERVAL_MS
+        return data
+
+    def collapsed_stacks(self):
+        """CPU samples in the collapsed-stack text format that flame graph tools read."""
+        return "".join(f"{stack} {count}\n" for stack, count in (self.cpu_samples or {}).items())
+
+
+@contextmanager
+def span(name, **attrs):
+    """Times a block as part of the current request's profile; a no-op when nothing is being profiled."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start_ms = profile.offset_ms()
+    profile.enter_thread()
+    try:
+        yield
+    finally:
+        profile.leave_thread()
+        profile.add_span(name, start_ms, profile.offset_ms(), attrs)
+
+
+def is_active():
+    return _current_profile.get() is not None
+
+
+def admin_token_ok(headers):
+    return not PROFILING_ADMIN_TOKEN or headers.get("X-Admin-Token") == PROFILING_ADMIN_TOKEN
+
+
+def _requested_mode(headers):
+    """None (don't profile), "timeline" or "cpu" for an incoming request."""
+    if not PROFILING_ENABLED:
+        return None
+    header = (headers.get("X-Profile") or "").lower()
+    if header and admin_token_ok(headers):
+        return "cpu" if header == "cpu" else "timeline"
+    if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        return "timeline"
+    return None
+
+
+def profiled(name):
+    """View decorator: profiles the request if asked to and returns the profile ID in X-Profile-Id."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import make_response, request
+            mode = _requested_mode(request.headers)
+            if mode is None:
+                return view(*args, **kwargs)
+            profile = Profile(name, cpu=(mode == "cpu"))
+            token = _current_profile.set(profile)
+            profile.start_sampler()
+            try:
+                with span("request", path=request.path):
+                    response = make_response(view(*args, **kwargs))
+            finally:
+                _current_profile.reset(token)
+                profile.finish()
+                with _buffer_lock:
+                    _finished_profiles.append(profile)
+            response.headers["X-Profile-Id"] = profile.id
+            return response
+        return wrapper
+    return decorator
+
+
+def list_profiles():
+    with _buffer_lock:
+        return [p.summary() for p in reversed(_finished_profiles)]
+
+
+def get_profile(profile_id):
+    with _buffer_lock:
+        return next((p for p in _finished_profiles if p.id == profile_id), None)
@@ -0,0 +1,155 @@
+# app/services/providers.py
+import importlib
+import os
+
+# Declarative provider registry. Each provider names its client function, the call variants a
+# search makes (one task per variant), a timeout budget and a bulkhead: the maximum number of
+# concurrent upstream calls this worker makes to that provider (enforced by the scheduler).
+#
+# Everything can be tuned per provider from the environment, with NAME upper-cased (e.g. WEBWUNDER):
+#   PROVIDER_<NAME>_ENABLED=false          drop the provider from searches
+#   PROVIDER_<NAME>_MAX_CONCURRENCY=4      bulkhead size
+#   PROVIDER_<NAME>_TIMEOUT_SECONDS=10     budget per call (HTTP timeout and search wait)
+#   PROVIDER_<NAME>_VARIANTS=DSL,FIBER     only run these variants
+#   PROVIDER_<NAME>_RATE_PER_SECOND=10     token-bucket rate for the provider's host (0 = no limit)
+#   PROVIDER_<NAME>_BURST=20               bucket size (see app/services/rate_limit.py)
+#   PROVIDER_<NAME>_MAX_PAYLOAD_BYTES=...  largest response body read (see app/services/upstream_payload.py)
+#
+# "fetch_raw"/"parse" are the split form used by bulk_compare.py to run parsing in another process.
+
+DEFAULT_TIMEOUT_SECONDS = 20
+_MB = 1024 * 1024
+DEFAULT_MAX_PAYLOAD_BYTES = 4 * _MB
+
+_PROVIDER_SPECS = [
+    {
+        "name": "ServusSpeed", "module": "app.services.servus_speed_client", "fetch": "get_servus_offers",
+        "variants": [{"name": None, "args": ()}],
+        "timeout_seconds": 25, "max_concurrency": 8,
+        "rate_per_second": 20, "burst": 40, "max_payload_bytes": 1 * _MB,
+    },
+    {
+        "name": "ByteMe", "module": "app.services.byteme_client", "fetch": "get_byteme_offers",
+        "variants": [{"name": None, "args": ()}],
+        "timeout_seconds": 20, "max_concurrency": 8,
+        "rate_per_second": 10, "burst": 20, "max_payload_bytes": 8 * _MB,
+    },
+    {
+        "name": "PingPerfect", "module": "app.services.ping_perfect_client", "fetch": "fetch_ping_perfect_offers",
+        "variants": [{"name": None, "args": (True,)}], # wantsFiber
+        "timeout_seconds": 20, "max_concurrency": 8,
+        "rate_per_second": 10, "burst": 20, "max_payload_bytes": 4 * _MB,
+    },
+    {
+        "name": "VerbynDich", "module": "app.services.verbyndich_client", "fetch": "fetch_verbyndich_offers",
+        "fetch_raw": "fetch_verbyndich_raw", "parse": "parse_verbyndich_items",
+        "variants": [{"name": None, "args": (), "parse_args": ()}],
+        "timeout_seconds": 15, "max_concurrency": 8,
+        "rate_per_second": 20, "burst": 20, "max_payload_bytes": 1 * _MB,
+    },
+    {
+        "name": "WebWunder", "module": "app.services.webwunder_client", "fetch": "fetch_webwunder_offers",
+        "fetch_raw": "fetch_webwunder_raw", "parse": "parse_webwunder_response",
+        # "MOBILE" often has no address check. Args are (connection type, installation).
+        "variants": [
+            {"name": conn_type, "args": (conn_type, True), "parse_args": (conn_type,)}
+            for conn_type in ("DSL", "CABLE", "FIBER")
+        ],
+        "timeout_seconds": 25, "max_concurrency": 12,
+        "rate_per_second": 15, "burst": 30, "max_payload_bytes": 4 * _MB,
+    },
+]
+
+
+def _env(provider_name, setting):
+    return os.getenv(f"PROVIDER_{provider_name.upper()}_{setting}")
+
+
+def _load_provider(spec):
+    provider = dict(spec)
+    name = spec["name"]
+    provider["enabled"] = (_env(name, "ENABLED") or "true").lower() == "true"
+    provider["max_concurrency"] = int(_env(name, "MAX_CONCURRENCY") or spec["max_concurrency"])
+    provider["timeout_seconds"] = float(_env(name, "TIMEOUT_SECONDS") or spec["timeout_seconds"])
+    provider["rate_per_second"] = float(_env(name, "RATE_PER_SECOND") or spec["rate_per_second"])
+    provider["burst"] = max(1, int(_env(name, "BURST") or spec["burst"]))
+    provider["max_payload_bytes"] = int(_env(name, "MAX_PAYLOAD_BYTES") or spec["max_payload_bytes"])
+    variant_filter = _env(name, "VARIANTS")
+    if variant_filter:
+        wanted = {v.strip().upper() for v in variant_filter.split(",") if v.strip()}
+        provider["variants"] = [v for v in spec["variants"] if v["name"] is None or v["name"].upper() in wanted]
+    return provider
+
+
+PROVIDERS = {spec["name"]: _load_provider(spec) for spec in _PROVIDER_SPECS}
+
+
+def enabled_providers():
+    return [p for p in PROVIDERS.values() if p["enabled"]]
+
+
+def max_concurrency_by_provider():
+    """Bulkhead sizes for the scheduler, keyed by provider name."""
+    return {p["name"]: p["max_concurrency"] for p in PROVIDERS.values()}
+
+
+def max_concurrency_for(provider_name):
+    """Bulkhead size of provider_name (0 for unknown providers)."""
+    provider = PROVIDERS.get(provider_name)
+    return provider["max_concurrency"] if provider else 0
+
+
+def timeout_for(provider_name):
+    """Timeout budget in seconds for one upstream call to provider_name."""
+    provider = PROVIDERS.get(provider_name)
+    return provider["timeout_seconds"] if provider else DEFAULT_TIMEOUT_SECONDS
+
+
+def max_payload_bytes_for(provider_name):
+    """Largest upstream response body read for provider_name (per HTTP response, e.g. one page)."""
+    provider = PROVIDERS.get(provider_name)
+    return provider["max_payload_bytes"] if provider else DEFAULT_MAX_PAYLOAD_BYTES
+
+
+def rate_limit_for(provider_name):
+    """(requests per second, burst) for provider_name's host, or None if it isn't rate limited."""
+    provider = PROVIDERS.get(provider_name)
+    if provider is None or provider["rate_per_second"] <= 0:
+        return None
+    return provider["rate_per_second"], provider["burst"]
+
+
+def task_name(provider, variant):
+    return f"{provider['name']}-{variant['name']}" if variant["name"] else provider["name"]
+
+
+def resolve(provider, attribute):
+    """The client function named by provider[attribute], imported on first use."""
+    # Provider clients (and lxml) are imported on first use rather than at worker boot.
+    # After the first search these are just sys.modules lookups.
+    return getattr(importlib.import_module(provider["module"]), provider[attribute])
+
+
+def build_tasks(address_payload, raw=False):
+    """
+    One task per enabled provider variant: {"name", "provider", "func", "args", "timeout"}.
+    With raw=True the tasks call the provider's fetch_raw function where it has one, and carry
+    "parse"/"parse_args" for turning the raw payload into offers.
+    """
+    tasks = []
+    for provider in enabled_providers():
+        use_raw = raw and "fetch_raw" in provider
+        func = resolve(provider, "fetch_raw" if use_raw else "fetch")
+        for variant in provider["variants"]:
+            task = {
+                "name": task_name(provider, variant),
+                "provider": provider["name"],
+                "func": func,
+                "args": (address_payload,) + tuple(variant["args"]),
+                "timeout": provider["timeout_seconds"],
+            }
+            if use_raw:
+                task["parse"] = resolve(provider, "parse")
+                task["parse_args"] = tuple(variant.get("parse_args", ()))
+            tasks.append(task)
+    return tasks
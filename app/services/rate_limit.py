@@ -0,0 +1,180 @@
+# app/services/rate_limit.py
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+
+from app.services import metrics, providers
+from app.services.local_store import default_path, get_connection
+
+# Token-bucket rate limits per provider host, applied to every request sent through the shared
+# HTTP session (app/services/http_session.py). Each client registers its host under its provider
+# name; rate and burst come from the provider registry (PROVIDER_<NAME>_RATE_PER_SECOND, 0 = no
+# limit, and PROVIDER_<NAME>_BURST). Callers reserve tokens in arrival order and sleep until their
+# turn, but never longer than the request's timeout: a call that can't be sent in time fails
+# with RateLimitTimeout, which the clients handle like any other timeout. Calls made for a search
+# are also bounded by the search's deadline for that task (see deadline(); the scheduler copies it
+# into the call's thread): waiting past it would only produce an answer nobody reads.
+# By default each worker has its own buckets. With HTTP_RATE_LIMIT_SHARED=true the buckets live
+# in a host-local SQLite file, so the limit holds for all workers on the host together.
+HTTP_RATE_LIMIT_ENABLED = os.getenv("HTTP_RATE_LIMIT_ENABLED", "true").lower() == "true"
+HTTP_RATE_LIMIT_SHARED = os.getenv("HTTP_RATE_LIMIT_SHARED", "false").lower() == "true"
+HTTP_RATE_LIMIT_DB_PATH = os.getenv("HTTP_RATE_LIMIT_DB_PATH", default_path("offer_cache.db"))
+# Longest wait for requests sent without a timeout.
+HTTP_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("HTTP_RATE_LIMIT_MAX_WAIT_SECONDS", "10"))
+
+
+class RateLimitTimeout(requests.exceptions.Timeout):
+    """No token could be had before the request's deadline."""
+
+
+_deadline = contextvars.ContextVar("rate_limit_deadline", default=None)
+
+
+@contextmanager
+def deadline(at):
+    """Requests started (or submitted to the scheduler) inside the block must be sent by `at` (time.monotonic())."""
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class TokenBucket:
+    """Per-worker bucket. Tokens may go negative: that is the queue of reservations ahead."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """Seconds to wait before sending, or None if that would exceed max_wait (nothing reserved)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class SharedTokenBucket:
+    """The same bucket kept in SQLite, shared by every worker on the host."""
+
+    _schema_lock = threading.Lock()
+    _schema_ready = False
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def _connect(self):
+        conn = get_connection(HTTP_RATE_LIMIT_DB_PATH)
+        if not SharedTokenBucket._schema_ready:
+            with SharedTokenBucket._schema_lock:
+                if not SharedTokenBucket._schema_ready:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                        " bucket TEXT PRIMARY KEY,"
+                        " tokens REAL NOT NULL,"
+                        " updated_at REAL NOT NULL)"
+                    )
+                    SharedTokenBucket._schema_ready = True
+        return conn
+
+    def reserve(self, max_wait):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket = ?", (self.key,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if wait > max_wait:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit_buckets (bucket, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.key, tokens - 1, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+_lock = threading.Lock()
+_host_providers = {} # host -> provider name
+_buckets = {} # provider name -> bucket (None: not limited)
+
+
+def register_host(url, provider_name):
+    """Puts requests to url's host under provider_name's rate limit."""
+    host = urlsplit(url).hostname
+    if host:
+        with _lock:
+            _host_providers[host] = provider_name
+
+
+def _bucket_for(provider_name):
+    with _lock:
+        if provider_name not in _buckets:
+            limit = providers.rate_limit_for(provider_name)
+            if limit is None:
+                _buckets[provider_name] = None
+            elif HTTP_RATE_LIMIT_SHARED:
+                _buckets[provider_name] = SharedTokenBucket(provider_name, *limit)
+            else:
+                _buckets[provider_name] = TokenBucket(*limit)
+        return _buckets[provider_name]
+
+
+def _max_wait(timeout):
+    if isinstance(timeout, tuple): # (connect, read)
+        timeout = timeout[0]
+    return HTTP_RATE_LIMIT_MAX_WAIT_SECONDS if timeout is None else float(timeout)
+
+
+def acquire(url, timeout):
+    """
+    Blocks until a request to url may be sent; raises RateLimitTimeout if that's later than timeout
+    or the current search deadline.
+    """
+    if not HTTP_RATE_LIMIT_ENABLED:
+        return
+    provider_name = _host_providers.get(urlsplit(url).hostname)
+    if provider_name is None:
+        return
+    bucket = _bucket_for(provider_name)
+    if bucket is None:
+        return
+    max_wait = _max_wait(timeout)
+    search_deadline = _deadline.get()
+    if search_deadline is not None:
+        max_wait = min(max_wait, search_deadline - time.monotonic())
+    try:
+        wait = bucket.reserve(max_wait)
+    except sqlite3.Error as e:
+        # Don't fail provider calls because the shared bucket is unavailable.
+        print(f"Rate Limit ERROR: Shared bucket for {provider_name} unavailable, sending unthrottled: {e}")
+        return
+    if wait is None:
+        metrics.increment(f"rate_limit.{provider_name}.rejected")
+        raise RateLimitTimeout(f"{provider_name} rate limit: no slot before the request timeout or search deadline")
+    metrics.observe(f"rate_limit.{provider_name}.wait_ms", wait * 1000)
+    if wait > 0:
+        metrics.increment(f"rate_limit.{provider_name}.throttled")
+        time.sleep(wait)
@@ -0,0 +1,142 @@
+# app/services/result_sets.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from app.services.local_store import default_path, get_connection
+
+# Result sets: each /api/offers response is stored for RESULT_SET_TTL_SECONDS under an ID,
+# with its offers and status per provider task. A retry re-runs only the tasks that failed,
+# timed out or came back partial and merges their offers into the stored set, instead of a
+# whole new search.
+RESULT_SETS_ENABLED = os.getenv("RESULT_SETS_ENABLED", "true").lower() == "true"
+RESULT_SET_DB_PATH = os.getenv("RESULT_SET_DB_PATH", default_path("offer_cache.db"))
+RESULT_SET_TTL_SECONDS = int(os.getenv("RESULT_SET_TTL_SECONDS", "3600"))
+# Expired rows are deleted every N saves.
+_PURGE_EVERY_SAVES = 200
+
+RETRYABLE_STATUSES = ("error", "timeout", "partial")
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+_saves_since_purge = 0
+
+
+def _connect():
+    global _schema_ready
+    conn = get_connection(RESULT_SET_DB_PATH)
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS result_sets ("
+                    " id TEXT PRIMARY KEY,"
+                    " payload BLOB NOT NULL,"
+                    " expires_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_result_sets_expires_at ON result_sets (expires_at)")
+                _schema_ready = True
+    return conn
+
+
+def _encode(result_set):
+    return zlib.compress(json.dumps(result_set, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 6)
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def failed_tasks(result_set):
+    return [name for name, task in result_set["tasks"].items() if task["status"] in RETRYABLE_STATUSES]
+
+
+def offers_of(result_set):
+    return [offer for task in result_set["tasks"].values() for offer in task["offers"]]
+
+
+def providers_of(result_set):
+    return {name: {"status": task["status"], "count": task["count"]} for name, task in result_set["tasks"].items()}
+
+
+def _tasks_from_result(result):
+    return {
+        name: {"status": status["status"], "count": status["count"], "offers": result["task_offers"].get(name, [])}
+        for name, status in result["providers"].items()
+    }
+
+
+def save(address_payload, result):
+    """Stores an aggregation result and returns its ID (None when disabled or on a storage error)."""
+    global _saves_since_purge
+    if not RESULT_SETS_ENABLED:
+        return None
+    result_set_id = uuid.uuid4().hex
+    result_set = {"address": address_payload, "tasks": _tasks_from_result(result), "stale": result["stale"]}
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute(
+            "INSERT INTO result_sets (id, payload, expires_at) VALUES (?, ?, ?)",
+            (result_set_id, _encode(result_set), now + RESULT_SET_TTL_SECONDS)
+        )
+        _saves_since_purge += 1
+        if _saves_since_purge >= _PURGE_EVERY_SAVES:
+            _saves_since_purge = 0
+            conn.execute("DELETE FROM result_sets WHERE expires_at < ?", (now,))
+    except sqlite3.Error as e:
+        print(f"Result Sets ERROR: Could not store result set: {e}")
+        return None
+    return result_set_id
+
+
+def load(result_set_id):
+    """The stored result set ({"address", "tasks", "stale"}) or None if unknown or expired."""
+    try:
+        row = _connect().execute(
+            "SELECT payload FROM result_sets WHERE id = ? AND expires_at >= ?", (result_set_id, time.time())
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Result Sets ERROR: Could not read result set {result_set_id}: {e}")
+        return None
+    return _decode(row[0]) if row else None
+
+
+def merge_tasks(result_set, result):
+    """Replaces the tasks of result_set that are still failed with the ones in `result`, in place."""
+    for name, task in _tasks_from_result(result).items():
+        stored = result_set["tasks"].get(name)
+        if stored is None or stored["status"] in RETRYABLE_STATUSES:
+            result_set["tasks"][name] = task
+    result_set["stale"] = result_set["stale"] or result["stale"]
+    return result_set
+
+
+def merge(result_set_id, result):
+    """
+    Merges `result` into the stored set (see merge_tasks) and returns the merged set, or None if
+    the set is gone or on a storage error. Runs in one write transaction, so concurrent retries
+    of the same set each only fill in what is still missing.
+    """
+    try:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT payload FROM result_sets WHERE id = ?", (result_set_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            result_set = merge_tasks(_decode(row[0]), result)
+            conn.execute("UPDATE result_sets SET payload = ? WHERE id = ?", (_encode(result_set), result_set_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        print(f"Result Sets ERROR: Could not merge into result set {result_set_id}: {e}")
+        return None
+    return result_set
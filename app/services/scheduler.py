@@ -0,0 +1,217 @@
+# app/services/scheduler.py
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.services import metrics, profiling, providers
+
+# Per-provider caps (bulkheads) come from the provider registry and are shared by every search
+# in this worker. The thread pool is sized to their sum, so one slow provider can never use up
+# the threads another provider needs.
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Priority lanes, highest first. Each lane reserves a share of every provider's cap
+# (SCHEDULER_LANE_<LANE>_RESERVED, a fraction of the cap, rounded down). A lane may borrow
+# idle capacity beyond its reservation, but never the unused reservation of a higher lane,
+# or of a lower lane that has calls waiting. So background work only fills spare capacity,
+# and a user search always finds its reserved slots free. Queued calls are always started
+# highest lane first. Calls that are already running are never interrupted.
+LANES = ("interactive", "refresh", "batch")
+LANE_RESERVED_FRACTIONS = {
+    lane: float(os.getenv(f"SCHEDULER_LANE_{lane.upper()}_RESERVED", default))
+    for lane, default in (("interactive", "0.5"), ("refresh", "0.125"), ("batch", "0.125"))
+}
+
+
+class ProviderScheduler:
+    """
+    Runs provider calls on one shared thread pool with a concurrency cap per provider.
+    Calls over the cap wait in a per-provider queue per priority lane. Within a lane the queue
+    is split by owner (a search, a batch job) and served round-robin, so a batch of thousands
+    of addresses interleaves fairly with everyone else in its lane instead of being drained
+    first-come-first-served.
+    """
+
+    def __init__(self, max_concurrency, default_max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 reserved_fractions=None):
+        self._caps = dict(max_concurrency)
+        self._default_cap = default_max_concurrency
+        self._reserved_fractions = dict(reserved_fractions or LANE_RESERVED_FRACTIONS)
+        self._lock = threading.Lock()
+        self._in_flight = defaultdict(int)
+        self._lane_in_flight = defaultdict(lambda: dict.fromkeys(LANES, 0)) # provider -> lane -> running calls
+        # provider -> lane -> owner -> deque of pending calls
+        self._queues = defaultdict(lambda: {lane: OrderedDict() for lane in LANES})
+        self._queued_calls = {} # future -> (provider, lane, owner) while queued
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(sum(self._caps.values()), 1), thread_name_prefix="provider-call"
+        )
+
+    def cap_for(self, provider):
+        return self._caps.get(provider, self._default_cap)
+
+    def reserved_for(self, provider):
+        """Slots of provider's cap reserved per lane."""
+        cap = self.cap_for(provider)
+        return {lane: int(cap * self._reserved_fractions.get(lane, 0)) for lane in LANES}
+
+    def submit(self, provider, func, args=(), owner=None, lane="interactive"):
+        """Queues func(*args) in lane under provider's cap and returns a Future for its result."""
+        if lane not in LANES:
+            raise ValueError(f"Unknown scheduler lane: {lane}")
+        future = Future()
+        # Run the call with the submitter's contextvars, as if it had been called inline.
+        call = (future, func, args, contextvars.copy_context(), time.monotonic())
+        with self._lock:
+            self._enqueue_locked(provider, lane, owner, call)
+            self._dispatch_locked(provider)
+        return future
+
+    def promote(self, future, lane):
+        """
+        Moves a still-queued call up to lane (e.g. a user search joining a batch call for the
+        same address), so it doesn't wait behind lower-priority work. No-op otherwise.
+        """
+        with self._lock:
+            location = self._queued_calls.get(future)
+            if location is None:
+                return False
+            provider, current_lane, owner = location
+            if LANES.index(lane) >= LANES.index(current_lane):
+                return False
+            call = self._remove_queued_locked(future)
+            self._enqueue_locked(provider, lane, owner, call)
+            metrics.increment(f"scheduler.{current_lane}.promoted")
+            self._dispatch_locked(provider)
+            return True
+
+    def unqueue(self, future, lanes=("refresh", "batch")):
+        """
+        Takes a call that is still queued in one of lanes out of the queue, so it never runs.
+        Returns True if it was; the caller then cancels the future. Running calls and calls
+        promoted to a higher lane are left alone.
+        """
+        with self._lock:
+            location = self._queued_calls.get(future)
+            if location is None or location[1] not in lanes:
+                return False
+            self._remove_queued_locked(future)
+            return True
+
+    def queued(self, provider, lane=None):
+        with self._lock:
+            lanes = LANES if lane is None else (lane,)
+            return sum(len(q) for l in lanes for q in self._queues[provider][l].values())
+
+    def in_flight(self, provider, lane=None):
+        with self._lock:
+            return self._in_flight[provider] if lane is None else self._lane_in_flight[provider][lane]
+
+    def _enqueue_locked(self, provider, lane, owner, call):
+        owners = self._queues[provider][lane]
+        owner_queue = owners.get(owner)
+        if owner_queue is None:
+            owner_queue = owners[owner] = deque()
+        owner_queue.append(call)
+        self._queued_calls[call[0]] = (provider, lane, owner)
+
+    def _remove_queued_locked(self, future):
+        provider, lane, owner = self._queued_calls.pop(future)
+        owner_queue = self._queues[provider][lane][owner]
+        call = next(c for c in owner_queue if c[0] is future)
+        owner_queue.remove(call)
+        if not owner_queue:
+            del self._queues[provider][lane][owner]
+        return call
+
+    def _next_call_locked(self, provider, lane):
+        owners = self._queues[provider][lane]
+        while owners:
+            owner, owner_queue = next(iter(owners.items()))
+            call = owner_queue.popleft()
+            if owner_queue:
+                owners.move_to_end(owner) # round-robin between owners
+            else:
+                del owners[owner]
+            del self._queued_calls[call[0]]
+            if call[0].set_running_or_notify_cancel():
+                return call
+            # Cancelled while queued; skip it.
+        return None
+
+    def _can_start_locked(self, provider, lane):
+        cap = self.cap_for(provider)
+        if self._in_flight[provider] >= cap:
+            return False
+        running = self._lane_in_flight[provider]
+        reserved = self.reserved_for(provider)
+        if running[lane] < reserved[lane]:
+            return True
+        # Borrowing: leave the unused reservations of higher lanes, and of lower lanes with calls waiting.
+        rank = LANES.index(lane)
+        held = sum(
+            max(0, reserved[other] - running[other])
+            for i, other in enumerate(LANES)
+            if other != lane and (i < rank or self._queues[provider][other])
+        )
+        return cap - self._in_flight[provider] - 1 >= held
+
+    def _dispatch_locked(self, provider):
+        queues = self._queues[provider]
+        started = True
+        while started:
+            started = False
+            for rank, lane in enumerate(LANES):
+                if not queues[lane] or not self._can_start_locked(provider, lane):
+                    continue
+                call = self._next_call_locked(provider, lane)
+                if call is None:
+                    continue
+                for lower in LANES[rank + 1:]:
+                    # Queued lower-priority work that could have had this slot.
+                    if queues[lower] and self._can_start_locked(provider, lower):
+                        metrics.increment(f"scheduler.{lower}.preempted")
+                self._in_flight[provider] += 1
+                self._lane_in_flight[provider][lane] += 1
+                self._executor.submit(self._run, provider, lane, call)
+                started = True
+                break
+
+    def _run(self, provider, lane, call):
+        future, func, args, context, queued_at = call
+        started_at = time.monotonic()
+        metrics.observe(f"scheduler.{lane}.queue_ms", (started_at - queued_at) * 1000)
+        try:
+            result = context.run(_call_with_span, provider, lane, func, args, queued_at)
+        except BaseException as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+        finally:
+            metrics.observe(f"scheduler.{lane}.call_ms", (time.monotonic() - started_at) * 1000)
+            with self._lock:
+                self._in_flight[provider] -= 1
+                self._lane_in_flight[provider][lane] -= 1
+                self._dispatch_locked(provider)
+
+
+def _call_with_span(provider, lane, func, args, queued_at):
+    # queueMs is the time spent waiting for the provider's cap (the bulkhead) and the lane's share of it.
+    with profiling.span(f"{provider}.call", lane=lane, queueMs=round((time.monotonic() - queued_at) * 1000, 3)):
+        return func(*args)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Process-wide scheduler, created on first use (after any gunicorn fork)."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ProviderScheduler(providers.max_concurrency_by_provider())
+    return _scheduler
@@ -1,7 +1,14 @@
 import requests
+from app.services import profiling
+from app.services.interning import intern_offer
+from app.services.http_session import get_session, register_provider_host
+from app.services.upstream_payload import read_payload
+from app.services.providers import timeout_for
 # from flask import current_app # Not used in this snippet directly
 from requests.auth import HTTPBasicAuth
+import contextvars
 import os
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed # Added for concurrency
 from datetime import datetime
 import time
@@ -10,6 +17,22 @@ BASE_URL = "https://servus-speed.gendev7.check24.fun" # Corrected from your code
 USERNAME = os.getenv("SERVUS_SPEED_USERNAME")
 PASSWORD = os.getenv("SERVUS_SPEED_PASSWORD")
 
+# Product detail calls from every Servus Speed search share one pool instead of each
+# search starting its own threads.
+SERVUS_DETAIL_MAX_WORKERS = int(os.getenv("SERVUS_DETAIL_MAX_WORKERS", "16"))
+register_provider_host(BASE_URL, "ServusSpeed", extra_connections=SERVUS_DETAIL_MAX_WORKERS)
+_detail_executor = None
+_detail_executor_lock = threading.Lock()
+
+
+def _get_detail_executor():
+    global _detail_executor
+    if _detail_executor is None:
+        with _detail_executor_lock:
+            if _detail_executor is None:
+                _detail_executor = ThreadPoolExecutor(max_workers=SERVUS_DETAIL_MAX_WORKERS, thread_name_prefix="servus-detail")
+    return _detail_executor
+
 def _normalize_servus_speed_offer(product_detail_data, product_id):
     """
     Transforms raw product detail data from Servus Speed API
@@ -95,7 +118,7 @@ def _normalize_servus_speed_offer(product_detail_data, product_id):
         "_provider_specific_id": product_id,
         "discount": discount
     }
-    return normalized_offer
+    return intern_offer(normalized_offer)
 
 
 def _fetch_single_product_detail(product_id, address_payload, auth_obj, headers_obj):
@@ -113,21 +136,26 @@ def _fetch_single_product_detail(product_id, address_payload, auth_obj, headers_
     
     try:
         # print(f"Servus Speed (Thread for {product_id} at {time.strftime('%H:%M:%S')}): Requesting details...")
-        response_step2 = requests.post(
-            detail_url,
-            json={"address": address_payload}, 
-            headers=headers_obj,
-            auth=auth_obj,
-            # timeout=25
-        )
+        with profiling.span("ServusSpeed.fetch_detail", product=product_id):
+            response_step2 = get_session().post(
+                detail_url,
+                json={"address": address_payload}, 
+                headers=headers_obj,
+                auth=auth_obj,
+                timeout=timeout_for("ServusSpeed"), # Timeout budget from the provider registry
+                stream=True
+            )
+            read_payload(response_step2, "ServusSpeed")
         response_received_time = time.time()
         # print(f"Servus Speed (Thread for {product_id} at {time.strftime('%H:%M:%S')}): Response received in {response_received_time - start_time:.2f}s. Status: {response_step2.status_code}")
         response_step2.raise_for_status()
-        product_detail_data = response_step2.json()
+        with profiling.span("ServusSpeed.parse", product=product_id):
+            product_detail_data = response_step2.json()
         json_parsed_time = time.time()
         # print(f"Servus Speed (Thread for {product_id} at {time.strftime('%H:%M:%S')}): JSON parsed in {json_parsed_time - response_received_time:.2f}s.")
 
-        normalized_offer = _normalize_servus_speed_offer(product_detail_data, product_id)
+        with profiling.span("ServusSpeed.normalize", product=product_id):
+            normalized_offer = _normalize_servus_speed_offer(product_detail_data, product_id)
         if normalized_offer:
             return normalized_offer
         else:
@@ -164,13 +192,16 @@ def get_servus_offers(address): # 'address' here is the payload for the API, e.g
     product_ids = []
     try:
         print(f"Servus Speed (Step 1) at {datetime.now()}: Requesting available products with payload: {address}")
-        response_step1 = requests.post(
-            available_products_url,
-            json={"address": address}, 
-            headers=headers,
-            auth=auth,
-            timeout=15
-        )
+        with profiling.span("ServusSpeed.fetch_products"):
+            response_step1 = get_session().post(
+                available_products_url,
+                json={"address": address}, 
+                headers=headers,
+                auth=auth,
+                timeout=timeout_for("ServusSpeed"),
+                stream=True
+            )
+            read_payload(response_step1, "ServusSpeed")
         response_step1.raise_for_status()
         
         product_ids_data = response_step1.json()
@@ -178,19 +209,20 @@ def get_servus_offers(address): # 'address' here is the payload for the API, e.g
     
         if not isinstance(product_ids, list):
             print(f"Servus Speed (Step 1): Expected list of product IDs, but got: {type(product_ids)}. Response: {product_ids_data}")
-            return []
+            return None
         
         print(f"Servus Speed (Step 1): Received {len(product_ids)} product IDs: {product_ids}")
 
+    # Failures return None (not []) so callers can tell them apart from "no products at this address".
     except requests.exceptions.Timeout:
         print("Servus Speed (Step 1): Timeout fetching available products.")
-        return []
+        return None
     except requests.exceptions.HTTPError as e:
         print(f"Servus Speed (Step 1): HTTP error fetching available products: {e.response.status_code} - {e.response.text}")
-        return []
+        return None
     except Exception as e:
         print(f"Servus Speed (Step 1): Unexpected error: {e}")
-        return []
+        return None
     
     if not product_ids:
         print("Servus Speed: No product IDs found for the address.")
@@ -198,29 +230,30 @@ def get_servus_offers(address): # 'address' here is the payload for the API, e.g
 
     # --- Step 2: Get details for each product ID CONCURRENTLY ---
     all_normalized_offers = []
-    # max_workers: Number of threads. Adjust based on testing.
-    # For I/O-bound tasks, more workers can be beneficial up to a point.
-    with ThreadPoolExecutor(max_workers=5) as executor:
-
-        # Create a list of future objects
-        future_to_product_id = {
-            executor.submit(_fetch_single_product_detail, pid, address, auth, headers): pid 
-            for pid in product_ids if isinstance(pid, str) and pid.strip() # Basic validation of product_id
-        }
-        
-        print(f"Servus Speed (Step 2): Submitted {len(future_to_product_id)} tasks to ThreadPoolExecutor.")
-
-        for future in as_completed(future_to_product_id):
-            # product_id_completed = future_to_product_id[future] # For logging if needed
-            try:
-                result = future.result() # This will raise an exception if one occurred in the thread
-                if result:
-                    all_normalized_offers.append(result)
-            except Exception as exc:
-                # This catches exceptions from _fetch_single_product_detail if not caught internally,
-                # or from future.result() itself if the task was cancelled, etc.
-                # pid_for_exc = future_to_product_id[future] # Get ID for logging
-                print(f"Servus Speed (Step 2): A task for a product ID generated an exception: {exc}")
+    executor = _get_detail_executor()
+    # Create a list of future objects
+    # Each detail call runs in a copy of this context, so profiling spans follow it into the pool.
+    future_to_product_id = {
+        executor.submit(contextvars.copy_context().run, _fetch_single_product_detail, pid, address, auth, headers): pid 
+        for pid in product_ids if isinstance(pid, str) and pid.strip() # Basic validation of product_id
+    }
+    
+    print(f"Servus Speed (Step 2): Submitted {len(future_to_product_id)} tasks to the shared detail pool.")
+
+    for future in as_completed(future_to_product_id):
+        # product_id_completed = future_to_product_id[future] # For logging if needed
+        try:
+            result = future.result() # This will raise an exception if one occurred in the thread
+            if result:
+                all_normalized_offers.append(result)
+        except Exception as exc:
+            # This catches exceptions from _fetch_single_product_detail if not caught internally,
+            # or from future.result() itself if the task was cancelled, etc.
+            # pid_for_exc = future_to_product_id[future] # Get ID for logging
+            print(f"Servus Speed (Step 2): A task for a product ID generated an exception: {exc}")
 
     print(f"Servus Speed at {datetime.now()}: Successfully fetched and normalized {len(all_normalized_offers)} offers out of {len(product_ids)} product IDs using threads.")
+    if not all_normalized_offers:
+        # Products were available but every detail call failed; report it as a failure.
+        return None
     return all_normalized_offers
@@ -0,0 +1,335 @@
+# app/services/share_journal.py
+import atexit
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+from app.services import metrics
+from app.services.local_store import default_path
+
+try:
+    import fcntl # Serializes appends and flushes across the workers on a host
+except ImportError: # Windows: single-process development only
+    fcntl = None
+
+# Write-behind share creation (SHARE_WRITE_BEHIND_ENABLED=true). POST /api/share appends the new
+# link to a host-local append-only journal and returns as soon as the line is on disk, instead
+# of waiting for a database commit. Each worker's flusher thread moves the journal into the
+# database every SHARE_FLUSH_INTERVAL_SECONDS with multi-row INSERTs of up to
+# SHARE_FLUSH_BATCH_SIZE, then truncates it. Reads check the pending links first.
+#
+# Durability: with SHARE_JOURNAL_FSYNC (the default) a share ID is only returned after its journal
+# line has been fsync'd, so an acknowledged link survives a worker or host crash. The next flush
+# (from any worker, including right after a restart) inserts it. Until then it exists only on
+# this host's disk. Every line carries a CRC32, so a line torn by a crash mid-write is skipped
+# (it was never acknowledged). Replaying a journal is idempotent: IDs already in the database
+# are skipped.
+#
+# Only one flusher runs at a time on a host (a non-blocking flock on SHARE_JOURNAL_PATH + ".flush";
+# a worker that finds it taken skips its pass), and inserts ignore IDs that already exist, so
+# overlapping flushes can't fail on duplicate keys. Reads of links created by another worker use
+# a per-worker index of journal offsets that is extended with the lines appended since the last
+# lookup, instead of re-reading the whole journal.
+SHARE_WRITE_BEHIND_ENABLED = os.getenv("SHARE_WRITE_BEHIND_ENABLED", "false").lower() == "true"
+SHARE_JOURNAL_PATH = os.getenv("SHARE_JOURNAL_PATH", default_path("share_journal.log"))
+SHARE_JOURNAL_FSYNC = os.getenv("SHARE_JOURNAL_FSYNC", "true").lower() == "true"
+SHARE_FLUSH_INTERVAL_SECONDS = float(os.getenv("SHARE_FLUSH_INTERVAL_SECONDS", "0.5"))
+SHARE_FLUSH_BATCH_SIZE = int(os.getenv("SHARE_FLUSH_BATCH_SIZE", "500"))
+# This worker keeps its own recent shares in memory for reads; older ones are looked up in the journal.
+_MEMORY_TTL_SECONDS = 60
+
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+_file_lock = threading.Lock() # threads of this worker; flock covers the other workers
+_pending_lock = threading.Lock()
+_pending = {} # share id -> (record, added at monotonic)
+_flush_wakeup = threading.Event()
+_flush_lock = threading.Lock() # this worker's flusher thread, atexit and CLI; flock covers the other workers
+_index_lock = threading.Lock()
+_index = {} # share id -> (offset, length) of its journal line
+_indexed_up_to = 0 # journal bytes indexed so far
+_indexed_head = b"" # the journal's first line when it was indexed; changes when a flush truncates
+
+
+class _JournalLock:
+    """Exclusive lock on the journal for this thread and, where fcntl exists, across processes."""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def acquire(self):
+        _file_lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        _file_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _encode_line(record):
+    body = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+    return f"{zlib.crc32(body.encode('utf-8')):08x} {body}\n".encode("utf-8")
+
+
+def _decode_line(line):
+    """The record of a journal line, or None for a torn or corrupt line."""
+    try:
+        text = line.decode("utf-8").rstrip("\n")
+        checksum, body = text.split(" ", 1)
+        if int(checksum, 16) != zlib.crc32(body.encode("utf-8")):
+            return None
+        return json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def _open_journal():
+    return os.open(SHARE_JOURNAL_PATH, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+
+
+def append(share_id, offers_json, created_at, expires_at):
+    """
+    Durably records a new share link in the journal. Raises OSError if it could not be written;
+    the link must then not be acknowledged.
+    """
+    record = {
+        "id": share_id, "offers_json": offers_json,
+        "created_at": created_at.strftime(_DATETIME_FORMAT),
+        "expires_at": expires_at.strftime(_DATETIME_FORMAT) if expires_at else None,
+    }
+    line = _encode_line(record)
+    started = time.monotonic()
+    fd = _open_journal()
+    try:
+        with _JournalLock(fd):
+            end = os.lseek(fd, 0, os.SEEK_END)
+            if end and os.pread(fd, 1, end - 1) != b"\n":
+                line = b"\n" + line # a crash tore the last line; don't glue this record onto it
+            os.write(fd, line)
+            if SHARE_JOURNAL_FSYNC:
+                os.fsync(fd)
+    finally:
+        os.close(fd)
+    with _pending_lock:
+        _pending[share_id] = (record, time.monotonic())
+    metrics.observe("share.journal_append_ms", (time.monotonic() - started) * 1000)
+    metrics.increment("share.journal_appends")
+    if len(_pending) >= SHARE_FLUSH_BATCH_SIZE:
+        _flush_wakeup.set()
+
+
+def _read_records(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    data = b""
+    while True:
+        chunk = os.read(fd, 1 << 20)
+        if not chunk:
+            break
+        data += chunk
+    records = []
+    torn = 0
+    for line in data.splitlines(keepends=True):
+        record = _decode_line(line)
+        if record is None:
+            torn += 1
+        else:
+            records.append(record)
+    return records, torn
+
+
+def _to_link(record):
+    from app import SharedLink
+    return SharedLink(
+        id=record["id"], offers_json=record["offers_json"],
+        created_at=datetime.strptime(record["created_at"], _DATETIME_FORMAT),
+        expires_at=datetime.strptime(record["expires_at"], _DATETIME_FORMAT) if record["expires_at"] else None,
+    )
+
+
+def _find_in_journal(share_id):
+    """share_id's journal record, indexing the lines appended since the last lookup first."""
+    global _indexed_up_to, _indexed_head
+    try:
+        fd = os.open(SHARE_JOURNAL_PATH, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        with _index_lock:
+            size = os.fstat(fd).st_size
+            if size < _indexed_up_to or (_indexed_head and os.pread(fd, len(_indexed_head), 0) != _indexed_head):
+                # Truncated by a flush since the last lookup: start over.
+                _index.clear()
+                _indexed_up_to = 0
+                _indexed_head = b""
+            if share_id not in _index and size > _indexed_up_to:
+                offset = _indexed_up_to
+                for line in os.pread(fd, size - offset, offset).splitlines(keepends=True):
+                    if not line.endswith(b"\n"):
+                        break # still being appended
+                    record = _decode_line(line)
+                    if record is not None:
+                        _index[record["id"]] = (offset, len(line))
+                    if offset == 0:
+                        _indexed_head = line
+                    offset += len(line)
+                _indexed_up_to = offset
+            location = _index.get(share_id)
+            if location is None:
+                return None
+            record = _decode_line(os.pread(fd, location[1], location[0]))
+    finally:
+        os.close(fd)
+    return record if record is not None and record["id"] == share_id else None
+
+
+def get_pending(share_id):
+    """An unsaved (transient) SharedLink for a link still waiting in the journal, else None."""
+    if not SHARE_WRITE_BEHIND_ENABLED:
+        return None
+    with _pending_lock:
+        entry = _pending.get(share_id)
+    if entry is not None:
+        return _to_link(entry[0])
+    # Created by another worker and not flushed yet?
+    record = _find_in_journal(share_id)
+    return _to_link(record) if record is not None else None
+
+
+def _insert_batches(records):
+    """Inserts the records' links with one multi-row INSERT per batch; returns the number inserted."""
+    from app import db, SharedLink
+    table = SharedLink.__table__
+    inserted = 0
+    for start in range(0, len(records), SHARE_FLUSH_BATCH_SIZE):
+        batch = records[start:start + SHARE_FLUSH_BATCH_SIZE]
+        # Idempotent replay: skip links an earlier (interrupted or overlapping) flush already committed.
+        existing = set(db.session.execute(
+            select(table.c.id).where(table.c.id.in_([r["id"] for r in batch]))
+        ).scalars())
+        rows = [{
+            "id": link.id, "offers_json": link.offers_json,
+            "created_at": link.created_at, "expires_at": link.expires_at,
+        } for link in (_to_link(r) for r in batch if r["id"] not in existing)]
+        if rows:
+            # A link committed by a concurrent flush between the SELECT and here is skipped, not an error.
+            statement = insert(table).prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql")
+            db.session.execute(statement, rows)
+        db.session.commit()
+        inserted += len(rows)
+    return inserted
+
+
+_busy_flushes = 0 # flushes in a row that found new appends and couldn't truncate
+
+
+def flush():
+    """
+    Moves every journaled link into the database. Needs an app context; returns the number inserted
+    (0 right away if another flush is running on the host).
+
+    The journal lock is only held to read the journal and to truncate it, so share creation isn't
+    blocked by database latency. If links were appended meanwhile the journal is kept, and the next
+    pass re-reads it (skipping what is already in the database). After a few such passes in a row
+    a flush holds the lock throughout so the journal can't keep growing under constant load.
+    """
+    from app import db
+    if not os.path.exists(SHARE_JOURNAL_PATH):
+        return 0
+    if not _flush_lock.acquire(blocking=False):
+        return 0 # this worker is already flushing
+    try:
+        flush_fd = os.open(SHARE_JOURNAL_PATH + ".flush", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(flush_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0 # another worker is flushing
+            return _flush_journal(db)
+        finally:
+            os.close(flush_fd) # releases the flock
+    finally:
+        _flush_lock.release()
+
+
+def _flush_journal(db):
+    global _busy_flushes
+    fd = _open_journal()
+    lock = _JournalLock(fd)
+    hold_lock = _busy_flushes >= 3
+    locked = False
+    try:
+        lock.acquire()
+        locked = True
+        records, torn = _read_records(fd)
+        read_up_to = os.lseek(fd, 0, os.SEEK_END)
+        if torn:
+            metrics.increment("share.journal_torn_lines", torn)
+            print(f"Share Journal WARNING: Skipped {torn} torn or corrupt journal line(s).")
+        if not hold_lock:
+            lock.release()
+            locked = False
+        inserted = _insert_batches(records)
+        if not locked:
+            lock.acquire()
+            locked = True
+        # Everything read is in the database; start over unless more was appended meanwhile.
+        if os.lseek(fd, 0, os.SEEK_END) == read_up_to:
+            os.ftruncate(fd, 0)
+            _busy_flushes = 0
+        else:
+            _busy_flushes += 1
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if locked:
+            lock.release()
+        os.close(fd)
+    flushed_ids = {r["id"] for r in records}
+    now = time.monotonic()
+    with _pending_lock:
+        for share_id in [k for k, (_, added) in _pending.items() if k in flushed_ids or now - added > _MEMORY_TTL_SECONDS]:
+            del _pending[share_id]
+    if inserted:
+        metrics.increment("share.journal_flushed", inserted)
+        metrics.observe("share.journal_flush_batch", inserted)
+    return inserted
+
+
+def start_background_job(app):
+    """Per-worker flusher thread. Its first pass also recovers whatever a crash left in the journal."""
+    from app import db, ensure_schema
+
+    def _flush_once():
+        with app.app_context():
+            try:
+                if ensure_schema():
+                    flush()
+            except Exception as e:
+                # The journal is untouched; the next pass retries.
+                print(f"Share Journal ERROR: Flush failed: {e}")
+            finally:
+                db.session.remove()
+
+    def _run():
+        while True:
+            _flush_once()
+            _flush_wakeup.wait(SHARE_FLUSH_INTERVAL_SECONDS)
+            _flush_wakeup.clear()
+
+    threading.Thread(target=_run, name="share-journal-flusher", daemon=True).start()
+    atexit.register(_flush_once) # best effort on clean shutdown; the journal covers the rest
@@ -0,0 +1,136 @@
+# app/services/share_lifecycle.py
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, delete, select, update
+
+from app.services import metrics
+
+# Share links expire after a TTL chosen at creation (SHARE_LINK_TTL_DAYS by default, capped at
+# SHARE_LINK_MAX_TTL_DAYS). Reads are noted in memory and written to last_accessed_at in one
+# batched UPDATE every SHARE_ACCESS_FLUSH_SECONDS instead of one write per read. A background
+# job deletes expired rows in small batches using the indexed timestamps, so no delete holds
+# locks on the table for long. Links created before expiry existed (expires_at NULL) are purged
+# once they have been idle for the default TTL.
+SHARE_LINK_TTL_DAYS = int(os.getenv("SHARE_LINK_TTL_DAYS", "90"))
+SHARE_LINK_MAX_TTL_DAYS = int(os.getenv("SHARE_LINK_MAX_TTL_DAYS", "365"))
+SHARE_LIFECYCLE_ENABLED = os.getenv("SHARE_LIFECYCLE_ENABLED", "true").lower() == "true"
+SHARE_ACCESS_FLUSH_SECONDS = int(os.getenv("SHARE_ACCESS_FLUSH_SECONDS", "60"))
+SHARE_PURGE_INTERVAL_SECONDS = int(os.getenv("SHARE_PURGE_INTERVAL_SECONDS", "3600"))
+SHARE_PURGE_BATCH_SIZE = int(os.getenv("SHARE_PURGE_BATCH_SIZE", "500"))
+# Pause between purge batches so other queries get the table in between.
+SHARE_PURGE_BATCH_PAUSE_SECONDS = float(os.getenv("SHARE_PURGE_BATCH_PAUSE_SECONDS", "0.1"))
+
+_access_lock = threading.Lock()
+_pending_accesses = {} # share id -> last access (naive UTC datetime)
+
+
+def utcnow():
+    """Naive UTC, matching how the DateTime columns are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def expiry_for(ttl_days=None):
+    """expires_at for a new link; ttl_days is clamped to 1..SHARE_LINK_MAX_TTL_DAYS."""
+    days = SHARE_LINK_TTL_DAYS if ttl_days is None else max(1, min(int(ttl_days), SHARE_LINK_MAX_TTL_DAYS))
+    return utcnow() + timedelta(days=days)
+
+
+def is_expired(shared_link, now=None):
+    return shared_link.expires_at is not None and shared_link.expires_at <= (now or utcnow())
+
+
+def record_access(share_id):
+    """Notes a read; written to the database by the next flush_accesses()."""
+    with _access_lock:
+        _pending_accesses[share_id] = utcnow()
+
+
+def flush_accesses():
+    """Writes the noted reads to last_accessed_at in one transaction. Needs an app context."""
+    from app import db, SharedLink
+    with _access_lock:
+        if not _pending_accesses:
+            return 0
+        batch = dict(_pending_accesses)
+        _pending_accesses.clear()
+    table = SharedLink.__table__
+    try:
+        # One executemany; links purged in the meantime just match no row.
+        db.session.execute(
+            update(table).where(table.c.id == bindparam("link_id")).values(last_accessed_at=bindparam("accessed_at")),
+            [{"link_id": share_id, "accessed_at": accessed_at} for share_id, accessed_at in batch.items()]
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Share Lifecycle ERROR: Could not record {len(batch)} link accesses: {e}")
+        return 0
+    metrics.increment("share.accesses_flushed", len(batch))
+    return len(batch)
+
+
+def _purge_where(condition, order_column):
+    from app import db, SharedLink
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            select(SharedLink.id).where(condition).order_by(order_column).limit(SHARE_PURGE_BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        result = db.session.execute(delete(SharedLink).where(SharedLink.id.in_(ids)))
+        db.session.commit()
+        deleted += result.rowcount # another worker may have purged some of these already
+        if len(ids) < SHARE_PURGE_BATCH_SIZE:
+            return deleted
+        time.sleep(SHARE_PURGE_BATCH_PAUSE_SECONDS)
+
+
+def purge_expired():
+    """Deletes expired links in batches of SHARE_PURGE_BATCH_SIZE. Needs an app context."""
+    from app import db, SharedLink
+    now = utcnow()
+    idle_cutoff = now - timedelta(days=SHARE_LINK_TTL_DAYS)
+    try:
+        deleted = _purge_where(SharedLink.expires_at <= now, SharedLink.expires_at)
+        # Legacy links without expires_at: purge once idle for the default TTL.
+        deleted += _purge_where(
+            (SharedLink.expires_at.is_(None)) & (SharedLink.created_at <= idle_cutoff)
+            & ((SharedLink.last_accessed_at.is_(None)) | (SharedLink.last_accessed_at <= idle_cutoff)),
+            SharedLink.created_at
+        )
+    except Exception as e:
+        db.session.rollback()
+        print(f"Share Lifecycle ERROR: Purge failed: {e}")
+        return 0
+    metrics.increment("share.links_purged", deleted)
+    if deleted:
+        print(f"Share Lifecycle: Purged {deleted} expired share link(s).")
+    return deleted
+
+
+def start_background_job(app):
+    """Per-worker daemon thread: flushes link accesses and periodically purges expired links."""
+    from app import db, ensure_schema
+
+    def _run():
+        next_purge = time.monotonic()
+        while True:
+            time.sleep(SHARE_ACCESS_FLUSH_SECONDS)
+            with app.app_context():
+                try:
+                    if not ensure_schema():
+                        continue
+                    flush_accesses()
+                    if time.monotonic() >= next_purge:
+                        purge_expired()
+                        next_purge = time.monotonic() + SHARE_PURGE_INTERVAL_SECONDS
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=_run, name="share-lifecycle", daemon=True)
+    thread.start()
+    return thread
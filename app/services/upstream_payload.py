@@ -0,0 +1,113 @@
+# app/services/upstream_payload.py
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+
+import requests
+
+from app.services import metrics, providers
+
+# Bounded reads of upstream response bodies. Clients send with stream=True and call read_payload(),
+# which reads the body in chunks and aborts with PayloadTooLarge as soon as it passes the
+# provider's limit (PROVIDER_<NAME>_MAX_PAYLOAD_BYTES in the registry), or earlier if the
+# Content-Length header already says so. The body is then stored on the response, so
+# response.text / response.json() work as usual.
+#
+# Every search has a PayloadAccounting. The scheduler copies contextvars into provider calls, so
+# the accounting follows the search onto the worker threads. It adds up the bytes buffered across
+# all of the search's provider tasks and stops reading once UPSTREAM_REQUEST_MAX_BYTES is reached.
+UPSTREAM_REQUEST_MAX_BYTES = int(os.getenv("UPSTREAM_REQUEST_MAX_BYTES", str(32 * 1024 * 1024)))
+_CHUNK_SIZE = 64 * 1024
+
+
+class PayloadTooLarge(requests.exceptions.RequestException):
+    """An upstream body exceeded its provider's or its search's byte limit; the read was aborted."""
+
+
+class PayloadAccounting:
+    """Upstream bytes buffered for one search, across all of its provider tasks."""
+
+    def __init__(self, limit=UPSTREAM_REQUEST_MAX_BYTES):
+        self.limit = limit
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        """Counts n more bytes; returns False (without counting them) if that would pass the limit."""
+        with self._lock:
+            if self.total_bytes + n > self.limit:
+                return False
+            self.total_bytes += n
+            return True
+
+
+_accounting = contextvars.ContextVar("upstream_payload_accounting", default=None)
+
+_buffer_lock = threading.Lock()
+_buffered_bytes = 0 # bytes held by reads in progress in this worker
+
+
+def _track_buffered(n):
+    global _buffered_bytes
+    with _buffer_lock:
+        _buffered_bytes += n
+        current = _buffered_bytes
+    if n > 0:
+        metrics.set_gauge_max("upstream_payload.buffered_bytes_max", current)
+
+
+@contextmanager
+def accounting(payload_accounting):
+    """Charges upstream reads started (or submitted to the scheduler) inside the block to payload_accounting."""
+    token = _accounting.set(payload_accounting)
+    try:
+        yield payload_accounting
+    finally:
+        _accounting.reset(token)
+
+
+def report(payload_accounting):
+    """Records a finished search's upstream bytes."""
+    metrics.observe("upstream_payload.request_bytes", payload_accounting.total_bytes)
+    metrics.set_gauge_max("upstream_payload.request_bytes_max", payload_accounting.total_bytes)
+
+
+def _abort(response, provider_name, reason):
+    response.close()
+    metrics.increment(f"upstream_payload.{provider_name}.aborted")
+    print(f"Upstream Payload WARNING: {provider_name} response aborted: {reason}")
+    raise PayloadTooLarge(f"{provider_name} response aborted: {reason}", response=response)
+
+
+def read_payload(response, provider_name):
+    """
+    Reads a streamed response body within the provider's and the current search's limits.
+    Returns the body bytes (also stored on the response). Raises PayloadTooLarge on overflow.
+    """
+    if response._content_consumed: # not streamed; already fully read
+        return response.content
+    limit = providers.max_payload_bytes_for(provider_name)
+    declared = response.headers.get("Content-Length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        _abort(response, provider_name, f"Content-Length {declared} exceeds {limit} bytes")
+    payload_accounting = _accounting.get()
+    chunks = []
+    size = 0
+    try:
+        for chunk in response.iter_content(_CHUNK_SIZE):
+            size += len(chunk)
+            _track_buffered(len(chunk))
+            if size > limit:
+                _abort(response, provider_name, f"body exceeds {limit} bytes")
+            if payload_accounting is not None and not payload_accounting.add(len(chunk)):
+                _abort(response, provider_name, f"search exceeds {payload_accounting.limit} upstream bytes")
+            chunks.append(chunk)
+    finally:
+        _track_buffered(-size)
+    body = b"".join(chunks)
+    response._content = body
+    response._content_consumed = True
+    metrics.observe(f"upstream_payload.{provider_name}.bytes", len(body))
+    metrics.set_gauge_max(f"upstream_payload.{provider_name}.bytes_max", len(body))
+    return body
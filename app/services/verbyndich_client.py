@@ -1,6 +1,14 @@
 # app/services/verbyndich_client.py
 import os
+import random
+import sqlite3
 import requests
+from app.services import metrics, parse_pool, profiling
+from app.services.interning import intern_offer
+from app.services.http_session import get_session, register_provider_host
+from app.services.upstream_payload import read_payload
+from app.services.local_store import default_path, get_connection
+from app.services.providers import timeout_for
 import time
 import json
 import re
@@ -8,6 +16,28 @@ import re
 # --- Credentials and Constants ---
 VERBYNDICH_BASE_URL = "https://verbyndich.gendev7.check24.fun/check24/data"
 VERBYNDICH_API_KEY = os.getenv("VERBYNDICH_API_KEY")
+register_provider_host(VERBYNDICH_BASE_URL, "VerbynDich")
+
+# --- Pagination Retries & Progress ---
+VERBYNDICH_PAGE_RETRIES = int(os.getenv("VERBYNDICH_PAGE_RETRIES", "2"))
+VERBYNDICH_RETRY_BACKOFF_SECONDS = float(os.getenv("VERBYNDICH_RETRY_BACKOFF_SECONDS", "0.3"))
+VERBYNDICH_PROGRESS_TTL_SECONDS = int(os.getenv("VERBYNDICH_PROGRESS_TTL_SECONDS", "600"))
+VERBYNDICH_PROGRESS_DB_PATH = os.getenv("VERBYNDICH_PROGRESS_DB_PATH", default_path("offer_cache.db"))
+_progress_schema_ready = False
+
+# --- Description Patterns ---
+# Compiled once at import so the first search doesn't pay for regex compilation.
+_PRICE_RE = re.compile(r"Für nur (\d+)€ im Monat")
+_CONN_TYPE_RE = re.compile(r"eine (DSL|Cable|Fiber)-Verbindung")
+_SPEED_RE = re.compile(r"Geschwindigkeit von (\d+)\s*Mbit/s")
+_TERM_RE = re.compile(r"Mindestvertragslaufzeit (\d+)\s*Monate")
+_LIMIT_RE = re.compile(r"Ab (\d+)GB pro Monat wird die Geschwindigkeit gedrosselt")
+_PERCENT_DISCOUNT_RE = re.compile(
+    r"Rabatt von (\d+)% auf Ihre monatliche Rechnung bis zum (\d+)\. Monat\.\s*Der maximale Rabatt beträgt (\d+)€"
+)
+_ONETIME_DISCOUNT_RE = re.compile(r"einmaligen Rabatt von (\d+)€.*?Der Mindestbestellwert beträgt (\d+)€")
+_PRICE_AFTER_RE = re.compile(r"Ab dem 24\. Monat beträgt der monatliche Preis (\d+)€")
+_AGE_RE = re.compile(r"Personen unter (\d+)\s*Jahren verfügbar")
 
 def _parse_verbyndich_description(description_str):
     """
@@ -29,32 +59,29 @@ def _parse_verbyndich_description(description_str):
         return details
 
     try: # Add a try-catch for parsing robustness
-        price_match = re.search(r"Für nur (\d+)€ im Monat", description_str)
+        price_match = _PRICE_RE.search(description_str)
         if price_match:
             details["monthlyPriceEur"] = float(price_match.group(1))
 
-        conn_type_match = re.search(r"eine (DSL|Cable|Fiber)-Verbindung", description_str)
+        conn_type_match = _CONN_TYPE_RE.search(description_str)
         if conn_type_match:
             type_map = {"dsl": "DSL", "cable": "Cable", "fiber": "Fiber"}
             details["connectionType"] = type_map.get(conn_type_match.group(1).lower())
 
-        speed_match = re.search(r"Geschwindigkeit von (\d+)\s*Mbit/s", description_str)
+        speed_match = _SPEED_RE.search(description_str)
         if speed_match:
             details["downloadSpeedMbps"] = int(speed_match.group(1))
 
-        term_match = re.search(r"Mindestvertragslaufzeit (\d+)\s*Monate", description_str)
+        term_match = _TERM_RE.search(description_str)
         if term_match:
             details["contractTermMonths"] = int(term_match.group(1))
 
-        limit_match = re.search(r"Ab (\d+)GB pro Monat wird die Geschwindigkeit gedrosselt", description_str)
+        limit_match = _LIMIT_RE.search(description_str)
         if limit_match:
             details["dataLimitGb"] = int(limit_match.group(1))
             details["raw_benefits_text"].append(f"Speed throttled after {details['dataLimitGb']}GB/month")
 
-        perc_discount_match = re.search(
-            r"Rabatt von (\d+)% auf Ihre monatliche Rechnung bis zum (\d+)\. Monat\.\s*Der maximale Rabatt beträgt (\d+)€",
-            description_str
-        )
+        perc_discount_match = _PERCENT_DISCOUNT_RE.search(description_str)
         if perc_discount_match:
             details["discount_percentage"] = int(perc_discount_match.group(1))
             details["discount_percentage_duration_months"] = int(perc_discount_match.group(2))
@@ -63,10 +90,7 @@ def _parse_verbyndich_description(description_str):
                 f"{details['discount_percentage']}% monthly discount for {details['discount_percentage_duration_months']} months (max total €{details['discount_percentage_max_eur']})"
             )
 
-        onetime_discount_match = re.search(
-            r"einmaligen Rabatt von (\d+)€.*?Der Mindestbestellwert beträgt (\d+)€",
-            description_str
-        )
+        onetime_discount_match = _ONETIME_DISCOUNT_RE.search(description_str)
         if onetime_discount_match:
             details["discount_onetime_eur"] = float(onetime_discount_match.group(1))
             details["discount_onetime_min_order_eur"] = float(onetime_discount_match.group(2))
@@ -74,11 +98,11 @@ def _parse_verbyndich_description(description_str):
                 f"One-time discount of €{details['discount_onetime_eur']} (min. order €{details['discount_onetime_min_order_eur']})"
             )
 
-        price_after_match = re.search(r"Ab dem 24\. Monat beträgt der monatliche Preis (\d+)€", description_str)
+        price_after_match = _PRICE_AFTER_RE.search(description_str)
         if price_after_match:
             details["monthlyPriceEurAfter2Years"] = float(price_after_match.group(1))
 
-        age_match = re.search(r"Personen unter (\d+)\s*Jahren verfügbar", description_str)
+        age_match = _AGE_RE.search(description_str)
         if age_match:
             details["ageRestrictionMax"] = int(age_match.group(1))
             details["raw_benefits_text"].append(f"Young tariff: for persons under {details['ageRestrictionMax']} years")
@@ -127,12 +151,139 @@ def _normalize_verbyndich_offer(api_offer_item, parsed_desc_details):
             "dataLimitGb": parsed_desc_details.get("dataLimitGb"),
             "_provider_specific_id": product_name_from_api,
         }
-        return normalized_offer
+        return intern_offer(normalized_offer)
     except Exception as e:
         print(f"Verbyndich Normalization Error: {e} for item {api_offer_item.get('product')}")
         return None
 
-def fetch_verbyndich_offers(address_details): 
+def parse_verbyndich_items(api_offer_items):
+    """
+    CPU half of fetch_verbyndich_offers: runs the description regexes and normalizes each valid page item.
+    Has no network or app state, so it can also run in a worker process.
+    """
+    all_normalized_offers = []
+    for api_offer_item in api_offer_items:
+        description = api_offer_item.get("description", "")
+        parsed_description_details = _parse_verbyndich_description(description)
+        normalized = _normalize_verbyndich_offer(api_offer_item, parsed_description_details)
+        if normalized:
+            all_normalized_offers.append(normalized)
+    return all_normalized_offers
+
+class PartialResult(list):
+    """
+    Offers (or page items) from a pagination run that stopped early because a page kept failing.
+    The aggregator caches these only briefly and reports the task as "partial", so it can be retried.
+    """
+    partial = True
+
+
+_PAGE_FAILED = object()
+
+
+def _progress_connect():
+    global _progress_schema_ready
+    conn = get_connection(VERBYNDICH_PROGRESS_DB_PATH)
+    if not _progress_schema_ready:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS verbyndich_progress ("
+            " address TEXT PRIMARY KEY,"
+            " next_page INTEGER NOT NULL,"
+            " items TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        _progress_schema_ready = True
+    return conn
+
+
+def _load_progress(address_str_body):
+    """(next page, items collected so far) from an earlier run that stopped early, or (0, [])."""
+    try:
+        row = _progress_connect().execute(
+            "SELECT next_page, items FROM verbyndich_progress WHERE address = ? AND expires_at >= ?",
+            (address_str_body, time.time())
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Verbyndich Client WARNING: Could not read pagination progress: {e}")
+        return 0, []
+    return (row[0], json.loads(row[1])) if row else (0, [])
+
+
+def _save_progress(address_str_body, next_page, items):
+    try:
+        conn = _progress_connect()
+        if next_page is None:
+            conn.execute("DELETE FROM verbyndich_progress WHERE address = ?", (address_str_body,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO verbyndich_progress (address, next_page, items, expires_at) VALUES (?, ?, ?, ?)",
+                (address_str_body, next_page, json.dumps(items, ensure_ascii=False), time.time() + VERBYNDICH_PROGRESS_TTL_SECONDS)
+            )
+    except sqlite3.Error as e:
+        print(f"Verbyndich Client WARNING: Could not store pagination progress: {e}")
+
+
+def _fetch_page(address_str_body, page, deadline):
+    """
+    One page, retried with jittered exponential backoff on transient failures (timeouts,
+    connection errors, 5xx/429, malformed JSON) while the deadline allows.
+    Returns the page JSON ({} for an empty page) or _PAGE_FAILED.
+    """
+    params = {"apiKey": VERBYNDICH_API_KEY, "page": page}
+    headers = {"Content-Type": "text/plain;charset=UTF-8"}
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"Verbyndich Client ERROR: Out of time before page {page}.")
+            return _PAGE_FAILED
+        response = None
+        try:
+            with profiling.span("VerbynDich.fetch_page", page=page, attempt=attempt + 1):
+                response = get_session().post(
+                    VERBYNDICH_BASE_URL,
+                    data=address_str_body.encode('utf-8'),
+                    params=params, headers=headers, timeout=remaining, # Bounded by the request deadline
+                    stream=True
+                )
+                read_payload(response, "VerbynDich") # per page
+                response.raise_for_status()
+                return response.json() or {}
+        except requests.exceptions.Timeout:
+            print(f"Verbyndich Client ERROR: Timeout on page {page} (attempt {attempt + 1}).")
+        except requests.exceptions.HTTPError as http_err:
+            status = http_err.response.status_code
+            print(f"Verbyndich Client HTTP ERROR on page {page}: {status} - {http_err.response.text[:200]}")
+            if status < 500 and status != 429:
+                return _PAGE_FAILED # Not transient; retrying won't help
+        except ValueError as json_err: # JSONDecodeError
+            print(f"Verbyndich Client JSON DECODE ERROR on page {page}: {json_err}. Response: {response.text[:200] if response is not None else 'N/A'}")
+        except requests.exceptions.ConnectionError as conn_err:
+            print(f"Verbyndich Client CONNECTION ERROR on page {page}: {conn_err}")
+        except requests.exceptions.RequestException as req_err:
+            print(f"Verbyndich Client REQUEST EXCEPTION on page {page}: {req_err}")
+            return _PAGE_FAILED
+
+        if attempt >= VERBYNDICH_PAGE_RETRIES:
+            return _PAGE_FAILED
+        backoff = random.uniform(0, VERBYNDICH_RETRY_BACKOFF_SECONDS * (2 ** attempt)) # full jitter
+        if time.monotonic() + backoff >= deadline:
+            return _PAGE_FAILED
+        attempt += 1
+        metrics.increment("verbyndich.pages_retried")
+        time.sleep(backoff)
+
+
+def fetch_verbyndich_raw(address_details):
+    """
+    Network half of fetch_verbyndich_offers: walks the pages and returns the raw valid page items.
+
+    Each page is retried (see _fetch_page) within a deadline of the provider's timeout budget.
+    If a page still fails, the pages collected so far are remembered for
+    VERBYNDICH_PROGRESS_TTL_SECONDS and the next call for the address (a cache refresh or a
+    retry) continues from the failed page. Returns a PartialResult in that case, and None if
+    nothing usable was fetched.
+    """
     if not VERBYNDICH_API_KEY:
         print("Verbyndich Client ERROR: API Key (VERBYNDICH_API_KEY) is not configured.")
         return []
@@ -148,64 +299,60 @@ def fetch_verbyndich_offers(address_details):
         return [] # Return empty if essential address parts are missing
     address_str_body = ";".join(address_str_body_parts)
 
-    all_normalized_offers = []
-    current_page = 0
+    deadline = time.monotonic() + timeout_for("VerbynDich")
+    current_page, valid_items = _load_progress(address_str_body)
+    if current_page:
+        metrics.increment("verbyndich.pages_resumed", current_page)
+        print(f"Verbyndich Client: Resuming pagination at page {current_page} ({len(valid_items)} item(s) remembered).")
     max_pages_to_fetch = 20 # Keep a reasonable limit
+    pagination_failed = False
 
     print(f"Verbyndich Client: Fetching data for address: '{address_str_body}'")
 
     try: # Outer try for the whole pagination process
         while current_page < max_pages_to_fetch:
-            params = {"apiKey": VERBYNDICH_API_KEY, "page": current_page}
-            headers = {"Content-Type": "text/plain;charset=UTF-8"}
-            
-            # Inner try for individual page request
-            try:
-                response = requests.post(
-                    VERBYNDICH_BASE_URL,
-                    data=address_str_body.encode('utf-8'),
-                    params=params, headers=headers, timeout=15 # Timeout per page request
-                )
-                # print(f"Verbyndich Client: Page {current_page}, Status: {response.status_code}") # Debug
-                response.raise_for_status()
-                api_offer_item = response.json()
-                
-                if api_offer_item:
-                    if api_offer_item.get("valid", False):
-                        description = api_offer_item.get("description", "")
-                        parsed_description_details = _parse_verbyndich_description(description)
-                        normalized = _normalize_verbyndich_offer(api_offer_item, parsed_description_details)
-                        if normalized:
-                            all_normalized_offers.append(normalized)
-                    
-                    if api_offer_item.get("last", False):
-                        break 
-                else:
-                    print(f"Verbyndich Client WARNING: Empty/non-JSON response on page {current_page}. Stopping pagination.")
-                    break 
-                current_page += 1
-                # time.sleep(0.1) # Optional small delay between paginated requests
-
-            except requests.exceptions.Timeout:
-                print(f"Verbyndich Client ERROR: Timeout on page {current_page}.")
-                break # Stop pagination on timeout
-            except requests.exceptions.HTTPError as http_err:
-                print(f"Verbyndich Client HTTP ERROR on page {current_page}: {http_err.response.status_code} - {http_err.response.text[:200]}")
-                break # Stop pagination on HTTP error
-            except ValueError as json_err: # JSONDecodeError
-                print(f"Verbyndich Client JSON DECODE ERROR on page {current_page}: {json_err}. Response: {response.text[:200] if 'response' in locals() else 'N/A'}")
-                break # Stop pagination on JSON error
-            except requests.exceptions.RequestException as req_err:
-                print(f"Verbyndich Client REQUEST EXCEPTION on page {current_page}: {req_err}")
-                break # Stop on other request errors
+            api_offer_item = _fetch_page(address_str_body, current_page, deadline)
+            if api_offer_item is _PAGE_FAILED:
+                metrics.increment("verbyndich.pages_lost")
+                pagination_failed = True
+                break
+            metrics.increment("verbyndich.pages_fetched")
+            if not api_offer_item:
+                print(f"Verbyndich Client WARNING: Empty/non-JSON response on page {current_page}. Stopping pagination.")
+                break
+            if api_offer_item.get("valid", False):
+                valid_items.append(api_offer_item)
+            if api_offer_item.get("last", False):
+                break
+            current_page += 1
 
     except Exception as e: # Catch-all for unexpected issues in the loop setup or outer logic
         print(f"Verbyndich Client UNEXPECTED ERROR during pagination: {e}")
         import traceback
         traceback.print_exc()
-        return [] # Return whatever has been collected so far or empty list
+        return None
+
+    # Remember where we stopped so the next call doesn't refetch the good pages; clear it once complete.
+    _save_progress(address_str_body, current_page if pagination_failed else None, valid_items)
+    if pagination_failed:
+        print(f"Verbyndich Client: Pagination stopped at page {current_page} with {len(valid_items)} valid item(s).")
+        return PartialResult(valid_items) if valid_items else None # Nothing usable: report a failure, not "no offers"
 
-    print(f"Verbyndich Client: Fetched and normalized {len(all_normalized_offers)} offers across {current_page + 1} page(s).")
+    print(f"Verbyndich Client: Fetched {len(valid_items)} valid offer page(s) across {current_page + 1} page(s).")
+    return valid_items
+
+def fetch_verbyndich_offers(address_details):
+    valid_items = fetch_verbyndich_raw(address_details)
+    if valid_items is None:
+        return None
+    with profiling.span("VerbynDich.parse_normalize", items=len(valid_items)): # description regexes run per item during normalization
+        all_normalized_offers = parse_pool.run_parse(
+            "VerbynDich", parse_verbyndich_items, list(valid_items), size=len(valid_items),
+            min_size=parse_pool.PARSE_POOL_MIN_ITEMS
+        )
+    print(f"Verbyndich Client: Normalized {len(all_normalized_offers)} offers.")
+    if isinstance(valid_items, PartialResult):
+        return PartialResult(all_normalized_offers)
     return all_normalized_offers
 
 # --- if __name__ == '__main__': block ---
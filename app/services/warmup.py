@@ -0,0 +1,128 @@
+# app/services/warmup.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from app.services.http_session import get_session
+
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "5"))
+WARMUP_CONNECTIONS_PER_HOST = int(os.getenv("WARMUP_CONNECTIONS_PER_HOST", "2"))
+
+# --- Synthetic Provider Data (shapes taken from the real responses) ---
+_SAMPLE_BYTEME_ROW = {
+    "productId": "510", "providerName": "Byte Extreme 100, All in", "speed": "100",
+    "monthlyCostInCent": "4931", "afterTwoYearsMonthlyCost": "5131", "durationInMonths": "12",
+    "connectionType": "Fiber", "installationService": "false", "tv": "Extreme ByteLive",
+    "limitFrom": "300", "maxAge": "", "voucherType": "absolute", "voucherValue": "10775"
+}
+_SAMPLE_PING_PERFECT_OFFER = {
+    "providerName": "Ping Perfect", "productId": "pp_warmup",
+    "productInfo": {"speed": 250, "contractDurationInMonths": 24, "connectionType": "fiber", "tv": "none"},
+    "pricingDetails": {"monthlyCostInCent": 3999, "installationService": "included"}
+}
+_SAMPLE_SERVUS_DETAIL = {
+    "servusSpeedProduct": {
+        "providerName": "Servus Extreme 350",
+        "productInfo": {"speed": 350, "contractDurationInMonths": 36, "connectionType": "Fiber", "tv": "ServusFlix"},
+        "pricingDetails": {"monthlyCostInCent": 5483, "installationService": False},
+        "discount": 3727
+    }
+}
+_SAMPLE_VERBYNDICH_ITEM = {
+    "product": "VerbynDich Warmup", "valid": True, "last": True,
+    "description": (
+        "Für nur 40€ im Monat erhalten Sie eine DSL-Verbindung mit einer Geschwindigkeit von 100 Mbit/s. "
+        "Mindestvertragslaufzeit 24 Monate. Ab 500GB pro Monat wird die Geschwindigkeit gedrosselt. "
+        "Ab dem 24. Monat beträgt der monatliche Preis 50€. Dieses Angebot ist nur für Personen unter 27 Jahren verfügbar."
+    )
+}
+_SAMPLE_WEBWUNDER_RESPONSE = (
+    b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>'
+    b'<ns2:Output xmlns:ns2="http://webwunder.gendev7.check24.fun/offerservice"><ns2:products>'
+    b'<ns2:productId>1</ns2:productId><ns2:providerName>WebWunder</ns2:providerName>'
+    b'<ns2:productInfo><ns2:speed>50</ns2:speed><ns2:monthlyCostInCent>2999</ns2:monthlyCostInCent>'
+    b'<ns2:monthlyCostInCentFrom25thMonth>3999</ns2:monthlyCostInCentFrom25thMonth>'
+    b'<ns2:contractDurationInMonths>24</ns2:contractDurationInMonths><ns2:connectionType>DSL</ns2:connectionType>'
+    b'</ns2:productInfo></ns2:products></ns2:Output></soapenv:Body></soapenv:Envelope>'
+)
+
+
+def _configured_provider_urls():
+    """Base URLs of the enabled providers whose credentials are configured (only those get called by searches)."""
+    from app.services import byteme_client, ping_perfect_client, providers, servus_speed_client, verbyndich_client, webwunder_client
+    candidates = [
+        ("ByteMe", byteme_client.BYTEME_API_KEY, byteme_client.BYTEME_BASE_URL),
+        ("PingPerfect", ping_perfect_client.PING_PERFECT_CLIENT_ID, ping_perfect_client.PING_PERFECT_BASE_URL),
+        ("ServusSpeed", servus_speed_client.USERNAME, servus_speed_client.BASE_URL),
+        ("VerbynDich", verbyndich_client.VERBYNDICH_API_KEY, verbyndich_client.VERBYNDICH_BASE_URL),
+        ("WebWunder", webwunder_client.WEBWUNDER_API_KEY, webwunder_client.WEBWUNDER_SOAP_ENDPOINT),
+    ]
+    return [url for name, credential, url in candidates if credential and providers.PROVIDERS[name]["enabled"]]
+
+
+def _run_synthetic_normalization():
+    """Pushes one canned record through every parser/normalizer so first-use setup happens now."""
+    from app.services import byteme_client, ping_perfect_client, servus_speed_client, verbyndich_client, webwunder_client
+
+    byteme_client._normalize_byteme_offer(dict(_SAMPLE_BYTEME_ROW))
+    ping_perfect_client._normalize_ping_perfect_offer(_SAMPLE_PING_PERFECT_OFFER, 0)
+    servus_speed_client._normalize_servus_speed_offer(_SAMPLE_SERVUS_DETAIL, "warmup")
+
+    parsed = verbyndich_client._parse_verbyndich_description(_SAMPLE_VERBYNDICH_ITEM["description"])
+    verbyndich_client._normalize_verbyndich_offer(_SAMPLE_VERBYNDICH_ITEM, parsed)
+
+    webwunder_client.parse_webwunder_response(_SAMPLE_WEBWUNDER_RESPONSE, "DSL")
+
+
+def _open_connection(url, timeout):
+    # Any response (even 404/405) means the TCP + TLS handshake is done and the
+    # connection goes back into the shared pool for the first real search.
+    try:
+        get_session().head(url, timeout=timeout, allow_redirects=False)
+        return True
+    except Exception as e:
+        print(f"Warm-up: Could not pre-open connection to {url}: {e}")
+        return False
+
+
+def warm_up(timeout_seconds=WARMUP_TIMEOUT_SECONDS):
+    """
+    Brings a fresh worker to steady state before it reports ready: imports the provider
+    clients, compiles their parsers, runs one synthetic normalization pass and opens pooled
+    connections to the configured provider hosts. Stops early once timeout_seconds is spent.
+
+    :return: A dict of step name -> elapsed milliseconds (plus "timedOut").
+    """
+    started = time.monotonic()
+    deadline = started + timeout_seconds
+    report = {"timedOut": False}
+
+    step_started = time.monotonic()
+    urls = _configured_provider_urls()
+    report["importClients"] = round((time.monotonic() - step_started) * 1000, 1)
+
+    step_started = time.monotonic()
+    try:
+        _run_synthetic_normalization()
+    except Exception as e:
+        print(f"Warm-up: Synthetic normalization pass failed: {e}")
+    report["syntheticNormalization"] = round((time.monotonic() - step_started) * 1000, 1)
+
+    remaining = deadline - time.monotonic()
+    if urls and remaining > 0:
+        step_started = time.monotonic()
+        connection_jobs = [url for url in urls for _ in range(WARMUP_CONNECTIONS_PER_HOST)]
+        executor = ThreadPoolExecutor(max_workers=len(connection_jobs))
+        futures = [executor.submit(_open_connection, url, remaining) for url in connection_jobs]
+        _, not_done = wait(futures, timeout=remaining)
+        executor.shutdown(wait=False)
+        report["openConnections"] = round((time.monotonic() - step_started) * 1000, 1)
+        report["connectionsOpened"] = sum(1 for f in futures if f.done() and f.result())
+        if not_done:
+            report["timedOut"] = True
+    elif urls:
+        report["timedOut"] = True
+
+    report["total"] = round((time.monotonic() - started) * 1000, 1)
+    print(f"Warm-up: Finished in {report['total']}ms. Report: {report}")
+    return report
@@ -1,13 +1,30 @@
 # app/services/webwunder_client.py
 import os
+import threading
 import requests
+from app.services import parse_pool, profiling
+from app.services.interning import intern_offer
+from app.services.http_session import get_session, register_provider_host
+from app.services.upstream_payload import read_payload
+from app.services.providers import timeout_for
 from lxml import etree # Using lxml directly for robust parsing
-import time # For unique ID fallback
+import hashlib # For the stable ID fallback
 
 # --- Credentials and Constants ---
 WEBWUNDER_API_KEY = os.getenv("WEBWUNDER_API_KEY")
 WEBWUNDER_SOAP_ENDPOINT = "https://webwunder.gendev7.check24.fun/endpunkte/soap/ws" # WSDL URL not needed for direct POST
 OFFER_NS = "http://webwunder.gendev7.check24.fun/offerservice"
+register_provider_host(WEBWUNDER_SOAP_ENDPOINT, "WebWunder")
+
+# lxml parsers must not be shared between threads, so each worker thread keeps its own.
+_parser_local = threading.local()
+
+def _get_xml_parser():
+    parser = getattr(_parser_local, "parser", None)
+    if parser is None:
+        parser = etree.XMLParser(remove_blank_text=True, recover=True)
+        _parser_local.parser = parser
+    return parser
 
 def _normalize_webwunder_offer_from_lxml(product_element):
     if product_element is None:
@@ -22,7 +39,15 @@ def _normalize_webwunder_offer_from_lxml(product_element):
             # print(f"WebWunder Norm: productInfo missing for {product_id_str}")
             return None
 
-        provider_specific_id = str(product_id_str) if product_id_str else f"ww_unknown_{int(time.time()*1000)}"
+        if product_id_str:
+            provider_specific_id = str(product_id_str)
+        else:
+            # Derived from the defining fields, so the same product keeps its ID across fetches (offer history).
+            defining = [product_info_element.get('name')] + [
+                product_info_element.findtext(f'sch:{field}', namespaces=ns_map)
+                for field in ('speed', 'connectionType', 'contractDurationInMonths')
+            ]
+            provider_specific_id = "ww_unknown_" + hashlib.sha1(repr(defining).encode("utf-8")).hexdigest()[:12]
         
         # Use .get('name', api_provider_name_field) to ensure product name uses the specific name if available
         product_name = product_info_element.get('name', api_provider_name_field) 
@@ -79,15 +104,19 @@ def _normalize_webwunder_offer_from_lxml(product_element):
             "installationServiceIncluded": None, "ageRestrictionMax": None, "dataLimitGb": None,
             "_provider_specific_id": provider_specific_id,
         }
-        return normalized_offer
+        return intern_offer(normalized_offer)
     except Exception as e:
         print(f"WebWunder Norm Error: {e} for product ID {product_element.findtext('sch:productId', namespaces=ns_map if 'ns_map' in locals() else None)}")
         return None
 
-def fetch_webwunder_offers(address_details, connection_type_param="DSL", installation_param=True): # Renamed
+def fetch_webwunder_raw(address_details, connection_type_param="DSL", installation_param=True):
+    """
+    Network half of fetch_webwunder_offers: sends the SOAP request and returns the raw response bytes.
+    Returns b"" when the call is skipped (no API key, incomplete address) and None on request failures.
+    """
     if not WEBWUNDER_API_KEY:
         print(f"WebWunder Client ERROR ({connection_type_param}): API Key not configured.")
-        return []
+        return b""
 
     # Address details mapping for payload
     addr_payload = {
@@ -97,7 +126,7 @@ def fetch_webwunder_offers(address_details, connection_type_param="DSL", install
     }
     if not all(addr_payload.values()): # Basic check
         print(f"WebWunder Client WARNING ({connection_type_param}): Missing address components. Details: {address_details}")
-        return []
+        return b""
         
     gs_ns = OFFER_NS
     input_xml_parts = [
@@ -114,30 +143,49 @@ def fetch_webwunder_offers(address_details, connection_type_param="DSL", install
     soap_envelope = f"<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\"><soapenv:Header/><soapenv:Body>{soap_body_content}</soapenv:Body></soapenv:Envelope>"
     
     headers = {'Content-Type': 'text/xml; charset=utf-8', 'X-Api-Key': WEBWUNDER_API_KEY, 'SOAPAction': ''}
-    normalized_offers_for_type = []
 
     try:
         # print(f"WebWunder Client ({connection_type_param}): Sending SOAP request...")
-        response = requests.post(WEBWUNDER_SOAP_ENDPOINT, data=soap_envelope.encode('utf-8'), headers=headers, timeout=25)
+        with profiling.span("WebWunder.fetch", connection=connection_type_param):
+            response = get_session().post(WEBWUNDER_SOAP_ENDPOINT, data=soap_envelope.encode('utf-8'), headers=headers, timeout=timeout_for("WebWunder"), stream=True)
+            read_payload(response, "WebWunder")
         # print(f"WebWunder Client ({connection_type_param}): API response status: {response.status_code}")
-        
-        raw_xml_response = "COULD_NOT_DECODE_RESPONSE"
-        try: raw_xml_response = response.content.decode('utf-8')
-        except: pass
-            
         if response.status_code != 200:
-            print(f"WebWunder Client ({connection_type_param}): Non-200 Status {response.status_code}. Raw Resp: {raw_xml_response[:500]}")
+            print(f"WebWunder Client ({connection_type_param}): Non-200 Status {response.status_code}. Raw Resp: {response.content[:500].decode('utf-8', 'replace')}")
         response.raise_for_status()
-        
-        parser = etree.XMLParser(remove_blank_text=True, recover=True)
-        tree = etree.fromstring(response.content, parser=parser)
+        return response.content
+
+    except requests.exceptions.Timeout:
+        print(f"WebWunder Client ({connection_type_param}) ERROR: Timeout during SOAP request.")
+    except requests.exceptions.HTTPError as http_err:
+        print(f"WebWunder Client ({connection_type_param}) HTTP ERROR: {http_err.response.status_code if http_err.response else 'N/A'}")
+    except requests.exceptions.RequestException as req_err:
+        print(f"WebWunder Client ({connection_type_param}) REQUEST EXCEPTION: {req_err}")
+    except Exception as e:
+        print(f"WebWunder Client ({connection_type_param}) UNEXPECTED ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+    return None
+
+def parse_webwunder_response(response_content, connection_type_param="DSL"):
+    """
+    CPU half of fetch_webwunder_offers: parses the SOAP response bytes and normalizes the products.
+    Has no network or app state, so it can also run in a worker process.
+    Returns a list of offers, [] for a skipped call (empty content) and None on SOAP faults/XML errors.
+    """
+    if not response_content:
+        return []
+    normalized_offers_for_type = []
+    try:
+        with profiling.span("WebWunder.parse", connection=connection_type_param, bytes=len(response_content)):
+            tree = etree.fromstring(response_content, parser=_get_xml_parser())
         xml_namespaces = {'soapenv': 'http://schemas.xmlsoap.org/soap/envelope/', 'sch': OFFER_NS}
 
         fault_element = tree.find('.//soapenv:Fault', namespaces=xml_namespaces)
         if fault_element is not None:
             faultstring = fault_element.findtext('faultstring', default="Unknown SOAP fault")
             print(f"WebWunder Client ({connection_type_param}) SOAP FAULT: {faultstring}")
-            return []
+            return None
 
         output_el = tree.find('.//soapenv:Body/sch:Output', namespaces=xml_namespaces) # More specific path
         if output_el is None: # Try without sch prefix if server response varies
@@ -146,28 +194,34 @@ def fetch_webwunder_offers(address_details, connection_type_param="DSL", install
         if output_el is not None:
             product_elements = output_el.findall('./sch:products', namespaces=xml_namespaces)
             # print(f"WebWunder Client ({connection_type_param}): Found {len(product_elements)} product elements.")
-            for product_el in product_elements:
-                normalized = _normalize_webwunder_offer_from_lxml(product_el)
-                if normalized:
-                    normalized_offers_for_type.append(normalized)
+            with profiling.span("WebWunder.normalize", connection=connection_type_param, products=len(product_elements)):
+                for product_el in product_elements:
+                    normalized = _normalize_webwunder_offer_from_lxml(product_el)
+                    if normalized:
+                        normalized_offers_for_type.append(normalized)
         else:
-            print(f"WebWunder Client ({connection_type_param}) WARNING: <Output> element not found in SOAP Body. Raw: {raw_xml_response[:500]}")
+            print(f"WebWunder Client ({connection_type_param}) WARNING: <Output> element not found in SOAP Body. Raw: {response_content[:500].decode('utf-8', 'replace')}")
 
-    except requests.exceptions.Timeout:
-        print(f"WebWunder Client ({connection_type_param}) ERROR: Timeout during SOAP request.")
-    except requests.exceptions.HTTPError as http_err:
-        print(f"WebWunder Client ({connection_type_param}) HTTP ERROR: {http_err.response.status_code if http_err.response else 'N/A'}")
-    except requests.exceptions.RequestException as req_err:
-        print(f"WebWunder Client ({connection_type_param}) REQUEST EXCEPTION: {req_err}")
     except etree.XMLSyntaxError as xml_err:
-        print(f"WebWunder Client ({connection_type_param}) XML PARSE ERROR: {xml_err}. Raw Resp: {raw_xml_response[:500]}")
+        print(f"WebWunder Client ({connection_type_param}) XML PARSE ERROR: {xml_err}. Raw Resp: {response_content[:500].decode('utf-8', 'replace')}")
+        return None
     except Exception as e:
         print(f"WebWunder Client ({connection_type_param}) UNEXPECTED ERROR: {e}")
         import traceback
         traceback.print_exc()
+        return None
 
     print(f"WebWunder Client: Processed {len(normalized_offers_for_type)} offers for type {connection_type_param}.")
     return normalized_offers_for_type
 
+def fetch_webwunder_offers(address_details, connection_type_param="DSL", installation_param=True): # Renamed
+    response_content = fetch_webwunder_raw(address_details, connection_type_param, installation_param)
+    if response_content is None:
+        return None
+    # Large responses are parsed in a worker process when the parse pool is enabled.
+    return parse_pool.run_parse(
+        "WebWunder", parse_webwunder_response, response_content, (connection_type_param,), size=len(response_content)
+    )
+
 # ... (if __name__ == '__main__': block needs to be updated to call fetch_webwunder_offers for each type)
 # Note: The main routes.py will handle iterating through connection types for WebWunder.
\ No newline at end of file
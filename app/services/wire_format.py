@@ -0,0 +1,109 @@
+# app/services/wire_format.py
+import json
+
+# Compact columnar encoding for offer lists (?format=compact on /api/offers and /api/share/<id>).
+# Instead of one object per offer repeating every key, the response has a schema header
+# ("fields") and one array per field ("columns", in the same order). Columns of repeated strings
+# (provider names, connection types, TV packages, benefits) hold indexes into a per-column
+# dictionary ("dictionaries"); null stays null. Example for two offers:
+#
+#   {"format": "columnar", "version": 1, "count": 2,
+#    "fields": ["providerName", "monthlyPriceEur"],
+#    "dictionaries": {"providerName": ["ByteMe"]},
+#    "columns": [[0, 0], [39.99, 29.99]]}
+#
+# Offers that lack a field get null in its column. The offers are walked once, and the
+# response body is streamed one column at a time instead of being built as one big string.
+FORMAT_NAME = "columnar"
+FORMAT_VERSION = 1
+
+DICTIONARY_FIELDS = frozenset({
+    "providerName", "productName", "connectionType", "tv", "tvIncluded", "benefits", "discountType",
+})
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def parse_fields(fields_param):
+    """The ?fields= projection as a list of field names (None when not given)."""
+    if fields_param is None:
+        return None
+    fields = [f.strip() for f in fields_param.split(",") if f.strip()]
+    return fields or None
+
+
+def project(offers, fields):
+    """Offers reduced to the given fields, for the regular JSON format."""
+    if not fields:
+        return offers
+    return [{f: offer[f] for f in fields if f in offer} for offer in offers]
+
+
+def _encode_columns(offers, fields):
+    """One pass over the offers: (field names, columns, dictionaries)."""
+    names = list(fields) if fields else []
+    columns = [[] for _ in names]
+    index_of = {name: i for i, name in enumerate(names)}
+    # (type, value) keys, so True and 1 get separate dictionary entries
+    lookups = {name: {} for name in names if name in DICTIONARY_FIELDS}
+    dictionaries = {name: [] for name in lookups}
+
+    for row, offer in enumerate(offers):
+        for name, value in (offer.items() if not fields else ((f, offer.get(f)) for f in fields)):
+            i = index_of.get(name)
+            if i is None:
+                if fields:
+                    continue
+                # Field first seen on this row: earlier rows get null
+                i = index_of[name] = len(names)
+                names.append(name)
+                columns.append([None] * row)
+                if name in DICTIONARY_FIELDS:
+                    lookups[name] = {}
+                    dictionaries[name] = []
+            lookup = lookups.get(name)
+            if lookup is not None and value is not None:
+                key = (value.__class__, value)
+                code = lookup.get(key)
+                if code is None:
+                    code = lookup[key] = len(dictionaries[name])
+                    dictionaries[name].append(value)
+                value = code
+            columns[i].append(value)
+        for column in columns:
+            if len(column) <= row: # this offer doesn't have the field
+                column.append(None)
+    return names, columns, dictionaries
+
+
+def iter_columnar(offers, fields=None, extra=None):
+    """
+    Yields the compact JSON document for offers in chunks (header, then one chunk per column).
+    `fields` projects to those fields in that order; `extra` adds top-level keys (e.g. resultSetId).
+    """
+    names, columns, dictionaries = _encode_columns(offers, fields)
+    header = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "count": len(offers)}
+    if extra:
+        header.update(extra)
+    header["fields"] = names
+    header["dictionaries"] = {name: values for name, values in dictionaries.items() if name in names}
+    yield _dumps(header)[:-1] + ',"columns":['
+    for i, column in enumerate(columns):
+        yield ("," if i else "") + _dumps(column)
+    yield "]}"
+
+
+def encode_columnar(offers, fields=None, extra=None):
+    return "".join(iter_columnar(offers, fields, extra))
+
+
+def decode_columnar(document):
+    """Offers back from a compact document (the inverse of iter_columnar, for tests and tools)."""
+    fields = document["fields"]
+    dictionaries = document.get("dictionaries", {})
+    decoders = [dictionaries.get(name) for name in fields]
+    offers = [{} for _ in range(document["count"])]
+    for name, column, dictionary in zip(fields, document["columns"], decoders):
+        for offer, value in zip(offers, column):
+            offer[name] = dictionary[value] if dictionary is not None and value is not None else value
+    return offers
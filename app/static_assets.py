@@ -0,0 +1,116 @@
+# app/static_assets.py
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response, abort, request, send_file
+
+try:
+    import brotli # Optional; without it only .br files already in the build are served
+except ImportError:
+    brotli = None
+
+# Serves the React build from an in-memory manifest built once per worker: no filesystem
+# lookups per request, gzip/brotli variants chosen from Accept-Encoding, strong ETags, and
+# long-lived immutable caching for content-hashed files (e.g. static/js/main.3f2a1b9c.js).
+
+STATIC_PRECOMPRESS = os.getenv("STATIC_PRECOMPRESS", "true").lower() == "true"
+# Files that aren't content-hashed (logos, favicon, manifest.json) can change between deploys.
+STATIC_DEFAULT_MAX_AGE_SECONDS = int(os.getenv("STATIC_DEFAULT_MAX_AGE_SECONDS", "3600"))
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 3600
+
+_COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                       "image/svg+xml", "application/xml", "image/x-icon", "image/vnd.microsoft.icon")
+_MIN_COMPRESS_BYTES = 1024
+_HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.(?:chunk\.)?[a-z0-9]+$")
+
+
+def _is_compressible(mimetype):
+    return any(mimetype.startswith(t) for t in _COMPRESSIBLE_TYPES)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _entry_for(full_path, rel_path):
+    mimetype = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+    content = _read(full_path)
+    entry = {
+        "path": full_path,
+        "mimetype": mimetype,
+        "size": len(content),
+        "etag": hashlib.sha1(content).hexdigest()[:20],
+        "immutable": bool(_HASHED_NAME.search(rel_path)),
+        "encodings": {}, # "br"/"gzip" -> compressed bytes
+    }
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if os.path.isfile(full_path + suffix): # precompressed by the frontend build
+            entry["encodings"][encoding] = _read(full_path + suffix)
+    if STATIC_PRECOMPRESS and _is_compressible(mimetype) and len(content) >= _MIN_COMPRESS_BYTES:
+        if "gzip" not in entry["encodings"]:
+            entry["encodings"]["gzip"] = gzip.compress(content, compresslevel=9, mtime=0)
+        if "br" not in entry["encodings"] and brotli is not None:
+            entry["encodings"]["br"] = brotli.compress(content, quality=11)
+    # Only keep variants that actually save bytes.
+    entry["encodings"] = {k: v for k, v in entry["encodings"].items() if len(v) < len(content) * 0.9}
+    return entry
+
+
+def build_manifest(root):
+    """Maps every file under root (by URL path, e.g. "static/js/main.abc123.js") to its entry."""
+    manifest = {}
+    if not os.path.isdir(root):
+        print(f"Static Assets WARNING: Build directory {root} not found; only API routes will work.")
+        return manifest
+    total_bytes = compressed_bytes = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith((".gz", ".br")) and os.path.isfile(os.path.join(dirpath, filename[:-3])):
+                continue # served as a variant of the uncompressed file
+            full_path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(full_path, root).replace(os.sep, "/")
+            entry = manifest[rel_path] = _entry_for(full_path, rel_path)
+            total_bytes += entry["size"]
+            compressed_bytes += sum(len(v) for v in entry["encodings"].values())
+    print(f"Static Assets: Manifest built for {len(manifest)} files ({total_bytes // 1024} KiB, "
+          f"{compressed_bytes // 1024} KiB of compressed variants in memory).")
+    return manifest
+
+
+def _cache_control(rel_path, entry):
+    if entry["immutable"]:
+        return f"public, max-age={IMMUTABLE_MAX_AGE_SECONDS}, immutable"
+    if rel_path == "index.html":
+        return "no-cache" # always revalidate so new deploys pick up the new bundle names
+    return f"public, max-age={STATIC_DEFAULT_MAX_AGE_SECONDS}"
+
+
+def _preferred_encoding(entry):
+    for encoding in ("br", "gzip"):
+        if encoding in entry["encodings"] and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def serve_asset(manifest, path):
+    """Response for a static path; unknown paths get index.html so client-side routes work."""
+    rel_path = path if path in manifest else "index.html"
+    entry = manifest.get(rel_path)
+    if entry is None:
+        abort(404)
+
+    encoding = _preferred_encoding(entry)
+    if encoding:
+        response = Response(entry["encodings"][encoding], mimetype=entry["mimetype"])
+        response.headers["Content-Encoding"] = encoding
+        response.set_etag(f"{entry['etag']}-{encoding}")
+    else:
+        response = send_file(entry["path"], mimetype=entry["mimetype"], etag=entry["etag"], conditional=False)
+    if entry["encodings"]:
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = _cache_control(rel_path, entry)
+    return response.make_conditional(request)
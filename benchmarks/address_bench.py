@@ -0,0 +1,146 @@
+# benchmarks/address_bench.py
+"""
+Measures address canonicalization (app/services/address.py): throughput, and how much it
+raises the offer-cache hit rate on an address corpus compared with the previous key
+(fields trimmed, whitespace collapsed and lower-cased).
+
+The hit rate is simulated by replaying the corpus in order against an unbounded cache: an
+address is a hit if an earlier address produced the same key.
+
+Usage:
+    python benchmarks/address_bench.py                          # synthetic corpus of spelling variants
+    python benchmarks/address_bench.py --corpus searches.jsonl  # recorded addresses (CSV or JSONL, as for bulk_compare.py)
+    python benchmarks/address_bench.py --size 50000 --repeat 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+from app.services import address  # noqa: E402
+
+_SEED_ADDRESSES = [
+    ("Musterstraße", "10", "10115", "Berlin"),
+    ("Dr.-Müller-Straße", "4a", "01067", "Dresden"),
+    ("Sankt-Georg-Platz", "1", "60311", "Frankfurt am Main"),
+    ("Hauptstraße", "112", "80331", "München"),
+    ("Bahnhofstraße", "7", "50667", "Köln"),
+    ("Am Weißen Steinweg", "23", "04109", "Leipzig"),
+    ("Königsallee", "60", "40212", "Düsseldorf"),
+    ("Große Bleichen", "3 B", "20354", "Hamburg"),
+]
+
+
+def _variants(street, house_number, plz, city):
+    """Ways users actually type the same address."""
+    streets = [street, street.lower(), street.upper(), street + "  ", " " + street]
+    if street.endswith("straße"):
+        stem = street[:-len("straße")]
+        streets += [stem + "str.", stem + "str", stem + "strasse", stem + " Str.", stem + "-Straße"]
+    if street.startswith("Dr.-"):
+        streets += ["Doktor-" + street[4:], street.replace("-", " ")]
+    if street.startswith("Sankt-"):
+        streets += ["St. " + street[6:].replace("-", " "), "St.-" + street[6:]]
+    streets += [street.replace("ü", "ue").replace("ö", "oe").replace("ä", "ae").replace("ß", "ss")]
+    house_numbers = [house_number, house_number.upper(), " " + house_number + " "]
+    if house_number[-1:].isalpha():
+        house_numbers += [house_number[:-1] + " " + house_number[-1], house_number[:-1] + "-" + house_number[-1].upper()]
+    plzs = [plz, plz.lstrip("0"), " " + plz]
+    cities = [city, city.lower(), city.upper() + " "]
+    return streets, house_numbers, plzs, cities
+
+
+def synthetic_corpus(size, seed=24):
+    rng = random.Random(seed)
+    pools = [(_variants(*seed_address)) for seed_address in _SEED_ADDRESSES]
+    corpus = []
+    for _ in range(size):
+        streets, house_numbers, plzs, cities = rng.choice(pools)
+        corpus.append({
+            "strasse": rng.choice(streets), "hausnummer": rng.choice(house_numbers),
+            "postleitzahl": rng.choice(plzs), "stadt": rng.choice(cities),
+        })
+    return corpus
+
+
+def legacy_key(address_payload):
+    """The cache key used before canonicalization."""
+    return "|".join(
+        " ".join(str(address_payload.get(field) or "").split()).lower() for field in address.ADDRESS_FIELDS
+    )
+
+
+def canonical_key(address_payload):
+    return address.canonicalize_address(address_payload)[1]
+
+
+def hit_rate(corpus, key_func):
+    seen = set()
+    hits = 0
+    for address_payload in corpus:
+        key = key_func(address_payload)
+        if key in seen:
+            hits += 1
+        else:
+            seen.add(key)
+    return hits / len(corpus), len(seen)
+
+
+def _clear_caches():
+    for func in (address.street_key, address.house_number_key, address.city_key):
+        func.cache_clear()
+
+
+def throughput(corpus, repeat):
+    """(cold, warm) addresses per second; cold clears the per-field memo caches before each pass."""
+    results = {}
+    for label, clear in (("cold", True), ("warm", False)):
+        best = None
+        for _ in range(repeat):
+            if clear:
+                _clear_caches()
+            started = time.perf_counter()
+            for address_payload in corpus:
+                address.canonicalize_address(address_payload)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[label] = len(corpus) / best
+    return results["cold"], results["warm"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark address canonicalization")
+    parser.add_argument("--corpus", help="Recorded addresses (.csv or .jsonl); default: synthetic variants")
+    parser.add_argument("--size", type=int, default=500, help="Synthetic corpus size (default: 500)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing passes, best is reported (default: 3)")
+    args = parser.parse_args()
+
+    if args.corpus:
+        from bulk_compare import read_addresses
+        corpus_format = "csv" if args.corpus.lower().endswith(".csv") else "jsonl"
+        corpus = list(read_addresses(args.corpus, corpus_format))
+        source = args.corpus
+    else:
+        corpus = synthetic_corpus(args.size)
+        source = f"synthetic ({len(_SEED_ADDRESSES)} addresses in spelling variants)"
+    if not corpus:
+        sys.exit("Corpus is empty.")
+
+    cold, warm = throughput(corpus, args.repeat)
+    legacy_rate, legacy_keys = hit_rate(corpus, legacy_key)
+    canonical_rate, canonical_keys = hit_rate(corpus, canonical_key)
+
+    print(f"Corpus: {source}, {len(corpus)} addresses")
+    print(f"Throughput: {cold:,.0f} addr/s cold, {warm:,.0f} addr/s warm ({1e6 / warm:.2f} us/address)")
+    print(f"{'key':<12}{'distinct keys':>16}{'hit rate':>12}")
+    print(f"{'legacy':<12}{legacy_keys:>16}{legacy_rate:>12.1%}")
+    print(f"{'canonical':<12}{canonical_keys:>16}{canonical_rate:>12.1%}")
+    print(f"Hit rate change: {(canonical_rate - legacy_rate) * 100:+.1f} percentage points")
+
+
+if __name__ == '__main__':
+    main()
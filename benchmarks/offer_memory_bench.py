@@ -0,0 +1,118 @@
+# benchmarks/offer_memory_bench.py
+"""
+Measures the memory held per cached offer with and without the flyweight interning of repeating
+offer fields (app/services/interning.py).
+
+Offers are materialized the way the app holds them: each simulated search decodes a provider's
+cached result from an offer cache blob (offer_cache.encode_offers / decode_offers), and every
+decoded offer is kept in memory. The products come from a fixed synthetic catalog per provider,
+so like in production the same product names, benefits texts and IDs repeat across addresses.
+Memory is the tracemalloc growth while building the offers (the intern tables included),
+divided by the number of offers.
+
+Usage:
+    python benchmarks/offer_memory_bench.py                        # 100k and 250k offers
+    python benchmarks/offer_memory_bench.py --offers 500000 --catalog 2000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+from app.services import interning, offer_cache  # noqa: E402
+
+_PROVIDERS = ["ByteMe", "Ping Perfect", "Servus Speed", "VerbynDich", "WebWunder"]
+_CONNECTIONS = ["DSL", "Cable", "Fiber", "Mobile"]
+_TV = [None, None, "ByteMeTV Basic", "ServusFlix Pro Max Ultra", "WebWunder TV+"]
+_BENEFITS = [
+    "No specific benefits listed",
+    "Installation service included",
+    "Installation service included, Data limit: 200 GB/month",
+    "TV package: ServusFlix Pro Max Ultra, Data limit: 200 GB/month, Offer valid for customers up to 31 years old",
+    "Percentage voucher: 10%, Free router for the first 24 months",
+    "Absolute voucher: €50.00, Unlimited data, Installation service included",
+]
+_OFFERS_PER_SEARCH = 30 # one provider task's result
+
+
+def build_catalog(products_per_provider, seed=48):
+    rng = random.Random(seed)
+    catalog = {}
+    for provider in _PROVIDERS:
+        products = []
+        for i in range(products_per_provider):
+            speed = rng.choice([50, 100, 250, 350, 500, 1000])
+            products.append({
+                "providerName": provider,
+                "productName": f"{provider} {rng.choice(['Basic', 'Plus', 'Max', 'Extreme', 'Ultra'])} {speed}",
+                "downloadSpeedMbps": speed,
+                "uploadSpeedMbps": None,
+                "monthlyPriceEur": round(rng.uniform(19, 80), 2),
+                "monthlyPriceEurAfter2Years": round(rng.uniform(25, 95), 2),
+                "contractTermMonths": rng.choice([1, 12, 24]),
+                "connectionType": rng.choice(_CONNECTIONS),
+                "benefits": rng.choice(_BENEFITS),
+                "tv": rng.choice(_TV),
+                "discount": rng.choice([None, 5.0, 10.0]),
+                "discountType": rng.choice([None, "percentage", "absolute"]),
+                "installationServiceIncluded": rng.random() < 0.5,
+                "ageRestrictionMax": rng.choice([None, None, 27]),
+                "dataLimitGb": rng.choice([None, None, 100, 500]),
+                "_provider_specific_id": f"{provider[:2].lower()}-{i:06d}",
+            })
+        catalog[provider] = products
+    return catalog
+
+
+def cached_blobs(catalog, count, seed=48):
+    """Offer cache blobs of simulated searches, enough for `count` offers."""
+    rng = random.Random(seed)
+    blobs = []
+    total = 0
+    while total < count:
+        products = catalog[rng.choice(_PROVIDERS)]
+        offers = rng.sample(products, min(_OFFERS_PER_SEARCH, len(products), count - total))
+        blobs.append(offer_cache.encode_offers(offers))
+        total += len(offers)
+    return blobs
+
+
+def measure(blobs, intern_enabled):
+    """(offers held, bytes allocated) for decoding every blob and keeping the offers."""
+    interning.OFFER_INTERN_ENABLED = intern_enabled
+    for table in interning._tables.values():
+        table.clear()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [offer_cache.decode_offers(blob) for blob in blobs]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return sum(len(offers) for offers in held), used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory per cached offer with and without interning")
+    parser.add_argument("--offers", default="100000,250000", help="Comma-separated offer counts (default: 100000,250000)")
+    parser.add_argument("--catalog", type=int, default=500, help="Distinct products per provider (default: 500)")
+    args = parser.parse_args()
+
+    catalog = build_catalog(args.catalog)
+    print(f"catalog: {args.catalog} products x {len(_PROVIDERS)} providers, {_OFFERS_PER_SEARCH} offers per cached result")
+    print(f"{'offers':>10}{'plain B/offer':>16}{'interned B/offer':>18}{'saved':>8}{'plain MiB':>12}{'interned MiB':>14}")
+    for count in (int(c) for c in args.offers.split(",")):
+        blobs = cached_blobs(catalog, count)
+        held, plain = measure(blobs, intern_enabled=False)
+        _, interned = measure(blobs, intern_enabled=True)
+        print(f"{held:>10,}{plain / held:>16.0f}{interned / held:>18.0f}{1 - interned / plain:>8.0%}"
+              f"{plain / 2**20:>12.1f}{interned / 2**20:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
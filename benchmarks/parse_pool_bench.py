@@ -0,0 +1,117 @@
+# benchmarks/parse_pool_bench.py
+"""
+Shows the effect of the process-pool parsing stage (app/services/parse_pool.py) on a worker
+serving a mix of large and small responses.
+
+A thread pool stands in for the worker's request threads. Large requests parse a synthetic
+WebWunder SOAP response (--products products) through parse_pool.run_parse(), the way
+fetch_webwunder_offers does. Small requests do a short piece of CPU work typical of a cached
+search (serializing --small-offers offers). Both kinds are submitted interleaved, once with the
+parse pool disabled (everything parses in-thread) and once enabled. The benchmark reports
+throughput and the latency of the small requests, which are the ones slowed down by holding
+the GIL.
+
+Usage:
+    python benchmarks/parse_pool_bench.py
+    python benchmarks/parse_pool_bench.py --large 40 --small 800 --products 4000 --pool-workers 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+from app.services import parse_pool  # noqa: E402
+from app.services.webwunder_client import parse_webwunder_response  # noqa: E402
+
+
+def synthetic_soap_response(products, seed=49):
+    rng = random.Random(seed)
+    parts = [
+        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>'
+        '<ns2:Output xmlns:ns2="http://webwunder.gendev7.check24.fun/offerservice">'
+    ]
+    for i in range(products):
+        speed = rng.choice([50, 100, 250, 500, 1000])
+        monthly = rng.randint(1999, 7999)
+        parts.append(
+            f'<ns2:products><ns2:productId>{i}</ns2:productId><ns2:providerName>WebWunder</ns2:providerName>'
+            f'<ns2:productInfo name="WebWunder {rng.choice(["Basic", "Plus", "Max"])} {speed}">'
+            f'<ns2:speed>{speed}</ns2:speed><ns2:monthlyCostInCent>{monthly}</ns2:monthlyCostInCent>'
+            f'<ns2:monthlyCostInCentFrom25thMonth>{monthly + 1000}</ns2:monthlyCostInCentFrom25thMonth>'
+            f'<ns2:contractDurationInMonths>24</ns2:contractDurationInMonths>'
+            f'<ns2:connectionType>{rng.choice(["DSL", "CABLE", "FIBER"])}</ns2:connectionType>'
+            f'</ns2:productInfo></ns2:products>'
+        )
+    parts.append('</ns2:Output></soapenv:Body></soapenv:Envelope>')
+    return "".join(parts).encode("utf-8")
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_mix(payload, small_offers, large, small, threads):
+    """(wall seconds, small request latencies in ms) for one interleaved run."""
+    kinds = ["large"] * large + ["small"] * small
+    random.Random(7).shuffle(kinds)
+
+    def large_request():
+        offers = parse_pool.run_parse("WebWunder", parse_webwunder_response, payload, ("DSL",), size=len(payload))
+        assert offers, "synthetic response parsed to no offers"
+
+    def small_request(submitted):
+        json.dumps(small_offers)
+        return (time.perf_counter() - submitted) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = []
+        for kind in kinds:
+            if kind == "large":
+                executor.submit(large_request)
+            else:
+                futures.append(executor.submit(small_request, time.perf_counter()))
+        latencies = [f.result() for f in futures]
+    return time.perf_counter() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark in-thread vs process-pool parsing under a request mix")
+    parser.add_argument("--large", type=int, default=20, help="Large (WebWunder parse) requests (default: 20)")
+    parser.add_argument("--small", type=int, default=400, help="Small requests (default: 400)")
+    parser.add_argument("--products", type=int, default=3000, help="Products per large response (default: 3000)")
+    parser.add_argument("--small-offers", type=int, default=150, help="Offers serialized per small request (default: 150)")
+    parser.add_argument("--threads", type=int, default=16, help="Request threads (default: 16)")
+    parser.add_argument("--pool-workers", type=int, default=2, help="Parse processes (default: 2)")
+    args = parser.parse_args()
+
+    payload = synthetic_soap_response(args.products)
+    small_offers = [{"providerName": "ByteMe", "productName": f"Byte {i}", "monthlyPriceEur": 29.99, "benefits": "N/A"}
+                    for i in range(args.small_offers)]
+    parse_pool.PARSE_POOL_WORKERS = args.pool_workers
+    parse_pool.start() # warm processes, as create_app does
+
+    results = []
+    for label, enabled in (("in-thread", False), ("process pool", True)):
+        parse_pool.PARSE_POOL_ENABLED = enabled
+        results.append((label,) + run_mix(payload, small_offers, args.large, args.small, args.threads))
+    parse_pool.get_pool().shutdown()
+
+    # Printed at the end so the parser's log lines don't break up the table.
+    print(f"{args.large} large ({len(payload) / 1024:.0f} KiB, {args.products} products) + {args.small} small requests, "
+          f"{args.threads} threads, {args.pool_workers} parse processes, {os.cpu_count()} CPU(s)")
+    print(f"{'parsing':<14}{'wall s':>8}{'req/s':>8}{'small p50 ms':>14}{'small p99 ms':>14}{'small max ms':>14}")
+    for label, wall, latencies in results:
+        print(f"{label:<14}{wall:>8.2f}{(args.large + args.small) / wall:>8.0f}{_percentile(latencies, 0.5):>14.1f}"
+              f"{_percentile(latencies, 0.99):>14.1f}{max(latencies):>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
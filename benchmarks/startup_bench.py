@@ -0,0 +1,85 @@
+# benchmarks/startup_bench.py
+"""
+Measures worker startup cost: importing the app package, running create_app(),
+and the latency of the first /api/offers and /api/share/<id> requests.
+
+Each run happens in a fresh interpreter so import caches don't hide the real cost.
+Provider credentials are stripped from the environment (and the child skips .env, which
+would restore them), so the clients return immediately and the numbers reflect startup work rather than provider latency.
+
+Usage:
+    python benchmarks/startup_bench.py            # eager vs. lazy, 5 runs each
+    python benchmarks/startup_bench.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs inside the child interpreter and prints one JSON line of timings (milliseconds).
+_CHILD_SCRIPT = r"""
+import json, time
+t0 = time.perf_counter()
+import app as app_package
+t1 = time.perf_counter()
+flask_app = app_package.create_app()
+t2 = time.perf_counter()
+client = flask_app.test_client()
+address = {"strasse": "Musterstraße", "hausnummer": "10", "postleitzahl": "10115", "stadt": "Berlin"}
+client.post("/api/offers", json=address)
+t3 = time.perf_counter()
+client.post("/api/offers", json=address)
+t4 = time.perf_counter()
+client.get("/api/share/doesnotexist")
+t5 = time.perf_counter()
+print("BENCH " + json.dumps({
+    "import": (t1 - t0) * 1000,
+    "create_app": (t2 - t1) * 1000,
+    "first_offers_request": (t3 - t2) * 1000,
+    "second_offers_request": (t4 - t3) * 1000,
+    "first_share_request": (t5 - t4) * 1000,
+}))
+"""
+
+_CREDENTIAL_VARS = [
+    "BYTEME_API_KEY", "PING_PERFECT_CLIENT_ID", "PING_PERFECT_SIGNATURE_SECRET",
+    "SERVUS_SPEED_USERNAME", "SERVUS_SPEED_PASSWORD", "VERBYNDICH_API_KEY", "WEBWUNDER_API_KEY",
+]
+
+
+def _run_once(lazy):
+    env = {k: v for k, v in os.environ.items() if k not in _CREDENTIAL_VARS}
+    env["SKIP_DOTENV"] = "true"
+    env["LAZY_STARTUP"] = "true" if lazy else "false"
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    completed = subprocess.run(
+        [sys.executable, "-c", _CHILD_SCRIPT],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith("BENCH "):
+            return json.loads(line[len("BENCH "):])
+    raise RuntimeError(f"Benchmark child produced no timings. stderr: {completed.stderr[-500:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per mode (default: 5)")
+    args = parser.parse_args()
+
+    for lazy in (False, True):
+        samples = [_run_once(lazy) for _ in range(args.runs)]
+        print(f"\n--- LAZY_STARTUP={'true' if lazy else 'false'} ({args.runs} runs, median / max in ms) ---")
+        for phase in samples[0]:
+            values = [s[phase] for s in samples]
+            print(f"  {phase:<24} {statistics.median(values):8.1f} / {max(values):8.1f}")
+        ready = [s["import"] + s["create_app"] for s in samples]
+        print(f"  {'ready (import+create)':<24} {statistics.median(ready):8.1f} / {max(ready):8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/wire_format_bench.py
+"""
+Compares the compact columnar offer format (app/services/wire_format.py, ?format=compact)
+with the regular jsonify() response: body size (raw and gzip) and encode time.
+
+The offers are synthetic but shaped like the normalized offers of each provider client
+(same keys, similar benefits strings). Encode time is the best of --repeat passes; for the
+compact format it includes draining the streamed chunks.
+
+Usage:
+    python benchmarks/wire_format_bench.py                 # 150 offers (a typical search)
+    python benchmarks/wire_format_bench.py --offers 1000 --repeat 20
+    python benchmarks/wire_format_bench.py --fields providerName,productName,monthlyPriceEur
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask, jsonify  # noqa: E402
+
+from app.services import wire_format  # noqa: E402
+
+# Roughly what OfferCard.js renders
+CARD_FIELDS = [
+    "providerName", "productName", "downloadSpeedMbps", "monthlyPriceEur", "monthlyPriceEurAfter2Years",
+    "contractTermMonths", "connectionType", "benefits", "tv", "discount", "discountType",
+    "installationServiceIncluded", "ageRestrictionMax", "dataLimitGb",
+]
+
+_PROVIDERS = ["ByteMe", "Ping Perfect", "Servus Speed", "VerbynDich", "WebWunder"]
+_CONNECTIONS = ["DSL", "Cable", "Fiber", "Mobile"]
+_TV = [None, None, "ByteMeTV Basic", "ServusFlix Pro Max Ultra", "WebWunder TV+"]
+_BENEFITS = [
+    "No specific benefits listed",
+    "Installation service included, Max age 27",
+    "Percentage voucher: 10%, Free router for the first 24 months",
+    "Absolute voucher: €50.00, Unlimited data, Installation service included",
+]
+
+
+def synthetic_offers(count, seed=41):
+    rng = random.Random(seed)
+    offers = []
+    for i in range(count):
+        provider = rng.choice(_PROVIDERS)
+        speed = rng.choice([50, 100, 250, 500, 1000])
+        offer = {
+            "providerName": provider,
+            "productName": f"{provider} {rng.choice(['Basic', 'Plus', 'Max', 'Ultra'])} {speed}",
+            "downloadSpeedMbps": speed,
+            "uploadSpeedMbps": None,
+            "monthlyPriceEur": round(rng.uniform(19, 80), 2),
+            "monthlyPriceEurAfter2Years": round(rng.uniform(25, 95), 2),
+            "contractTermMonths": rng.choice([1, 12, 24]),
+            "connectionType": rng.choice(_CONNECTIONS),
+            "benefits": rng.choice(_BENEFITS),
+            "installationServiceIncluded": rng.random() < 0.5,
+            "ageRestrictionMax": rng.choice([None, None, 27]),
+            "dataLimitGb": rng.choice([None, None, 100, 500]),
+            "_provider_specific_id": f"{provider[:2].lower()}-{i:06d}",
+        }
+        if provider in ("ByteMe", "WebWunder"):
+            offer.update({"tv": rng.choice(_TV), "discount": rng.choice([None, 5.0, 10.0]),
+                          "discountType": rng.choice([None, "percentage", "absolute"])})
+        else:
+            offer["tvIncluded"] = rng.choice(_TV)
+        offers.append(offer)
+    return offers
+
+
+def _best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return body, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compact offer wire format against jsonify")
+    parser.add_argument("--offers", type=int, default=150, help="Offers per response (default: 150)")
+    parser.add_argument("--repeat", type=int, default=10, help="Timing passes, best is reported (default: 10)")
+    parser.add_argument("--fields", help="Projection to also measure (default: the fields OfferCard.js renders)")
+    args = parser.parse_args()
+
+    offers = synthetic_offers(args.offers)
+    fields = wire_format.parse_fields(args.fields) or CARD_FIELDS
+    app = Flask("wire_format_bench")
+
+    with app.app_context():
+        cases = [
+            ("jsonify", lambda: jsonify(offers).get_data()),
+            ("jsonify+fields", lambda: jsonify(wire_format.project(offers, fields)).get_data()),
+            ("compact", lambda: wire_format.encode_columnar(offers).encode("utf-8")),
+            ("compact+fields", lambda: wire_format.encode_columnar(offers, fields).encode("utf-8")),
+        ]
+        results = [(label,) + _best_time(func, args.repeat) for label, func in cases]
+
+    baseline_bytes = len(results[0][1])
+    baseline_time = results[0][2]
+    print(f"{args.offers} offers, projection: {len(fields)} fields, best of {args.repeat}")
+    print(f"{'format':<16}{'bytes':>10}{'gzip':>10}{'vs jsonify':>12}{'encode ms':>12}{'vs jsonify':>12}")
+    for label, body, elapsed in results:
+        print(f"{label:<16}{len(body):>10,}{len(gzip.compress(body, 6)):>10,}{len(body) / baseline_bytes:>12.0%}"
+              f"{elapsed * 1000:>12.3f}{elapsed / baseline_time:>12.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# bulk_compare.py
+"""
+Offline bulk comparison: streams addresses from a CSV or JSONL file, fetches offers through
+the same provider clients as the web app and writes one JSON line per address.
+
+    python bulk_compare.py addresses.csv -o offers.jsonl
+    python bulk_compare.py addresses.jsonl -o - --io-workers 64 --parse-workers 4
+
+CSV input needs a header row with strasse,hausnummer,postleitzahl,stadt (street,houseNumber,plz,city
+are accepted too); JSONL input has one address object per line.
+
+Provider calls run on a bounded thread pool. WebWunder XML and VerbynDich description parsing,
+normalization and ranking run on a process pool, so the CPU-heavy work doesn't contend for the GIL
+with the I/O threads. At most --window addresses are in the pipeline at once and results are written
+as soon as each address completes (in completion order, with its input "index"), so memory stays
+flat regardless of input size. Progress and throughput go to stderr.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+
+_FIELD_ALIASES = {
+    "strasse": ("strasse", "street"),
+    "hausnummer": ("hausnummer", "houseNumber", "house_number"),
+    "postleitzahl": ("postleitzahl", "plz", "zip"),
+    "stadt": ("stadt", "city"),
+    "land": ("land", "countryCode"),
+}
+
+
+def _address_from_record(record):
+    address = {}
+    for field, aliases in _FIELD_ALIASES.items():
+        for alias in aliases:
+            value = record.get(alias)
+            if value not in (None, ""):
+                address[field] = str(value).strip()
+                break
+    return address
+
+
+def read_addresses(path, input_format):
+    """Yields one address dict per input record without loading the file into memory."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if input_format == "csv":
+            for row in csv.DictReader(f):
+                yield _address_from_record(row)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield _address_from_record(json.loads(line))
+
+
+def _rank_key(offer):
+    price = offer.get("monthlyPriceEur")
+    speed = offer.get("downloadSpeedMbps") or 0
+    return (price is None, price if price is not None else 0, -speed)
+
+
+def parse_and_rank(index, address, fetched):
+    """
+    Process-pool stage: parses the raw WebWunder/VerbynDich payloads, merges every provider's
+    offers and ranks them by monthly price (cheapest first, then fastest).
+
+    :param fetched: {task name: (parse function or None, parse args, payload)} where payload None
+                    means the call failed.
+    """
+    offers = []
+    providers = {}
+    for task_name, (parse, parse_args, payload) in fetched.items():
+        if payload is not None and parse is not None:
+            payload = parse(payload, *parse_args)
+        if isinstance(payload, list):
+            offers.extend(payload)
+            providers[task_name] = {"status": "ok" if payload else "empty", "count": len(payload)}
+        else:
+            providers[task_name] = {"status": "error", "count": 0}
+    offers.sort(key=_rank_key)
+    return {"index": index, "address": address, "offers": offers, "providers": providers}
+
+
+def _safe_call(func, args):
+    try:
+        return func(*args)
+    except Exception as e:
+        print(f"Bulk Compare ERROR: {getattr(func, '__name__', func)} raised: {e}")
+        return None
+
+
+def run(args, output):
+    io_pool = ThreadPoolExecutor(max_workers=args.io_workers, thread_name_prefix="bulk-io")
+    parse_pool = ProcessPoolExecutor(max_workers=args.parse_workers)
+    from app.services.providers import build_tasks
+
+    in_flight = {} # index -> {"address", "io": {future: task}, "parse": future or None}
+    addresses = iter(read_addresses(args.input, args.format))
+    exhausted = False
+    started = time.monotonic()
+    last_report = started
+    next_index = done = total_offers = failed_addresses = 0
+
+    def report(final=False):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        label = "Done" if final else "Progress"
+        print(f"Bulk Compare {label}: {done} addresses in {elapsed:.1f}s ({done / elapsed:.2f} addr/s), "
+              f"{total_offers} offers, {len(in_flight)} in flight.", file=sys.stderr)
+
+    try:
+        while True:
+            while not exhausted and len(in_flight) < args.window:
+                try:
+                    address = next(addresses)
+                except StopIteration:
+                    exhausted = True
+                    break
+                index, next_index = next_index, next_index + 1
+                io_futures = {
+                    io_pool.submit(_safe_call, task["func"], task["args"]): task
+                    for task in build_tasks(address, raw=True)
+                }
+                in_flight[index] = {"address": address, "io": io_futures, "parse": None}
+            if not in_flight:
+                break
+
+            waiting_on = []
+            for index, entry in list(in_flight.items()):
+                if entry["parse"] is None and all(f.done() for f in entry["io"]):
+                    fetched = {
+                        task["name"]: (task.get("parse"), task.get("parse_args", ()), f.result())
+                        for f, task in entry["io"].items()
+                    }
+                    entry["io"] = {} # release raw payloads in this process
+                    entry["parse"] = parse_pool.submit(parse_and_rank, index, entry["address"], fetched)
+                if entry["parse"] is not None and entry["parse"].done():
+                    del in_flight[index]
+                    try:
+                        line = entry["parse"].result()
+                        total_offers += len(line["offers"])
+                        done += 1
+                    except Exception as e:
+                        line = {"index": index, "address": entry["address"], "error": str(e)}
+                        failed_addresses += 1
+                    output.write(json.dumps(line, ensure_ascii=False) + "\n")
+                    continue
+                waiting_on.extend(f for f in entry["io"] if not f.done())
+                if entry["parse"] is not None:
+                    waiting_on.append(entry["parse"])
+
+            if time.monotonic() - last_report >= args.progress_every:
+                output.flush()
+                report()
+                last_report = time.monotonic()
+            if waiting_on and (exhausted or len(in_flight) >= args.window):
+                wait(waiting_on, timeout=args.progress_every, return_when=FIRST_COMPLETED)
+    finally:
+        io_pool.shutdown(wait=True)
+        parse_pool.shutdown(wait=True)
+        output.flush()
+    report(final=True)
+    return failed_addresses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Addresses file (.csv or .jsonl)")
+    parser.add_argument("-o", "--output", default="offers.jsonl", help="Output JSONL file, '-' for stdout (default: offers.jsonl)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format (default: from the file extension)")
+    parser.add_argument("--io-workers", type=int, default=32, help="Concurrent provider calls (default: 32)")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 2, help="Parsing processes (default: CPU count)")
+    parser.add_argument("--window", type=int, default=64, help="Max addresses in the pipeline at once (default: 64)")
+    parser.add_argument("--progress-every", type=float, default=5.0, help="Seconds between progress lines (default: 5)")
+    args = parser.parse_args()
+    if args.format is None:
+        args.format = "csv" if args.input.lower().endswith(".csv") else "jsonl"
+
+    # Clients read their credentials at import time, so load .env first.
+    dotenv_path = os.path.join(PROJECT_ROOT, ".env")
+    if os.path.exists(dotenv_path):
+        load_dotenv(dotenv_path)
+
+    if args.output == "-":
+        # Client log lines go to stderr so stdout carries only JSONL.
+        output = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            failed = run(args, output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as output:
+            failed = run(args, output)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
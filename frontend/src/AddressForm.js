@@ -1,5 +1,5 @@
 // src/AddressForm.js
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   Box,
   FormControl,
@@ -14,6 +14,13 @@ import {
 
 // No localStorage key needed here; App.js will manage address persistence related to searches.
 
+// Once the address looks complete and the user pauses typing, the backend starts fetching offers
+// for it (POST /api/prefetch), so the search after submit finds them cached or already running.
+const PREFETCH_DEBOUNCE_MS = 800;
+
+const isCompleteAddress = (strasse, hausnummer, postleitzahl, stadt) =>
+  strasse.trim() !== '' && hausnummer.trim() !== '' && /^\d{5}$/.test(postleitzahl.trim()) && stadt.trim() !== '';
+
 function AddressForm({ onSubmitAddress, isLoading, currentAddress }) { // Renamed prop from initialValues
   const [strasse, setStrasse] = useState('');
   const [hausnummer, setHausnummer] = useState('');
@@ -21,6 +28,7 @@ function AddressForm({ onSubmitAddress, isLoading, currentAddress }) { // Rename
   const [stadt, setStadt] = useState('');
   const land = 'DE'; // Kept as constant
   const [error, setError] = useState('');
+  const lastPrefetchRef = useRef({ key: null, id: null });
 
   // Effect to pre-fill form fields when the 'currentAddress' prop (from App.js) changes.
   // This happens on initial load if localStorage has data, or if App.js updates it.
@@ -42,6 +50,38 @@ function AddressForm({ onSubmitAddress, isLoading, currentAddress }) { // Rename
     }
   }, [currentAddress]); // Re-run ONLY if currentAddress prop changes
 
+  // Debounced speculative prefetch. Each new prefetch replaces (cancels) this form's previous one.
+  useEffect(() => {
+    if (isLoading || !isCompleteAddress(strasse, hausnummer, postleitzahl, stadt)) {
+      return undefined;
+    }
+    const address = { strasse, hausnummer, postleitzahl, stadt, land };
+    const key = JSON.stringify(address);
+    if (key === lastPrefetchRef.current.key) {
+      return undefined;
+    }
+    const timer = setTimeout(async () => {
+      const previousId = lastPrefetchRef.current.id;
+      lastPrefetchRef.current = { key, id: null };
+      try {
+        const response = await fetch('/api/prefetch', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(previousId ? { ...address, replaces: previousId } : address),
+        });
+        if (response.ok) {
+          const data = await response.json();
+          if (lastPrefetchRef.current.key === key) {
+            lastPrefetchRef.current.id = data.prefetchId;
+          }
+        }
+      } catch (e) {
+        // Best effort only; the search works the same without it.
+      }
+    }, PREFETCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [strasse, hausnummer, postleitzahl, stadt, land, isLoading]);
+
   const handleSubmit = (event) => {
     // console.log("AddressForm: handleSubmit triggered!");
     event.preventDefault();
@@ -27,6 +27,7 @@ import {
 import AddressForm from './AddressForm';
 import OfferList from './OfferList';
 import SharedResultsPage from './SharedResultsPage'; // Ensure this path is correct
+import { decodeCompactOffers } from './compactOffers';
 
 const LOCAL_STORAGE_ADDRESS_KEY = 'lastSearchAddress';
 const LOCAL_STORAGE_LAST_RESULTS_KEY = 'lastSearchResults';
@@ -47,11 +48,21 @@ const getUniqueValues = (offers, key) => {
   });
 };
 
+// --- Helper: Provider tasks that failed in a search response (X-Failed-Providers header) ---
+const parseFailedProviders = (response) => {
+  const header = response.headers.get('X-Failed-Providers');
+  return header ? header.split(',').filter(Boolean) : [];
+};
+
 function App() {
   const [offers, setOffers] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
   const [hasSearched, setHasSearched] = useState(false);
+  // Result set of the last search and the provider tasks that failed in it (retryable individually)
+  const [resultSetId, setResultSetId] = useState(null);
+  const [failedProviders, setFailedProviders] = useState([]);
+  const [isRetrying, setIsRetrying] = useState(false);
 
   const [sortBy, setSortBy] = useState('');
   const [filterConnectionTypes, setFilterConnectionTypes] = useState([]);
@@ -117,10 +128,12 @@ function App() {
     
     // Clear previous offers before fetching new ones to avoid flicker of old data if fetch is slow
     setOffers([]); 
+    setResultSetId(null);
+    setFailedProviders([]);
 
     try {
       const jsonBody = JSON.stringify(addressDetailsFromForm);
-      const response = await fetch('/api/offers', { 
+      const response = await fetch('/api/offers?format=compact', { 
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: jsonBody,
@@ -136,8 +149,10 @@ function App() {
         localStorage.removeItem(LOCAL_STORAGE_LAST_RESULTS_KEY); // Clear stored results on error
         throw new Error(errorData.message || `HTTP error! Status: ${response.status}`);
       }
-      const data = await response.json();
+      const data = decodeCompactOffers(await response.json());
       setOffers(data); // Set new offers
+      setResultSetId(response.headers.get('X-Result-Set-Id'));
+      setFailedProviders(parseFailedProviders(response));
 
       // Save successful search results to localStorage (including reset filters/sort for this new search)
       try {
@@ -165,6 +180,29 @@ function App() {
     }
   }, []); // Dependencies are empty as we manage internal state explicitly or it's reset.
 
+  // Re-runs only the providers that failed or timed out and merges their offers into the results
+  const handleRetryFailedProviders = useCallback(async () => {
+    if (!resultSetId) return;
+    setIsRetrying(true);
+    try {
+      const response = await fetch(`/api/offers/${resultSetId}/retry`, { method: 'POST' });
+      if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
+      const data = await response.json();
+      setOffers(data.offers);
+      setFailedProviders(parseFailedProviders(response));
+      try {
+        const storedResults = JSON.parse(localStorage.getItem(LOCAL_STORAGE_LAST_RESULTS_KEY) || '{}');
+        localStorage.setItem(LOCAL_STORAGE_LAST_RESULTS_KEY, JSON.stringify({ ...storedResults, offers: data.offers }));
+      } catch (e) {
+        console.error("App.js: Error saving retried results to localStorage", e);
+      }
+    } catch (err) {
+      console.error("handleRetryFailedProviders: Retry failed:", err);
+    } finally {
+      setIsRetrying(false);
+    }
+  }, [resultSetId]);
+
   // Effect to save filter/sort changes to localStorage
   useEffect(() => {
     // Only save if a search has been made and there are offers to apply filters to
@@ -332,6 +370,16 @@ function App() {
       {isLoading && ( <Box textAlign="center" mt={10}> <Spinner size="xl" color="teal.500" /> <Heading as="h3" size="md" mt={4}>Fetching offers...</Heading> </Box> )}
       {error && ( <Alert status="error" mt={6} variant="solid"> <AlertIcon /> {error} </Alert> )}
       
+      {!isLoading && !error && hasSearched && failedProviders.length > 0 && resultSetId && (
+        <Alert status="warning" mt={6} variant="subtle">
+          <AlertIcon />
+          <Text flex="1" fontSize="sm">Some providers did not respond: {failedProviders.join(', ')}</Text>
+          <ChakraButton size="sm" colorScheme="orange" onClick={handleRetryFailedProviders} isLoading={isRetrying}>
+            Retry these providers
+          </ChakraButton>
+        </Alert>
+      )}
+
       {!isLoading && !error && hasSearched && (
         <Box mt={6}>
           <HStack justifyContent="space-between" alignItems="center" mb={4}>
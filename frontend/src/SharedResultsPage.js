@@ -3,6 +3,7 @@ import React, { useState, useEffect } from 'react';
 import { useParams, Link as RouterLink } from 'react-router-dom';
 import { Box, Heading, Spinner, Alert, AlertIcon, VStack, Button as ChakraButton, Text } from '@chakra-ui/react';
 import OfferList from './OfferList'; // Reuse your OfferList component
+import { decodeCompactOffers } from './compactOffers';
 
 function SharedResultsPage() {
   const { shareId } = useParams(); // Get shareId from URL
@@ -21,14 +22,14 @@ function SharedResultsPage() {
       setIsLoading(true);
       setError(null);
       try {
-        const response = await fetch(`/api/share/${shareId}`); // Use correct backend port
+        const response = await fetch(`/api/share/${shareId}?format=compact`); // Use correct backend port
         if (!response.ok) {
           let errorData;
           try { errorData = await response.json(); }
           catch (e) { errorData = { message: `HTTP error! Status: ${response.status}` }; }
           throw new Error(errorData.message || `HTTP error! Status: ${response.status}`);
         }
-        const data = await response.json();
+        const data = decodeCompactOffers(await response.json());
         setOffers(data);
       } catch (err) {
         setError(err.message || "Failed to load shared offers.");
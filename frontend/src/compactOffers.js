@@ -0,0 +1,16 @@
+// src/compactOffers.js
+// Decodes the columnar offer format the API returns for ?format=compact
+// (see app/services/wire_format.py) back into an array of offer objects.
+export const decodeCompactOffers = (doc) => {
+  const offers = Array.from({ length: doc.count }, () => ({}));
+  const dictionaries = doc.dictionaries || {};
+  doc.fields.forEach((field, i) => {
+    const column = doc.columns[i];
+    const dictionary = dictionaries[field];
+    for (let row = 0; row < doc.count; row++) {
+      const value = column[row];
+      offers[row][field] = dictionary && value !== null ? dictionary[value] : value;
+    }
+  });
+  return offers;
+};